@@ -0,0 +1,597 @@
+"""
+Batch API
+OpenAI-compatible /v1/files and /v1/batches: JSONL chat requests run in the
+background on their own concurrency budget, with progress persisted to disk
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from scheduler import SchedulerRejected
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = 24 * 3600
+TERMINAL_STATUSES = {"failed", "completed", "expired", "cancelled"}
+
+# Ids become file names, so anything else is rejected before touching disk
+_FILE_ID = re.compile(r"file-[0-9a-f]{24}")
+_BATCH_ID = re.compile(r"batch_[0-9a-f]{24}")
+
+# Seconds between progress writes while a batch runs
+PROGRESS_INTERVAL = 1.0
+# Attempts per request when admission control pushes back
+MAX_ATTEMPTS = 5
+
+
+class BatchError(RuntimeError):
+    """A files/batches call that cannot be served (bad input, unknown id)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _Interrupted(Exception):
+    """The server is shutting down; the request will run again after a restart"""
+
+
+def default_data_dir() -> Path:
+    data_home = os.getenv("XDG_DATA_HOME") or Path.home() / ".local" / "share"
+    return Path(data_home) / "claude-wrapper"
+
+
+def owner_id(api_key: Optional[str]) -> Optional[str]:
+    """Owner recorded on files and batches: a digest of the API key, never the key itself
+
+    None when authentication is off; such objects are visible to every caller.
+    """
+    if not api_key:
+        return None
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+# Stored with files and batches but never returned by the API
+_PRIVATE_FIELDS = ("owner", "rate_limit_key")
+
+
+def _public(record: Dict[str, Any]) -> Dict[str, Any]:
+    """API view of a stored file or batch"""
+    return {key: value for key, value in record.items() if key not in _PRIVATE_FIELDS}
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    """Replace path atomically so readers never see a partial document"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class FileStore:
+    """Uploaded and generated files: content plus a JSON metadata sidecar"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def content_path(self, file_id: str) -> Path:
+        return self.directory / f"{file_id}.data"
+
+    def _meta_path(self, file_id: str) -> Path:
+        return self.directory / f"{file_id}.json"
+
+    def _register(self, file_id: str, filename: str, purpose: str, owner: Optional[str]) -> Dict[str, Any]:
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": self.content_path(file_id).stat().st_size,
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "owner": owner,
+        }
+        _write_json(self._meta_path(file_id), meta)
+        return _public(meta)
+
+    async def create(
+        self,
+        read: Callable[[int], Awaitable[bytes]],
+        filename: str,
+        purpose: str,
+        max_bytes: int,
+        owner: Optional[str]
+    ) -> Dict[str, Any]:
+        """Store an upload chunk by chunk, refusing it once it exceeds max_bytes"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        path = self.content_path(file_id)
+        size = 0
+        try:
+            with open(path, "wb") as out:
+                while True:
+                    chunk = await read(1 << 20)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise BatchError(f"File exceeds the {max_bytes} byte limit", status_code=413)
+                    out.write(chunk)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return self._register(file_id, filename, purpose, owner)
+
+    def adopt(self, source: Path, filename: str, purpose: str, owner: Optional[str]) -> Dict[str, Any]:
+        """Publish a file produced on the server (batch output) without copying it"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        try:
+            os.link(source, self.content_path(file_id))
+        except OSError:
+            shutil.copyfile(source, self.content_path(file_id))
+        return self._register(file_id, filename, purpose, owner)
+
+    def _load(self, file_id: str) -> Optional[Dict[str, Any]]:
+        if not _FILE_ID.fullmatch(file_id):
+            return None
+        try:
+            return json.loads(self._meta_path(file_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def get(self, file_id: str, owner: Optional[str]) -> Optional[Dict[str, Any]]:
+        """File metadata, or None if it does not exist or belongs to another owner"""
+        meta = self._load(file_id)
+        if meta is None or meta.get("owner") != owner:
+            return None
+        return _public(meta)
+
+    def list(self, owner: Optional[str], purpose: Optional[str] = None) -> List[Dict[str, Any]]:
+        files = []
+        for meta_path in self.directory.glob("file-*.json"):
+            meta = self.get(meta_path.stem, owner)
+            if meta and (purpose is None or meta["purpose"] == purpose):
+                files.append(meta)
+        return sorted(files, key=lambda f: f["created_at"], reverse=True)
+
+    def delete(self, file_id: str, owner: Optional[str]) -> bool:
+        if self.get(file_id, owner) is None:
+            return False
+        self._meta_path(file_id).unlink(missing_ok=True)
+        self.content_path(file_id).unlink(missing_ok=True)
+        return True
+
+
+class BatchManager:
+    """Runs batches in background tasks and keeps their state on disk
+
+    Each batch directory holds batch.json plus output.jsonl/errors.jsonl,
+    appended one line per finished request. After a restart, requests whose
+    custom_id already appears there are skipped. A batch is run by whichever
+    process holds its flock, so gunicorn workers never run it twice. Each
+    request is charged to the submitting caller's rate limit (rate_limit,
+    e.g. RateLimiter.check) and waits while that limit is exhausted.
+    """
+
+    def __init__(
+        self,
+        files: FileStore,
+        directory: Path,
+        get_client: Callable[[], Optional[Any]],
+        request_model: Any,
+        concurrency: int = 2,
+        max_requests: int = 50000,
+        priority: Optional[str] = None,
+        rate_limit: Optional[Callable[[str], Awaitable[Any]]] = None,
+    ):
+        self.files = files
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._get_client = get_client
+        # ChatCompletionRequest, so batch lines are validated like live requests
+        self.request_model = request_model
+        self.concurrency = max(1, concurrency)
+        self.max_requests = max_requests
+        self.priority = priority
+        self.rate_limit = rate_limit
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Batches this process is running, kept current between progress writes
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._stopping = False
+
+    def _dir(self, batch_id: str) -> Path:
+        return self.directory / batch_id
+
+    def _load(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if not _BATCH_ID.fullmatch(batch_id):
+            return None
+        try:
+            return json.loads((self._dir(batch_id) / "batch.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, batch: Dict[str, Any]):
+        _write_json(self._dir(batch["id"]) / "batch.json", batch)
+
+    def _cancel_requested(self, batch_id: str) -> bool:
+        # A marker file, so a cancel reaches the runner in any worker process
+        return (self._dir(batch_id) / "cancel").exists()
+
+    def _cancelling_at(self, batch_id: str) -> Optional[int]:
+        try:
+            return int((self._dir(batch_id) / "cancel").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _view(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        if batch["status"] not in TERMINAL_STATUSES and self._cancel_requested(batch["id"]):
+            return _public({**batch, "status": "cancelling", "cancelling_at": self._cancelling_at(batch["id"])})
+        return _public(batch)
+
+    async def start(self):
+        """Resume every batch left unfinished by a previous run"""
+        resumed = 0
+        for path in self.directory.glob("batch_*/batch.json"):
+            batch = self._load(path.parent.name)
+            if batch and batch["status"] not in TERMINAL_STATUSES:
+                self._spawn(batch["id"])
+                resumed += 1
+        if resumed:
+            logger.info(f"🔁 Resuming {resumed} unfinished batch(es)")
+
+    def stop(self):
+        """Start no new requests; those in flight still finish and are recorded"""
+        self._stopping = True
+
+    async def close(self):
+        self.stop()
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, batch_id: str):
+        if self._stopping or batch_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(batch_id))
+        self._tasks[batch_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(batch_id, None))
+
+    def create(
+        self,
+        input_file_id: str,
+        endpoint: str,
+        owner: Optional[str],
+        completion_window: str = "24h",
+        metadata: Optional[Dict[str, str]] = None,
+        rate_limit_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        if endpoint != BATCH_ENDPOINT:
+            raise BatchError(f"Unsupported endpoint {endpoint!r}; only {BATCH_ENDPOINT} is available")
+        if completion_window != "24h":
+            raise BatchError("completion_window must be '24h'")
+        input_file = self.files.get(input_file_id, owner)
+        if input_file is None:
+            raise BatchError(f"No such file: {input_file_id}", status_code=404)
+        if input_file["purpose"] != "batch":
+            raise BatchError(f"File {input_file_id} was not uploaded with purpose 'batch'")
+
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + COMPLETION_WINDOW,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "expired_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+            "owner": owner,
+            "rate_limit_key": rate_limit_key,
+        }
+        self._dir(batch["id"]).mkdir(parents=True)
+        self._save(batch)
+        self._spawn(batch["id"])
+        logger.info(f"✅ Batch {batch['id']} created from {input_file_id}")
+        return _public(batch)
+
+    def get(self, batch_id: str, owner: Optional[str]) -> Dict[str, Any]:
+        batch = self._active.get(batch_id) or self._load(batch_id)
+        # Another owner's batch is reported exactly like a missing one
+        if batch is None or batch.get("owner") != owner:
+            raise BatchError(f"No such batch: {batch_id}", status_code=404)
+        if batch["status"] not in TERMINAL_STATUSES:
+            # Picks the batch up if the worker that ran it has gone away
+            self._spawn(batch_id)
+        return self._view(batch)
+
+    def list(self, owner: Optional[str], limit: int = 20, after: Optional[str] = None) -> Dict[str, Any]:
+        batches = []
+        for path in self.directory.glob("batch_*/batch.json"):
+            batch = self._active.get(path.parent.name) or self._load(path.parent.name)
+            if batch and batch.get("owner") == owner:
+                batches.append(self._view(batch))
+        batches.sort(key=lambda b: (b["created_at"], b["id"]), reverse=True)
+        if after:
+            ids = [b["id"] for b in batches]
+            batches = batches[ids.index(after) + 1:] if after in ids else []
+        page = batches[:max(1, min(limit, 100))]
+        return {
+            "object": "list",
+            "data": page,
+            "first_id": page[0]["id"] if page else None,
+            "last_id": page[-1]["id"] if page else None,
+            "has_more": len(batches) > len(page),
+        }
+
+    def cancel(self, batch_id: str, owner: Optional[str]) -> Dict[str, Any]:
+        batch = self.get(batch_id, owner)
+        if batch["status"] in TERMINAL_STATUSES:
+            raise BatchError(f"Batch {batch_id} is already {batch['status']}", status_code=409)
+        if not self._cancel_requested(batch_id):
+            (self._dir(batch_id) / "cancel").write_text(str(int(time.time())))
+            logger.info(f"🛑 Cancelling batch {batch_id}")
+        return self._view(batch)
+
+    def _scan_input(self, batch: Dict[str, Any]) -> Tuple[List[Tuple[str, int]], List[Dict[str, Any]]]:
+        """Validate the input file; returns each request's (custom_id, byte offset) and line errors
+
+        Blocking: runs in a worker thread. Requests are parsed again one at a
+        time as they run (_read_request), so the file is never held in memory.
+        """
+        requests: List[Tuple[str, int]] = []
+        errors: List[Dict[str, Any]] = []
+        seen: Set[str] = set()
+
+        def error(line: int, code: str, message: str):
+            errors.append({"code": code, "message": message, "param": None, "line": line})
+
+        offset = 0
+        with open(self.files.content_path(batch["input_file_id"]), "rb") as source:
+            for line_no, raw in enumerate(source, 1):
+                line_offset, offset = offset, offset + len(raw)
+                if not raw.strip():
+                    continue
+                try:
+                    item = json.loads(raw)
+                    custom_id = item["custom_id"]
+                    body = item["body"]
+                except (ValueError, KeyError, TypeError):
+                    error(line_no, "invalid_json_line", "Each line must be a JSON object with custom_id and body")
+                    continue
+                if item.get("method", "POST") != "POST" or item.get("url", batch["endpoint"]) != batch["endpoint"]:
+                    error(line_no, "mismatched_endpoint", f"Requests must be POST {batch['endpoint']}")
+                    continue
+                if custom_id in seen:
+                    error(line_no, "duplicate_custom_id", f"Duplicate custom_id {custom_id!r}")
+                    continue
+                try:
+                    request = self.request_model(**body)
+                except ValidationError as e:
+                    first = e.errors()[0]
+                    error(line_no, "invalid_request", f"body.{'.'.join(map(str, first['loc']))}: {first['msg']}")
+                    continue
+                except TypeError:
+                    error(line_no, "invalid_request", "body must be a JSON object")
+                    continue
+                if request.stream:
+                    error(line_no, "invalid_request", "stream is not supported in batches")
+                    continue
+                seen.add(str(custom_id))
+                requests.append((str(custom_id), line_offset))
+
+        if not requests and not errors:
+            error(0, "empty_file", "The input file contains no requests")
+        if len(requests) > self.max_requests:
+            error(0, "too_many_requests", f"A batch may hold at most {self.max_requests} requests")
+        return requests, errors
+
+    def _read_request(self, source: BinaryIO, offset: int) -> Any:
+        """Parse the request on the input line at offset (already validated by _scan_input)"""
+        source.seek(offset)
+        return self.request_model(**json.loads(source.readline())["body"])
+
+    def _recover(self, path: Path) -> Set[str]:
+        """custom_ids recorded in a result file, dropping a line torn by a crash (blocking)"""
+        done: Set[str] = set()
+        if not path.exists():
+            return done
+        good = 0
+        with open(path, "rb+") as results:
+            for raw in results:
+                try:
+                    done.add(json.loads(raw)["custom_id"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                good += len(raw)
+            results.truncate(good)
+        return done
+
+    async def _run(self, batch_id: str):
+        """Own the batch (if no other process does) and drive it to a terminal state"""
+        batch_dir = self._dir(batch_id)
+        lock_fd = os.open(batch_dir / "lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            return
+
+        try:
+            batch = self._load(batch_id)
+            if batch is None or batch["status"] in TERMINAL_STATUSES:
+                return
+            self._active[batch_id] = batch
+
+            requests, errors = await asyncio.to_thread(self._scan_input, batch)
+            if batch["status"] == "validating":
+                if errors:
+                    batch["status"] = "failed"
+                    batch["failed_at"] = int(time.time())
+                    batch["errors"] = {"object": "list", "data": errors[:100]}
+                    self._save(batch)
+                    logger.warning(f"⚠️ Batch {batch_id} failed validation: {errors[0]['message']}")
+                    return
+                batch["status"] = "in_progress"
+                batch["in_progress_at"] = int(time.time())
+                batch["request_counts"]["total"] = len(requests)
+                self._save(batch)
+
+            outcome = await self._execute(batch, requests)
+            if outcome is not None:
+                self._finalize(batch, outcome)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Batch {batch_id} stopped: {e}")
+        finally:
+            self._active.pop(batch_id, None)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+    async def _execute(self, batch: Dict[str, Any], requests: List[Tuple[str, int]]) -> Optional[str]:
+        """Run outstanding requests; returns the final status, or None if interrupted"""
+        batch_id = batch["id"]
+        output_path = self._dir(batch_id) / "output.jsonl"
+        errors_path = self._dir(batch_id) / "errors.jsonl"
+        completed = await asyncio.to_thread(self._recover, output_path)
+        failed = await asyncio.to_thread(self._recover, errors_path)
+        counts = batch["request_counts"]
+        counts["completed"], counts["failed"] = len(completed), len(failed)
+        pending: Iterator[Tuple[str, int]] = (
+            (custom_id, offset) for custom_id, offset in requests
+            if custom_id not in completed and custom_id not in failed
+        )
+        if counts["completed"] + counts["failed"]:
+            logger.info(f"🔁 Batch {batch_id}: {counts['completed'] + counts['failed']} of {counts['total']} already done")
+
+        last_saved = time.monotonic()
+        interrupted = False
+
+        input_path = self.files.content_path(batch["input_file_id"])
+        with open(input_path, "rb") as source, open(output_path, "a") as output, open(errors_path, "a") as errors:
+            async def worker():
+                nonlocal last_saved, interrupted
+                # The generator is shared, so each request is handed out once
+                for custom_id, offset in pending:
+                    if self._stopping or interrupted:
+                        interrupted = True
+                        return
+                    if self._cancel_requested(batch_id) or time.time() > batch["expires_at"]:
+                        return
+                    try:
+                        record, ok = await self._run_request(
+                            custom_id, self._read_request(source, offset), batch.get("rate_limit_key")
+                        )
+                    except _Interrupted:
+                        interrupted = True
+                        return
+                    target = output if ok else errors
+                    target.write(json.dumps(record) + "\n")
+                    target.flush()
+                    counts["completed" if ok else "failed"] += 1
+                    if time.monotonic() - last_saved >= PROGRESS_INTERVAL:
+                        last_saved = time.monotonic()
+                        self._save(batch)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        self._save(batch)
+        if interrupted:
+            logger.info(f"⏸️ Batch {batch_id} paused at {counts['completed'] + counts['failed']}/{counts['total']}")
+            return None
+        if self._cancel_requested(batch_id):
+            return "cancelled"
+        if counts["completed"] + counts["failed"] < counts["total"]:
+            return "expired"
+        return "completed"
+
+    async def _charge(self, rate_limit_key: str):
+        """Count one request against the submitter's rate limit, waiting while it is exhausted"""
+        while True:
+            if self._stopping:
+                raise _Interrupted()
+            result = await self.rate_limit(rate_limit_key)
+            if result.allowed:
+                return
+            # The sliding window frees capacity gradually, so look again soon
+            await asyncio.sleep(min(result.reset_after, 1.0))
+
+    async def _run_request(
+        self,
+        custom_id: str,
+        request: Any,
+        rate_limit_key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """One chat completion as a batch output line; retried while the server is busy"""
+        if self.rate_limit is not None and rate_limit_key:
+            await self._charge(rate_limit_key)
+        request_id = f"batch_req_{uuid.uuid4().hex[:24]}"
+        status_code, body = 500, None
+        for attempt in range(MAX_ATTEMPTS):
+            client = self._get_client()
+            if client is None or client.draining or self._stopping:
+                raise _Interrupted()
+            try:
+                body = await client.chat_completion(request, priority=self.priority)
+                status_code = 200
+                break
+            except SchedulerRejected as e:
+                if client.draining:
+                    raise _Interrupted()
+                status_code = e.status_code
+                body = {"error": {"message": str(e), "type": "rate_limit_error", "code": "server_busy"}}
+                await asyncio.sleep(e.retry_after * (attempt + 1))
+            except Exception as e:
+                body = {"error": {"message": str(e), "type": "server_error", "code": "internal_error"}}
+                break
+        return {
+            "id": request_id,
+            "custom_id": custom_id,
+            "response": {"status_code": status_code, "request_id": request_id, "body": body},
+            "error": None,
+        }, status_code == 200
+
+    def _finalize(self, batch: Dict[str, Any], status: str):
+        """Publish the result files and record the terminal status"""
+        batch_id = batch["id"]
+        now = int(time.time())
+        if status == "completed":
+            batch["status"] = "finalizing"
+            batch["finalizing_at"] = now
+            self._save(batch)
+        for name, field in (("output.jsonl", "output_file_id"), ("errors.jsonl", "error_file_id")):
+            path = self._dir(batch_id) / name
+            if path.exists() and path.stat().st_size and not batch[field]:
+                batch[field] = self.files.adopt(path, f"{batch_id}_{name}", "batch_output", batch.get("owner"))["id"]
+        if status == "cancelled":
+            batch["cancelling_at"] = self._cancelling_at(batch_id) or now
+        batch["status"] = status
+        batch[f"{status}_at"] = int(time.time())
+        self._save(batch)
+        counts = batch["request_counts"]
+        logger.info(f"✅ Batch {batch_id} {status}: {counts['completed']} completed, {counts['failed']} failed")
@@ -0,0 +1,49 @@
+"""
+Benchmark helpers
+Build a ClaudeCodeClient wired to the fake CLI and summarize timings
+"""
+
+import os
+import sys
+import statistics
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from corrected_claude_client import ClaudeCodeClient  # noqa: E402
+
+FAKE_CLAUDE = Path(__file__).with_name("fake_claude.py")
+
+
+def fake_claude_cmd() -> str:
+    """Command line that runs the fake CLI with this interpreter"""
+    return f"{sys.executable} {FAKE_CLAUDE}"
+
+
+def make_client(**env) -> ClaudeCodeClient:
+    """Create a fake-CLI client after applying env overrides (Config reads os.environ)"""
+    env.setdefault("CLAUDE_CLI_PATH", fake_claude_cmd())
+    os.environ.update({key: str(value) for key, value in env.items()})
+    return ClaudeCodeClient()
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean of samples, in the samples' unit"""
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples) if samples else float("nan"),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+    }
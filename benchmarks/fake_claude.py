@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Fake Claude CLI
+Stand-in for the real `claude` binary so benchmarks run offline
+
+Behaviour is tuned through environment variables:
+  FAKE_CLAUDE_STARTUP_MS      delay before the process does anything (default 0)
+  FAKE_CLAUDE_OUTPUT_BYTES    size of each generated answer (default 200)
+  FAKE_CLAUDE_CHUNK_BYTES     size of each streamed text delta (default 16)
+  FAKE_CLAUDE_CHUNK_DELAY_MS  pause between streamed deltas (default 0); one-shot
+                              output waits as long as streaming it would take
+  FAKE_CLAUDE_SESSION_DIR     when set, sessions are kept here as JSON lists of
+                              prompts, so --resume/--fork-session can be checked
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+STARTUP_MS = float(os.getenv("FAKE_CLAUDE_STARTUP_MS", 0))
+OUTPUT_BYTES = int(os.getenv("FAKE_CLAUDE_OUTPUT_BYTES", 200))
+CHUNK_BYTES = max(1, int(os.getenv("FAKE_CLAUDE_CHUNK_BYTES", 16)))
+CHUNK_DELAY_MS = float(os.getenv("FAKE_CLAUDE_CHUNK_DELAY_MS", 0))
+SESSION_DIR = os.getenv("FAKE_CLAUDE_SESSION_DIR", "")
+
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit "
+
+
+def make_answer(prompt: str) -> str:
+    head = f"Received {len(prompt)} characters. "
+    body = FILLER * (OUTPUT_BYTES // len(FILLER) + 1)
+    return (head + body)[:max(OUTPUT_BYTES, len(head))]
+
+
+def record_turn(session_id: str, resumed: str, prompt: str):
+    """Append prompt to the session history, starting from the resumed session's"""
+    if not SESSION_DIR:
+        return
+    history = []
+    if resumed:
+        with open(os.path.join(SESSION_DIR, f"{resumed}.json")) as f:
+            history = json.load(f)
+    with open(os.path.join(SESSION_DIR, f"{session_id}.json"), "w") as f:
+        json.dump(history + [prompt], f)
+
+
+def generation_delay(answer: str):
+    """Time the non-streaming formats spend "generating", to match stream-json"""
+    chunks = -(-len(answer) // CHUNK_BYTES)
+    if CHUNK_DELAY_MS:
+        time.sleep(chunks * CHUNK_DELAY_MS / 1000)
+
+
+def emit(event: dict):
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def answer_stream_json(prompt: str, session_id: str):
+    """Emit the event sequence of `--output-format stream-json --verbose`"""
+    started = time.monotonic()
+    emit({"type": "system", "subtype": "init", "session_id": session_id})
+    answer = make_answer(prompt)
+    for i in range(0, len(answer), CHUNK_BYTES):
+        if CHUNK_DELAY_MS:
+            time.sleep(CHUNK_DELAY_MS / 1000)
+        emit({
+            "type": "stream_event",
+            "event": {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": answer[i:i + CHUNK_BYTES]},
+            },
+        })
+    emit({"type": "assistant", "message": {"role": "assistant", "content": [{"type": "text", "text": answer}]}})
+    emit(result_event(prompt, answer, started, session_id))
+
+
+def result_event(prompt: str, answer: str, started: float, session_id: str) -> dict:
+    return {
+        "type": "result",
+        "subtype": "success",
+        "is_error": False,
+        "duration_ms": int((time.monotonic() - started) * 1000),
+        "num_turns": 1,
+        "result": answer,
+        "session_id": session_id,
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": len(prompt) // 4 + 1, "output_tokens": len(answer) // 4 + 1},
+    }
+
+
+def main():
+    if STARTUP_MS:
+        time.sleep(STARTUP_MS / 1000)
+
+    argv = sys.argv[1:]
+    if "--version" in argv:
+        print("0.0.0 (fake claude)")
+        return
+    if argv[:2] == ["auth", "whoami"]:
+        print("benchmark@example.com")
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--print", "-p", action="store_true")
+    parser.add_argument("--model")
+    parser.add_argument("--output-format", default="text")
+    parser.add_argument("--input-format", default="text")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--include-partial-messages", action="store_true")
+    parser.add_argument("--resume")
+    parser.add_argument("--fork-session", action="store_true")
+    parser.add_argument("--session-id")
+    parser.add_argument("prompt", nargs="?")
+    args, _ = parser.parse_known_args(argv)
+    if args.resume and not args.fork_session:
+        session_id = args.resume
+    else:
+        session_id = args.session_id or str(uuid.uuid4())
+
+    if args.input_format == "stream-json":
+        # Long-lived worker: one user turn per stdin line
+        for line in sys.stdin:
+            message = json.loads(line)
+            content = message["message"]["content"]
+            prompt = content if isinstance(content, str) else "".join(b.get("text", "") for b in content)
+            answer_stream_json(prompt, session_id)
+        return
+
+    prompt = args.prompt if args.prompt is not None else sys.stdin.read()
+    record_turn(session_id, args.resume, prompt)
+    if args.output_format == "stream-json":
+        answer_stream_json(prompt, session_id)
+    elif args.output_format == "json":
+        started = time.monotonic()
+        answer = make_answer(prompt)
+        generation_delay(answer)
+        print(json.dumps(result_event(prompt, answer, started, session_id)))
+    else:
+        answer = make_answer(prompt)
+        generation_delay(answer)
+        print(answer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Load test
+Drive /v1/chat/completions on a real server backed by the fake CLI
+
+    python benchmarks/load_test.py [--requests 200] [--concurrency 1,8,32]
+                                   [--mode nonstream,stream] [--latency-ms 50]
+                                   [--output-bytes 2000] [--chunk-bytes 16]
+                                   [--chunk-delay-ms 1] [--json results.json]
+
+Each scenario starts a fresh uvicorn server in a child process (so the load
+generator does not share its event loop or memory), fires --requests
+requests at a fixed concurrency and reports throughput, p50/p95/p99 latency,
+time to first token, peak RSS of the server and its CLI children, and the
+server's event-loop lag. Other wrapper settings (MAX_CONCURRENCY,
+CLAUDE_POOL_ENABLED, ...) are taken from the environment.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+import psutil
+
+from common import ROOT, fake_claude_cmd, summarize
+
+# How often the server samples its own event loop
+LAG_INTERVAL = 0.01
+
+
+def serve(port: int):
+    """Child process: run the app with an event-loop lag sampler beside it"""
+    import uvicorn
+
+    sys.path.insert(0, str(ROOT))
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+
+    async def run():
+        lag: List[float] = []
+
+        async def sample():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(LAG_INTERVAL)
+                lag.append(max(0.0, time.perf_counter() - started - LAG_INTERVAL) * 1000)
+
+        sampler = asyncio.create_task(sample())
+        await server.serve()
+        sampler.cancel()
+        # The parent reads this line once the server has shut down
+        print(json.dumps({"loop_lag_ms": {**summarize(lag), "max": max(lag, default=0.0)}}), flush=True)
+
+    asyncio.run(run())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_env(args) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "CLAUDE_CLI_PATH": fake_claude_cmd(),
+        "FAKE_CLAUDE_STARTUP_MS": str(args.latency_ms),
+        "FAKE_CLAUDE_OUTPUT_BYTES": str(args.output_bytes),
+        "FAKE_CLAUDE_CHUNK_BYTES": str(args.chunk_bytes),
+        "FAKE_CLAUDE_CHUNK_DELAY_MS": str(args.chunk_delay_ms),
+        "CLAUDE_CLI_CACHE_FILE": "",
+        "BATCH_ENABLED": "false",
+    })
+    # The load must not be throttled by the wrapper's own protections
+    env.setdefault("RATE_LIMIT_REQUESTS", "100000000")
+    env.setdefault("MAX_CONCURRENCY", str(max(args.concurrency_levels)))
+    env.setdefault("MAX_QUEUE_SIZE", str(args.requests))
+    return env
+
+
+class RSSSampler:
+    """Peak resident memory of the server process and of its CLI children"""
+
+    def __init__(self, pid: int):
+        self.process = psutil.Process(pid)
+        self.server_peak = 0
+        self.children_peak = 0
+
+    def sample(self):
+        try:
+            self.server_peak = max(self.server_peak, self.process.memory_info().rss)
+            children = 0
+            for child in self.process.children(recursive=True):
+                try:
+                    children += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.children_peak = max(self.children_peak, children)
+        except psutil.Error:
+            pass
+
+    async def run(self, interval: float = 0.05):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+
+async def one_request(http: httpx.AsyncClient, index: int, stream: bool) -> Dict[str, Any]:
+    body = {
+        "model": "gpt-4",
+        # Distinct prompts, so coalescing and the response cache stay out of the way
+        "messages": [{"role": "user", "content": f"load test request {index}"}],
+        "stream": stream,
+    }
+    started = time.perf_counter()
+    first_token: Optional[float] = None
+    if stream:
+        async with http.stream("POST", "/v1/chat/completions", json=body) as response:
+            async for line in response.aiter_lines():
+                if first_token is None and '"content"' in line:
+                    first_token = time.perf_counter() - started
+            status = response.status_code
+    else:
+        response = await http.post("/v1/chat/completions", json=body)
+        status = response.status_code
+    latency = time.perf_counter() - started
+    return {"status": status, "latency": latency, "ttft": first_token if stream else latency}
+
+
+async def run_scenario(args, mode: str, concurrency: int) -> Dict[str, Any]:
+    port = free_port()
+    child = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port)],
+        env=server_env(args),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        cwd=ROOT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as http:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    if (await http.get("/health")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or child.poll() is not None:
+                    raise RuntimeError("server did not start")
+                await asyncio.sleep(0.1)
+
+            rss = RSSSampler(child.pid)
+            sampler = asyncio.create_task(rss.run())
+            indices = iter(range(args.requests))
+            results: List[Dict[str, Any]] = []
+
+            async def worker():
+                for index in indices:
+                    results.append(await one_request(http, index, mode == "stream"))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+    finally:
+        child.send_signal(signal.SIGINT)
+        output, _ = await asyncio.to_thread(child.communicate, timeout=60)
+
+    lines = output.decode().strip().splitlines()
+    server_stats = json.loads(lines[-1]) if lines else {}
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize([r["latency"] * 1000 for r in ok]),
+        "ttft_ms": summarize([r["ttft"] * 1000 for r in ok if r["ttft"] is not None]),
+        "server_rss_peak_mb": rss.server_peak / 2**20,
+        "cli_rss_peak_mb": rss.children_peak / 2**20,
+        "loop_lag_ms": server_stats.get("loop_lag_ms", {}),
+    }
+
+
+async def main(args):
+    header = (
+        f"{'mode':>9} {'conc':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'ttft p50':>8} {'ttft p95':>8} {'err':>4} {'rss MB':>7} {'cli MB':>7} {'lag p99':>8} {'lag max':>8}"
+    )
+    print(header)
+    results = []
+    for mode in args.modes:
+        for concurrency in args.concurrency_levels:
+            r = await run_scenario(args, mode, concurrency)
+            results.append(r)
+            lat, ttft, lag = r["latency_ms"], r["ttft_ms"], r["loop_lag_ms"]
+            print(
+                f"{mode:>9} {concurrency:>4} {r['throughput_rps']:>7.1f} {lat['p50']:>8.1f} {lat['p95']:>8.1f} "
+                f"{lat['p99']:>8.1f} {ttft['p50']:>8.1f} {ttft['p95']:>8.1f} {r['errors']:>4} "
+                f"{r['server_rss_peak_mb']:>7.1f} {r['cli_rss_peak_mb']:>7.1f} "
+                f"{lag.get('p99', float('nan')):>8.2f} {lag.get('max', float('nan')):>8.2f}"
+            )
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump({"settings": vars(args), "results": results}, out, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--mode", default="nonstream,stream")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake CLI startup delay")
+    parser.add_argument("--output-bytes", type=int, default=2000)
+    parser.add_argument("--chunk-bytes", type=int, default=16)
+    parser.add_argument("--chunk-delay-ms", type=float, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+    else:
+        logging.basicConfig(level=logging.CRITICAL)
+        args.modes = args.mode.split(",")
+        args.concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+        asyncio.run(main(args))
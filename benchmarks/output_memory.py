@@ -0,0 +1,72 @@
+"""
+Output memory benchmark
+Peak Python heap per one-shot request versus CLI output size
+
+    python benchmarks/output_memory.py [--sizes 1,10,50]
+
+Sizes are in MiB. "communicate" is the old path (process.communicate(),
+decode, strip); "bounded" is ClaudeCodeClient._run_claude_command with
+CLAUDE_MAX_OUTPUT_BYTES raised above the largest size. Peaks come from
+tracemalloc, so they cover Python allocations only, not the child process.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tracemalloc
+
+from common import fake_claude_cmd, make_client
+
+MODEL = "claude-3-haiku-20240307"
+
+
+async def communicate_baseline(prompt: str):
+    process = await asyncio.create_subprocess_exec(
+        *fake_claude_cmd().split(), "--print", "--model", MODEL,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, _ = await process.communicate(input=prompt.encode("utf-8"))
+    return stdout.decode("utf-8").strip()
+
+
+async def peak_bytes(run) -> int:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        await run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,50")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    limit = (max(sizes) + 1) * 1024 * 1024
+    prompt = "Summarize the report."
+
+    print(f"{'size MiB':>9} {'path':>12} {'peak MiB':>9} {'x output':>9}")
+    for size in sizes:
+        output_bytes = size * 1024 * 1024
+        os.environ["FAKE_CLAUDE_OUTPUT_BYTES"] = str(output_bytes)
+        client = make_client(CLAUDE_POOL_ENABLED="false", CLAUDE_MAX_OUTPUT_BYTES=limit)
+
+        runs = {
+            "communicate": lambda: communicate_baseline(prompt),
+            "bounded": lambda: client._run_claude_command(prompt, MODEL),
+        }
+        for path, run in runs.items():
+            peak = await peak_bytes(run)
+            print(f"{size:>9} {path:>12} {peak / 2**20:>9.1f} {peak / output_bytes:>9.2f}")
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
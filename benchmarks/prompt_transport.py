@@ -0,0 +1,54 @@
+"""
+Prompt transport benchmark
+Latency of one-shot CLI calls versus prompt size, prompt in argv vs on stdin
+
+    python benchmarks/prompt_transport.py [--sizes 1,16,64,256,512] [--repeat 5]
+
+Sizes are in KiB. argv fails with E2BIG once a single argument passes the
+kernel's MAX_ARG_STRLEN (128 KiB on Linux); stdin has no such ceiling.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from common import make_client, summarize
+
+
+async def measure(client, prompt: str, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            await client._run_claude_command(prompt, "claude-3-haiku-20240307")
+        except RuntimeError as e:
+            return None, str(e).splitlines()[0][:60]
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies), None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,16,64,127,256,512")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'size KiB':>9} {'mode':>6} {'p50 ms':>9} {'p95 ms':>9}  note")
+    for mode in ("argv", "stdin"):
+        client = make_client(CLAUDE_PROMPT_TRANSPORT=mode, CLAUDE_POOL_ENABLED="false")
+        for size in sizes:
+            prompt = "x" * (size * 1024)
+            stats, error = await measure(client, prompt, args.repeat)
+            if stats:
+                print(f"{size:>9} {mode:>6} {stats['p50']:>9.1f} {stats['p95']:>9.1f}")
+            else:
+                print(f"{size:>9} {mode:>6} {'-':>9} {'-':>9}  failed: {error}")
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Response pipeline benchmark
+Requests/sec of /v1/models and non-streaming completions through the full app
+
+    python benchmarks/response_pipeline.py [--requests 3000] [--concurrency 16] [--rounds 3]
+
+Requests go straight to the ASGI app in this process (no sockets), so the
+numbers are the wrapper's own per-request cost: routing, middleware,
+dependencies and response encoding. The httpx client shares the process and
+its cost is included, so compare paths with each other rather than with
+figures from load_test.py. Completions are served from the
+response cache after the first call, which keeps the (fake) CLI out of the
+measurement while still building a fresh response body every time.
+
+Paths compared:
+  legacy  the previous handlers, re-mounted under /bench/legacy: Pydantic
+          objects built per call for /v1/models, and a completion dict
+          returned to FastAPI's jsonable_encoder + JSONResponse. The
+          completion route does the same disconnect watching, cache-bypass
+          check and logging as the real one, so only the encoding differs
+  typed   the real endpoints: pre-built model-list bytes, completion dict
+          encoded straight to bytes
+  debug   the real endpoints with DEBUG=true (bodies validated per call)
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+from fastapi import Depends, Request
+
+from common import fake_claude_cmd
+
+os.environ.update({
+    "CLAUDE_CLI_PATH": fake_claude_cmd(),
+    "CLAUDE_CLI_CACHE_FILE": "",
+    "RESPONSE_CACHE_ENABLED": "true",
+    "RATE_LIMIT_REQUESTS": "100000000",
+    "BATCH_ENABLED": "false",
+    "LOOP_MONITOR_ENABLED": "false",
+})
+
+import main  # noqa: E402
+
+COMPLETION = {"model": "gpt-4", "messages": [{"role": "user", "content": "response pipeline benchmark"}]}
+
+
+@main.app.get("/bench/legacy/v1/models", response_model=main.ModelsResponse)
+async def legacy_list_models(authorized: bool = Depends(main.verify_api_key)):
+    return main.ModelsResponse(data=[
+        main.ModelInfo(id=model_type.value, created=int(time.time()), owned_by="anthropic")
+        for model_type in main.ModelType
+    ])
+
+
+@main.app.post("/bench/legacy/v1/chat/completions")
+async def legacy_chat_completions(
+    request: main.ChatCompletionRequest,
+    http_request: Request,
+    authorized: bool = Depends(main.verify_api_key)
+):
+    # Everything the real non-streaming handler does except the encoding
+    use_cache = not main._cache_bypassed(http_request)
+    priority = getattr(http_request.state, "priority", None)
+    main.logger.info(f"Chat completion request: model={request.model}, messages={len(request.messages)}, stream={request.stream}, priority={priority}")
+    response = await main._cancel_on_disconnect(
+        http_request, main.claude_client.chat_completion(request, use_cache=use_cache, priority=priority)
+    )
+    main.logger.info(f"Chat completion response: tokens={response.get('usage', {}).get('total_tokens', 0)}")
+    return response
+
+
+async def measure_once(http: httpx.AsyncClient, method: str, path: str, requests: int, concurrency: int) -> float:
+    """Requests/sec for requests calls to path, concurrency at a time"""
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            if method == "GET":
+                response = await http.get(path)
+            else:
+                response = await http.post(path, json=COMPLETION)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+async def run(args):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            # Fill the response cache and warm every path once
+            for path in ("/v1/chat/completions", "/bench/legacy/v1/chat/completions"):
+                await http.post(path, json=COMPLETION)
+
+            print(f"{'endpoint':>20} {'path':>7} {'req/s':>9} {'speedup':>8}")
+            for label, method, path in (
+                ("/v1/models", "GET", "/v1/models"),
+                ("/v1/chat/completions", "POST", "/v1/chat/completions"),
+            ):
+                # Rounds alternate between the paths, so warm-up and machine drift hit all of them alike
+                best = {"legacy": 0.0, "typed": 0.0, "debug": 0.0}
+                for _ in range(args.rounds):
+                    for name, prefix, debug in (("legacy", "/bench/legacy", False), ("typed", "", False), ("debug", "", True)):
+                        main.config.DEBUG = debug
+                        per_sec = await measure_once(http, method, prefix + path, args.requests, args.concurrency)
+                        best[name] = max(best[name], per_sec)
+                main.config.DEBUG = False
+                for name, per_sec in best.items():
+                    print(f"{label:>20} {name:>7} {per_sec:>9,.0f} {per_sec / best['legacy']:>7.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=3, help="best of this many runs per path")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args))
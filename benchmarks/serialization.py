@@ -0,0 +1,103 @@
+"""
+Serialization benchmark
+Stream chunks/sec and response bodies/sec for each encoding path
+
+    python benchmarks/serialization.py [--delta-chars 16,256] [--seconds 1]
+
+Chunk paths: "dict+json" builds the full chunk dict and runs json.dumps per
+delta (the pre-template path); "template" formats the delta into the
+encoder's precomputed frame. Response paths: "jsonable+json" is what a
+FastAPI handler returning a dict costs (jsonable_encoder, then JSONResponse's
+json.dumps); "direct" encodes the dict straight to bytes. Template and
+direct paths run once per available backend (json, orjson).
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+
+import common  # noqa: F401  (puts the project root on sys.path)
+import fast_json
+import sse
+
+
+def rate(fn: Callable[[], object], seconds: float) -> float:
+    """Calls per second of fn over roughly seconds of wall time"""
+    calls, batch = 0, 1000
+    started = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            fn()
+        calls += batch
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def backends() -> List[str]:
+    return ["json", "orjson"] if fast_json.orjson is not None else ["json"]
+
+
+def legacy_chunk(chunk_id: str, created: int, model: str, text: str) -> bytes:
+    chunk = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+
+def sample_response(content: str) -> dict:
+    return {
+        "id": "chatcmpl-0123abcd",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 345, "total_tokens": 357},
+        "claude": {"stop_reason": "end_turn", "duration_ms": 1234},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delta-chars", default="16,256", help="content delta sizes for chunks")
+    parser.add_argument("--response-chars", default="2000", help="completion sizes for response bodies")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per measurement")
+    args = parser.parse_args()
+
+    print(f"{'kind':>8} {'size':>6} {'path':>16} {'per sec':>12} {'speedup':>8}")
+    for size in (int(s) for s in args.delta_chars.split(",")):
+        text = ("lorem ipsum é " * size)[:size]
+        baseline = rate(lambda: legacy_chunk("chatcmpl-0123abcd", 1700000000, "gpt-4", text), args.seconds)
+        print(f"{'chunk':>8} {size:>6} {'dict+json':>16} {baseline:>12,.0f} {1.0:>7.2f}x")
+        for backend in backends():
+            fast_json.set_backend(backend)
+            encoder = sse.ChunkEncoder("chatcmpl-0123abcd", 1700000000, "gpt-4")
+            per_sec = rate(lambda: encoder.content(text), args.seconds)
+            print(f"{'chunk':>8} {size:>6} {'template/' + backend:>16} {per_sec:>12,.0f} {per_sec / baseline:>7.2f}x")
+
+    for size in (int(s) for s in args.response_chars.split(",")):
+        body = sample_response(("lorem ipsum é " * size)[:size])
+        baseline = rate(
+            lambda: json.dumps(jsonable_encoder(body), ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            args.seconds
+        )
+        print(f"{'response':>8} {size:>6} {'jsonable+json':>16} {baseline:>12,.0f} {1.0:>7.2f}x")
+        for backend in backends():
+            fast_json.set_backend(backend)
+            per_sec = rate(lambda: fast_json.dumps(body), args.seconds)
+            print(f"{'response':>8} {size:>6} {'direct/' + backend:>16} {per_sec:>12,.0f} {per_sec / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
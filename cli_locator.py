@@ -0,0 +1,136 @@
+"""
+Claude CLI Locator
+Resolve the Claude Code CLI without serial probing and cache what was found
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+NPX_PACKAGE = "@anthropic-ai/claude-code"
+
+
+@dataclass
+class ResolvedCLI:
+    """The CLI command line and where it came from"""
+    command: str
+    source: str  # "env", "cache", "path" or "npx"
+    version: Optional[str] = None
+
+
+def default_cache_file() -> Path:
+    cache_home = os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "claude-wrapper" / "cli.json"
+
+
+def _fingerprint(executable: str) -> Optional[Dict[str, Any]]:
+    """What must still match for a cached resolution to be trusted"""
+    try:
+        stat = os.stat(executable)
+    except OSError:
+        return None
+    return {"executable": executable, "mtime": stat.st_mtime, "path_env": os.getenv("PATH", "")}
+
+
+def load_cached(cache_file: Optional[Path]) -> Optional[ResolvedCLI]:
+    """Return the cached resolution if its executable is unchanged"""
+    if not cache_file:
+        return None
+    try:
+        entry = json.loads(cache_file.read_text())
+    except (OSError, ValueError):
+        return None
+    if entry.get("fingerprint") is None or _fingerprint(entry["fingerprint"]["executable"]) != entry["fingerprint"]:
+        return None
+    return ResolvedCLI(command=entry["command"], source="cache", version=entry.get("version"))
+
+
+def save_cached(cache_file: Optional[Path], resolved: ResolvedCLI):
+    """Persist a resolution atomically; failures only cost the next cold start"""
+    if not cache_file or resolved.source == "env":
+        return
+    fingerprint = _fingerprint(shutil.which(resolved.command.split()[0]) or "")
+    if fingerprint is None:
+        return
+    entry = asdict(resolved)
+    entry["fingerprint"] = fingerprint
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(entry))
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        logger.debug(f"Could not write CLI cache {cache_file}: {e}")
+
+
+def locate_claude_cli(explicit: Optional[str], cache_file: Optional[Path]) -> Optional[ResolvedCLI]:
+    """Find the CLI without running anything: explicit command, cached result, then PATH
+
+    Returns None when only the npx fallback is left.
+    """
+    if explicit:
+        if not shutil.which(explicit.split()[0]):
+            raise RuntimeError(f"❌ CLAUDE_CLI_PATH is not executable: {explicit}")
+        return ResolvedCLI(command=explicit, source="env")
+
+    cached = load_cached(cache_file)
+    if cached:
+        return cached
+
+    for name in ("claude", "claude-code"):
+        executable = shutil.which(name)
+        if executable:
+            resolved = ResolvedCLI(command=executable, source="path")
+            save_cached(cache_file, resolved)
+            return resolved
+    return None
+
+
+async def _npx_version(cmd, timeout: float) -> Optional[str]:
+    """Version printed by cmd --version, or None if it fails or takes longer than timeout"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, "--version", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError:
+        return None
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None
+    if process.returncode != 0:
+        return None
+    return stdout.decode("utf-8", errors="replace").strip()
+
+
+async def resolve_claude_cli(explicit: Optional[str], cache_file: Optional[Path], npx_timeout: float = 60) -> ResolvedCLI:
+    """Find the CLI: explicit command, cached result, PATH lookup, then npx
+
+    Only the npx fallback runs a subprocess; it is awaited, so a slow
+    package download never blocks the event loop, and its result is cached.
+    """
+    resolved = locate_claude_cli(explicit, cache_file)
+    if resolved:
+        return resolved
+
+    if shutil.which("npx"):
+        cmd = ["npx", NPX_PACKAGE]
+        version = await _npx_version(cmd, npx_timeout)
+        if version is not None:
+            resolved = ResolvedCLI(command=" ".join(cmd), source="npx", version=version)
+            save_cached(cache_file, resolved)
+            return resolved
+
+    raise RuntimeError(
+        "❌ Claude Code CLI not found. Please install with:\n"
+        "npm install -g @anthropic-ai/claude-code"
+    )
@@ -9,12 +9,28 @@ import json
 import tempfile
 import os
 import shutil
-from typing import Dict, List, Optional, AsyncGenerator, Any
+from typing import Dict, List, Optional, AsyncGenerator, Any, Callable, Tuple, Union
 import uuid
 import time
 import logging
+from dataclasses import dataclass
 from pathlib import Path
 
+from cli_locator import ResolvedCLI, default_cache_file, locate_claude_cli, resolve_claude_cli, save_cached
+from metrics import (
+    CANCELLED_CALLS, CANCELLED_WORK_SECONDS, CLI_REPORTED_DURATION, CLI_RUNTIME, IN_FLIGHT,
+    PROCESS_SPAWN, REQUEST_COST, REQUESTS, SERIALIZATION, STOP_REASONS, TIME_TO_FIRST_BYTE, TOKENS
+)
+from process_group import SPAWN_KWARGS, ProcessTracker, kill_group
+from response_cache import CompletionCache, SharedCompletionCache, completion_cache_key
+from request_cost import CostEstimator, parse_weights
+from scheduler import ConcurrencyScheduler, SchedulerRejected, SharedSlots
+from session_store import SessionStore
+from single_flight import SingleFlight, StreamFanout, StreamFlight
+import sse
+from token_counter import create_token_counter
+from worker_pool import ClaudeWorkerPool, STREAM_LINE_LIMIT
+
 logger = logging.getLogger(__name__)
 
 class Config:
@@ -25,17 +41,121 @@ class Config:
         self.PORT = int(os.getenv("PORT", 8000))
         self.HOST = os.getenv("HOST", "0.0.0.0")
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+        # Debug mode: response bodies are validated against their Pydantic models
+        self.DEBUG = os.getenv("DEBUG", "false").lower() == "true"
         
         # Authentication (for the wrapper API, not Claude)
         self.VALID_API_KEYS = self._parse_api_keys(os.getenv("VALID_API_KEYS", ""))
         
         # Claude CLI configuration
+        # Explicit CLI command line; skips PATH lookup and the resolution cache
+        self.CLAUDE_CLI_PATH = os.getenv("CLAUDE_CLI_PATH", "")
+        # Where the resolved CLI path/version is remembered ("" disables)
+        self.CLAUDE_CLI_CACHE_FILE = os.getenv("CLAUDE_CLI_CACHE_FILE", str(default_cache_file()))
         self.CLAUDE_CLI_TIMEOUT = int(os.getenv("CLAUDE_CLI_TIMEOUT", 60))
         self.CLAUDE_MODEL_DEFAULT = os.getenv("CLAUDE_MODEL_DEFAULT", "claude-3-sonnet-20240229")
+        # How one-shot CLI processes receive the prompt: "stdin" or legacy "argv"
+        self.CLAUDE_PROMPT_TRANSPORT = os.getenv("CLAUDE_PROMPT_TRANSPORT", "stdin").lower()
+        # One-shot output: "json" carries real usage, stop reason and timing but
+        # peaks at ~3x the output size in memory; "text" peaks at ~2x
+        self.CLAUDE_OUTPUT_FORMAT = os.getenv("CLAUDE_OUTPUT_FORMAT", "text").lower()
+        # Caps on what is buffered from one CLI process
+        self.CLAUDE_MAX_OUTPUT_BYTES = int(os.getenv("CLAUDE_MAX_OUTPUT_BYTES", 8 * 1024 * 1024))
+        self.CLAUDE_MAX_STDERR_BYTES = int(os.getenv("CLAUDE_MAX_STDERR_BYTES", 64 * 1024))
+        
+        # Warm worker pool (long-lived CLI processes over stream-json stdin)
+        self.CLAUDE_POOL_ENABLED = os.getenv("CLAUDE_POOL_ENABLED", "false").lower() == "true"
+        self.CLAUDE_POOL_MIN_SIZE = int(os.getenv("CLAUDE_POOL_MIN_SIZE", 1))
+        self.CLAUDE_POOL_MAX_SIZE = int(os.getenv("CLAUDE_POOL_MAX_SIZE", 4))
+        self.CLAUDE_POOL_MAX_REQUESTS = int(os.getenv("CLAUDE_POOL_MAX_REQUESTS", 1))
+        # Required for CLAUDE_POOL_MAX_REQUESTS > 1: later requests see earlier ones' turns
+        self.CLAUDE_POOL_UNSAFE_SHARED_CONTEXT = os.getenv("CLAUDE_POOL_UNSAFE_SHARED_CONTEXT", "false").lower() == "true"
+        self.CLAUDE_POOL_MAX_AGE = int(os.getenv("CLAUDE_POOL_MAX_AGE", 300))
+        
+        # Multi-worker mode: state shared by every worker process on this host
+        # (concurrency slots, rate limits, response cache); "" = per-process
+        self.SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "")
+        
+        # Concurrency scheduler (admission control in front of the CLI)
+        self.MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", 4))
+        self.MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", 32))
+        self.QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", 30))
+        
+        # Cost-weighted admission: a request costs its model family's weight
+        # times (1 + prompt characters / COST_UNIT_CHARS); 0 disables the budget
+        self.MAX_INFLIGHT_COST = float(os.getenv("MAX_INFLIGHT_COST", 48))
+        self.COST_UNIT_CHARS = int(os.getenv("COST_UNIT_CHARS", 8000))
+        self.MODEL_COST_WEIGHTS = os.getenv("MODEL_COST_WEIGHTS", "haiku=1,sonnet=3,opus=8")
+        self.MAX_QUEUE_BYPASS = int(os.getenv("MAX_QUEUE_BYPASS", 8))
+        
+        # Priority lanes: separate queues sharing slots by weight; a lane comes
+        # from the API key (API_KEY_PRIORITIES) or the PRIORITY_HEADER request header
+        self.PRIORITY_LANES = {
+            lane.lower(): float(weight)
+            for lane, weight in self._parse_mapping(os.getenv("PRIORITY_LANES", "interactive=4,batch=1")).items()
+        }
+        self.DEFAULT_PRIORITY = os.getenv("DEFAULT_PRIORITY", "interactive").lower()
+        self.API_KEY_PRIORITIES = {
+            key: lane.lower() for key, lane in self._parse_mapping(os.getenv("API_KEY_PRIORITIES", "")).items()
+        }
+        self.PRIORITY_HEADER = os.getenv("PRIORITY_HEADER", "X-Priority")
+        
+        # Batch API (/v1/files, /v1/batches): jobs run in the background on their
+        # own concurrency budget and resume from disk after a restart
+        self.BATCH_ENABLED = os.getenv("BATCH_ENABLED", "true").lower() == "true"
+        self.BATCH_DATA_DIR = os.getenv("BATCH_DATA_DIR", "")  # "" = ~/.local/share/claude-wrapper
+        self.BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 2))
+        self.BATCH_PRIORITY = os.getenv("BATCH_PRIORITY", "batch").lower()
+        self.BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", 100 * 1024 * 1024))
+        self.BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 50000))
+        
+        # Background health prober
+        self.HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 30))
+        self.HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", 120))
+        
+        # Streaming: text deltas are coalesced until STREAM_FLUSH_INTERVAL_MS has
+        # passed or STREAM_FLUSH_SIZE characters are pending (0 = every delta);
+        # idle streams get an SSE comment every STREAM_HEARTBEAT_INTERVAL seconds
+        self.STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", 20))
+        self.STREAM_FLUSH_SIZE = int(os.getenv("STREAM_FLUSH_SIZE", 1024))
+        self.STREAM_HEARTBEAT_INTERVAL = float(os.getenv("STREAM_HEARTBEAT_INTERVAL", 15))
+        
+        # Response and chunk encoding: "auto" uses orjson when installed, else "json"
+        self.JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+        
+        # Event loop monitoring: lag histogram plus a log line naming any
+        # coroutine that blocks the loop for longer than SLOW_CALLBACK_MS
+        self.LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+        self.LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+        self.SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", 100))
+        
+        # Graceful shutdown: wait for in-flight work, then stop CLI process groups
+        self.SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30))
+        self.SHUTDOWN_KILL_GRACE = float(os.getenv("SHUTDOWN_KILL_GRACE", 5))
+        
+        # Response cache for identical completions (opt-in)
+        self.RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+        self.RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+        self.RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+        
+        # Request coalescing: identical concurrent requests share one CLI call
+        self.REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+        
+        # Conversation reuse: resume CLI sessions and send only new turns
+        self.SESSION_REUSE_ENABLED = os.getenv("SESSION_REUSE_ENABLED", "false").lower() == "true"
+        self.SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1000))
+        self.SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+        
+        # Usage accounting: "auto" uses tiktoken when installed, else "approx"
+        self.TOKEN_COUNTER = os.getenv("TOKEN_COUNTER", "auto").lower()
+        self.TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+        self.TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 4096))
         
         # Rate limiting
         self.RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", 100))
         self.RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", 60))
+        self.RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite" if self.SHARED_STATE_DIR else "memory").lower()
+        self.RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
         
         # Monitoring
         self.ENABLE_METRICS = os.getenv("ENABLE_METRICS", "true").lower() == "true"
@@ -47,11 +167,56 @@ class Config:
             return []
         return [key.strip() for key in api_keys_str.split(",") if key.strip()]
     
+    def _parse_mapping(self, mapping_str: str) -> Dict[str, str]:
+        """Parse comma-separated name=value pairs"""
+        mapping = {}
+        for item in mapping_str.split(","):
+            name, sep, value = item.partition("=")
+            if sep and name.strip():
+                mapping[name.strip()] = value.strip()
+        return mapping
+    
     @property
     def auth_required(self) -> bool:
         """Check if authentication is required"""
         return len(self.VALID_API_KEYS) > 0
 
+@dataclass
+class CLIResult:
+    """Output of one Claude CLI invocation"""
+    text: str
+    session_id: Optional[str] = None
+    # Reported by the CLI's JSON result event; None in plain-text mode
+    usage: Optional[Dict[str, int]] = None
+    stop_reason: Optional[str] = None
+    duration_ms: Optional[int] = None
+    
+    @classmethod
+    def from_event(cls, event: Dict[str, Any]) -> "CLIResult":
+        """Build from a JSON/stream-JSON "result" event"""
+        return cls(
+            text=(event.get("result") or "").strip(),
+            session_id=event.get("session_id"),
+            usage=event.get("usage") or None,
+            stop_reason=event.get("stop_reason"),
+            duration_ms=event.get("duration_ms"),
+        )
+    
+    @property
+    def prompt_tokens(self) -> Optional[int]:
+        """Input tokens including prompt-cache reads and writes"""
+        if not self.usage or "input_tokens" not in self.usage:
+            return None
+        return (
+            self.usage["input_tokens"]
+            + self.usage.get("cache_creation_input_tokens", 0)
+            + self.usage.get("cache_read_input_tokens", 0)
+        )
+    
+    @property
+    def completion_tokens(self) -> Optional[int]:
+        return self.usage.get("output_tokens") if self.usage else None
+
 class ClaudeCodeClient:
     """Client that interfaces with Claude Code CLI"""
     
@@ -73,74 +238,161 @@ class ClaudeCodeClient:
 }
     
     def __init__(self):
+        self._init_started = time.perf_counter()
         self.config = Config()
-        self.claude_cmd = self._find_claude_command()
-        self.temp_dir = Path(tempfile.gettempdir()) / "claude-wrapper"
-        self.temp_dir.mkdir(exist_ok=True)
-        self._verify_authentication()
+        self.startup_timings: Dict[str, float] = {}
+        self.cli: Optional[ResolvedCLI] = None
+        # Resolved here when no subprocess is needed; the npx fallback waits for start()
+        self.claude_cmd: Optional[str] = self._locate_claude_command()
+        self.startup_timings["resolve_cli"] = time.perf_counter() - self._init_started
+        # Private working directory, removed by close() once no CLI can still use it
+        self.temp_dir = Path(tempfile.mkdtemp(prefix="claude-wrapper-"))
+        self.processes = ProcessTracker()
+        self.draining = False
+        self._drain_task: Optional[asyncio.Task] = None
+        self._active_requests = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.worker_pool: Optional[ClaudeWorkerPool] = None
+        shared_dir = Path(self.config.SHARED_STATE_DIR) if self.config.SHARED_STATE_DIR else None
+        self.scheduler = ConcurrencyScheduler(
+            max_concurrency=self.config.MAX_CONCURRENCY,
+            max_queue=self.config.MAX_QUEUE_SIZE,
+            queue_timeout=self.config.QUEUE_TIMEOUT,
+            shared_slots=SharedSlots(shared_dir / "slots", self.config.MAX_CONCURRENCY) if shared_dir else None,
+            max_cost=self.config.MAX_INFLIGHT_COST,
+            max_bypass=self.config.MAX_QUEUE_BYPASS,
+            lanes=self.config.PRIORITY_LANES,
+            default_lane=self.config.DEFAULT_PRIORITY,
+        )
+        self.cost_estimator = CostEstimator(
+            parse_weights(self.config.MODEL_COST_WEIGHTS),
+            self.config.COST_UNIT_CHARS,
+        )
+        self.response_cache: Optional[Union[CompletionCache, SharedCompletionCache]] = None
+        if self.config.RESPONSE_CACHE_ENABLED and shared_dir:
+            self.response_cache = SharedCompletionCache(
+                shared_dir / "cache.sqlite3",
+                max_entries=self.config.RESPONSE_CACHE_SIZE,
+                ttl=self.config.RESPONSE_CACHE_TTL,
+            )
+        elif self.config.RESPONSE_CACHE_ENABLED:
+            self.response_cache = CompletionCache(
+                max_entries=self.config.RESPONSE_CACHE_SIZE,
+                ttl=self.config.RESPONSE_CACHE_TTL,
+            )
+        self.session_store: Optional[SessionStore] = None
+        if self.config.SESSION_REUSE_ENABLED:
+            self.session_store = SessionStore(
+                max_sessions=self.config.SESSION_CACHE_SIZE,
+                ttl=self.config.SESSION_TTL,
+            )
+        self.single_flight = SingleFlight()
+        self.token_counter = create_token_counter(self.config)
+        self.stream_fanout = StreamFanout()
+        self._health: Dict[str, Any] = {}
+        self._health_checked_at: Optional[float] = None
+        self._health_task: Optional[asyncio.Task] = None
         logger.info("✅ Claude Code client initialized successfully")
     
-    def _find_claude_command(self) -> str:
-        """Find Claude Code CLI command"""
-        possible_commands = [
-            "claude",
-            "claude-code", 
-            ["npx", "@anthropic-ai/claude-code"]
-        ]
-        
-        for cmd in possible_commands:
+    async def start(self):
+        """Start background resources (health prober, worker pool) concurrently"""
+        async def timed(phase: str, coro):
+            started = time.perf_counter()
             try:
-                if isinstance(cmd, list):
-                    test_cmd = cmd + ["--version"]
-                else:
-                    test_cmd = cmd.split() + ["--version"]
-                
-                result = subprocess.run(
-                    test_cmd,
-                    capture_output=True, 
-                    text=True, 
-                    timeout=10
-                )
-                
-                if result.returncode == 0:
-                    cmd_str = " ".join(cmd) if isinstance(cmd, list) else cmd
-                    logger.info(f"✅ Found Claude CLI: {cmd_str}")
-                    return cmd_str
-                    
-            except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.CalledProcessError):
-                continue
+                return await coro
+            finally:
+                self.startup_timings[phase] = time.perf_counter() - started
         
-        raise RuntimeError(
-            "❌ Claude Code CLI not found. Please install with:\n"
-            "npm install -g @anthropic-ai/claude-code"
-        )
+        if self.claude_cmd is None:
+            self.claude_cmd = await timed("resolve_cli", self._find_claude_command())
+        
+        phases = [timed("health_probe", self.refresh_health())]
+        if self.config.CLAUDE_POOL_ENABLED:
+            self.worker_pool = ClaudeWorkerPool(
+                base_cmd=self.claude_cmd.split(),
+                cwd=self.temp_dir,
+                default_model=self.config.CLAUDE_MODEL_DEFAULT,
+                min_size=self.config.CLAUDE_POOL_MIN_SIZE,
+                max_size=self.config.CLAUDE_POOL_MAX_SIZE,
+                max_requests=self.config.CLAUDE_POOL_MAX_REQUESTS,
+                max_age=self.config.CLAUDE_POOL_MAX_AGE,
+                allow_shared_context=self.config.CLAUDE_POOL_UNSAFE_SHARED_CONTEXT,
+                checkout_timeout=self.config.QUEUE_TIMEOUT,
+            )
+            phases.append(timed("worker_pool", self.worker_pool.start()))
+        await asyncio.gather(*phases)
+        self._health_task = asyncio.create_task(self._health_loop())
+        
+        self.startup_timings["total"] = time.perf_counter() - self._init_started
+        phases_ms = ", ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in self.startup_timings.items())
+        logger.info(f"⏱️ Startup phases: {phases_ms}")
+    
+    def begin_drain(self, timeout: float) -> asyncio.Task:
+        """Start draining now (idempotent); the task finishes when drain() does"""
+        if self._drain_task is None:
+            # Refuse new work from this moment, not from when the task first runs
+            self.draining = True
+            self._drain_task = asyncio.ensure_future(self.drain(timeout))
+        return self._drain_task
     
-    def _verify_authentication(self):
-        """Verify Claude Code CLI authentication"""
+    async def drain(self, timeout: float):
+        """Stop admitting requests and wait up to timeout for in-flight ones
+        
+        CLI process groups still running at the deadline are terminated, so
+        their requests and streams fail fast instead of being orphaned.
+        """
+        self.draining = True
+        if self._active_requests:
+            logger.info(f"🛑 Draining {self._active_requests} in-flight request(s), up to {timeout}s")
         try:
-            cmd = self.claude_cmd.split() + ["auth", "whoami"]
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            if result.returncode != 0:
-                error_msg = result.stderr.strip() or "Authentication failed"
-                logger.warning(f"⚠️ Claude CLI not authenticated: {error_msg}")
-                logger.warning("Starting in degraded mode - authentication will be checked on first request")
-                return
-            
-            user_info = result.stdout.strip()
-            logger.info(f"✅ Claude CLI authenticated: {user_info}")
-            
-        except subprocess.TimeoutExpired:
-            logger.warning("⚠️ Claude CLI authentication check timed out - starting in degraded mode")
-            logger.warning("Authentication will be checked on first request")
-        except Exception as e:
-            logger.warning(f"⚠️ Authentication verification failed: {e}")
-            logger.warning("Starting in degraded mode - authentication will be checked on first request")
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ {self._active_requests} request(s) still running after {timeout}s drain")
+        await self.processes.terminate_all(grace=self.config.SHUTDOWN_KILL_GRACE)
+    
+    def _request_started(self):
+        self._active_requests += 1
+        self._idle.clear()
+        if self.draining:
+            raise SchedulerRejected("Server is shutting down", status_code=503, retry_after=1)
+    
+    def _request_finished(self):
+        self._active_requests -= 1
+        if self._active_requests == 0:
+            self._idle.set()
+    
+    async def close(self):
+        """Stop background resources"""
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self.worker_pool:
+            await self.worker_pool.close()
+            self.worker_pool = None
+        await self.processes.terminate_all(grace=self.config.SHUTDOWN_KILL_GRACE)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _cli_cache_file(self) -> Optional[Path]:
+        return Path(self.config.CLAUDE_CLI_CACHE_FILE) if self.config.CLAUDE_CLI_CACHE_FILE else None
+    
+    def _locate_claude_command(self) -> Optional[str]:
+        """Find Claude Code CLI command without running a subprocess, if possible"""
+        self.cli = locate_claude_cli(self.config.CLAUDE_CLI_PATH, self._cli_cache_file())
+        if self.cli is None:
+            return None
+        logger.info(f"✅ Found Claude CLI ({self.cli.source}): {self.cli.command}")
+        return self.cli.command
+    
+    async def _find_claude_command(self) -> str:
+        """Find Claude Code CLI command, falling back to npx"""
+        self.cli = await resolve_claude_cli(self.config.CLAUDE_CLI_PATH, self._cli_cache_file())
+        logger.info(f"✅ Found Claude CLI ({self.cli.source}): {self.cli.command}")
+        return self.cli.command
     
     def _convert_messages_to_prompt(self, messages: List[Dict]) -> str:
         """Convert OpenAI messages format to Claude prompt"""
@@ -170,14 +422,24 @@ class ClaudeCodeClient:
         """Map OpenAI model names to Claude model identifiers"""
         return self.MODEL_MAPPING.get(openai_model, "claude-3-sonnet-20240229")
     
-    def _apply_temperature_instruction(self, prompt: str, temperature: float) -> str:
-        """Apply temperature as instruction since Claude CLI might not support it directly"""
+    # Instructions standing in for temperature, by bucket
+    TEMPERATURE_INSTRUCTIONS = {
+        "precise": "Please be precise, focused, and concise in your response.",
+        "balanced": "Please provide a balanced and natural response.",
+        "creative": "Please be creative, varied, and expressive in your response.",
+    }
+    
+    def _temperature_bucket(self, temperature: float) -> str:
+        """Collapse temperature into the instruction it produces"""
         if temperature < 0.3:
-            instruction = "Please be precise, focused, and concise in your response."
+            return "precise"
         elif temperature > 0.7:
-            instruction = "Please be creative, varied, and expressive in your response."
-        else:
-            instruction = "Please provide a balanced and natural response."
+            return "creative"
+        return "balanced"
+    
+    def _apply_temperature_instruction(self, prompt: str, temperature: float) -> str:
+        """Apply temperature as instruction since Claude CLI might not support it directly"""
+        instruction = self.TEMPERATURE_INSTRUCTIONS[self._temperature_bucket(temperature)]
         
         # Insert instruction before the final "Assistant:" if present
         if prompt.endswith("Assistant:"):
@@ -187,37 +449,48 @@ class ClaudeCodeClient:
         
         return prompt
     
-    async def _run_claude_command(self, prompt: str, model: str, temperature: float = 1.0) -> str:
+    async def _run_claude_command(
+        self,
+        prompt: str,
+        model: str,
+        temperature: float = 1.0,
+        resume_session: Optional[str] = None
+    ) -> CLIResult:
         """Run Claude CLI command asynchronously"""
         try:
             # Apply temperature as instruction
             if temperature != 1.0:
                 prompt = self._apply_temperature_instruction(prompt, temperature)
             
-            # Build command - let system prompt from bot determine the mode
-            cmd = self.claude_cmd.split() + [
-                "--print",  # Print output to stdout
-                "--model", model,
-                prompt  # The prompt as the last argument
-            ]
+            if self.worker_pool and not resume_session:
+                with CLI_RUNTIME.labels(model, "pool").time():
+                    return await self._run_pooled_command(prompt, model)
             
             logger.debug(f"Executing Claude command with model: {model}")
+            started = time.perf_counter()
             
-            # Execute command
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=self.temp_dir
-            )
+            args = ["--print", "--model", model]  # Print output to stdout
+            # Session reuse needs the session id, which only JSON output carries
+            structured = self.config.CLAUDE_OUTPUT_FORMAT == "json" or self.session_store is not None
+            if structured:
+                args += ["--output-format", "json"]
+            if resume_session:
+                args += self._resume_args(resume_session)
             
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(), 
-                timeout=self.claude_cmd_timeout
-            )
+            # Execute command - let system prompt from bot determine the mode
+            process, stdin_data = await self._spawn_cli(args, prompt)
+            
+            try:
+                stdout, stderr = await self._communicate_bounded(
+                    process, stdin_data, timeout=self.claude_cmd_timeout
+                )
+            except asyncio.CancelledError:
+                self._record_cancelled(started, prompt, model)
+                raise
+            CLI_RUNTIME.labels(model, "oneshot").observe(time.perf_counter() - started)
             
             if process.returncode != 0:
-                error_msg = stderr.decode('utf-8').strip()
+                error_msg = stderr.decode('utf-8', errors='replace').strip() or f"exit code {process.returncode}"
                 logger.error(f"❌ Claude CLI error (code {process.returncode}): {error_msg}")
                 
                 if "not authenticated" in error_msg.lower():
@@ -227,35 +500,498 @@ class ClaudeCodeClient:
                 else:
                     raise RuntimeError(f"Claude CLI failed: {error_msg}")
             
-            response = stdout.decode('utf-8').strip()
+            result = self._parse_json_result(stdout) if structured else CLIResult(text=self._decode_stripped(stdout))
+            del stdout
             
-            if not response:
+            if not result.text:
                 raise RuntimeError("Empty response from Claude CLI")
             
-            logger.debug(f"Claude response length: {len(response)} characters")
-            return response
+            logger.debug(f"Claude response length: {len(result.text)} characters")
+            return result
             
         except asyncio.TimeoutError:
             logger.error(f"❌ Claude CLI command timed out after {self.claude_cmd_timeout}s")
             raise RuntimeError(f"Claude CLI timed out after {self.claude_cmd_timeout}s")
+        except SchedulerRejected:
+            # No pooled worker came free in time; answered as 503, not a CLI failure
+            raise
         except Exception as e:
             logger.error(f"❌ Claude CLI execution error: {e}")
             raise RuntimeError(f"Claude CLI execution failed: {e}")
     
+    def _parse_json_result(self, output: bytearray) -> CLIResult:
+        """Parse the single result object printed by --output-format json
+        
+        json.loads decodes the buffer to a str before parsing, so the raw
+        bytes, that str and the extracted text are all alive at the peak.
+        """
+        try:
+            event = json.loads(output)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise RuntimeError(f"Unparseable JSON output from Claude CLI: {bytes(output[:200])!r}")
+        
+        result = CLIResult.from_event(event)
+        if event.get("is_error"):
+            raise RuntimeError(f"Claude CLI failed: {result.text or event.get('subtype', 'unknown error')}")
+        return result
+    
+    async def _run_pooled_command(self, prompt: str, model: str) -> CLIResult:
+        """Run a prompt on a warm pooled worker instead of spawning a process"""
+        started = time.perf_counter()
+        async with self.worker_pool.acquire(model) as worker:
+            logger.debug(f"Executing prompt on pooled worker pid={worker.process.pid} model={model}")
+            try:
+                result = await asyncio.wait_for(worker.run(prompt), timeout=self.claude_cmd_timeout)
+            except asyncio.CancelledError:
+                self._record_cancelled(started, prompt, model)
+                raise
+        
+        response = CLIResult.from_event(result)
+        if result.get("is_error"):
+            logger.error(f"❌ Claude CLI error (pooled worker): {response.text}")
+            raise RuntimeError(f"Claude CLI failed: {response.text}")
+        if not response.text:
+            raise RuntimeError("Empty response from Claude CLI")
+        
+        logger.debug(f"Claude response length: {len(response.text)} characters")
+        # Pooled workers' sessions hold other requests' turns; never resume them
+        response.session_id = None
+        return response
+    
+    async def _stream_claude_command(
+        self,
+        prompt: str,
+        model: str,
+        temperature: float = 1.0,
+        resume_session: Optional[str] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Run Claude CLI and yield text deltas as soon as the CLI emits them"""
+        if temperature != 1.0:
+            prompt = self._apply_temperature_instruction(prompt, temperature)
+        
+        started = time.perf_counter()
+        if self.worker_pool and not resume_session:
+            async with self.worker_pool.acquire(model) as worker:
+                logger.debug(f"Streaming prompt on pooled worker pid={worker.process.pid} model={model}")
+                try:
+                    async for text in self._text_from_events(self._with_deadline(worker.stream(prompt)), on_result):
+                        yield text
+                except (asyncio.CancelledError, GeneratorExit):
+                    self._record_cancelled(started, prompt, model)
+                    raise
+            CLI_RUNTIME.labels(model, "pool_stream").observe(time.perf_counter() - started)
+            return
+        
+        logger.debug(f"Streaming Claude command with model: {model}")
+        
+        process, stdin_data = await self._spawn_cli(
+            [
+                "--print",
+                "--output-format", "stream-json",
+                "--verbose",
+                "--include-partial-messages",
+                "--model", model
+            ] + (self._resume_args(resume_session) if resume_session else []),
+            prompt,
+            limit=STREAM_LINE_LIMIT
+        )
+        feeder = asyncio.create_task(self._feed_stdin(process, stdin_data)) if stdin_data is not None else None
+        stderr_task = asyncio.create_task(self._read_stderr_bounded(process))
+        
+        try:
+            events = self._with_deadline(self._read_stream_events(process))
+            async for text in self._text_from_events(events, on_result):
+                yield text
+            
+            await process.wait()
+            CLI_RUNTIME.labels(model, "stream").observe(time.perf_counter() - started)
+            if process.returncode != 0:
+                error_msg = (await stderr_task).decode('utf-8', errors='replace').strip() or f"exit code {process.returncode}"
+                logger.error(f"❌ Claude CLI error (code {process.returncode}): {error_msg}")
+                raise RuntimeError(f"Claude CLI failed: {error_msg}")
+        except (asyncio.CancelledError, GeneratorExit):
+            self._record_cancelled(started, prompt, model)
+            raise
+        finally:
+            if feeder:
+                feeder.cancel()
+            stderr_task.cancel()
+            if process.returncode is None:
+                await kill_group(process)
+    
+    async def _spawn_cli(self, args: List[str], prompt: str, **kwargs):
+        """Start a one-shot CLI process, handing it the prompt via the configured transport
+        
+        With the stdin transport the prompt never appears in argv, so it is not
+        bounded by ARG_MAX/MAX_ARG_STRLEN, not visible in ps, and not copied
+        through exec. Returns the process and the bytes still to be written to
+        its stdin (None for argv).
+        """
+        use_stdin = self.config.CLAUDE_PROMPT_TRANSPORT != "argv"
+        cmd = self.claude_cmd.split() + args + ([] if use_stdin else [prompt])
+        
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if use_stdin else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.temp_dir,
+            **SPAWN_KWARGS,
+            **kwargs
+        )
+        PROCESS_SPAWN.labels("oneshot").observe(time.perf_counter() - started)
+        self.processes.add(process)
+        return process, (prompt.encode('utf-8') if use_stdin else None)
+    
+    async def _feed_stdin(self, process, data: bytes):
+        """Write the prompt to a streaming process's stdin, then close it"""
+        try:
+            process.stdin.write(data)
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+    
+    async def _communicate_bounded(self, process, stdin_data: Optional[bytes], timeout: float) -> Tuple[bytes, bytes]:
+        """Like process.communicate(), but with capped stdout and stderr buffers
+        
+        stdout is read in chunks into one growing bytearray and the process is
+        killed once it passes CLAUDE_MAX_OUTPUT_BYTES; stderr keeps only its
+        first CLAUDE_MAX_STDERR_BYTES. The process group is also killed on
+        timeout or when the caller is cancelled.
+        """
+        feeder = asyncio.create_task(self._feed_stdin(process, stdin_data)) if stdin_data is not None else None
+        stderr_task = asyncio.create_task(self._read_stderr_bounded(process))
+        
+        try:
+            stdout = await asyncio.wait_for(self._read_stdout_bounded(process), timeout=timeout)
+            await process.wait()
+            return stdout, await stderr_task
+        finally:
+            if feeder:
+                feeder.cancel()
+            stderr_task.cancel()
+            if process.returncode is None:
+                await kill_group(process)
+    
+    async def _read_stdout_bounded(self, process) -> bytearray:
+        """Read stdout to EOF in chunks, failing once it passes CLAUDE_MAX_OUTPUT_BYTES"""
+        limit = self.config.CLAUDE_MAX_OUTPUT_BYTES
+        stdout = bytearray()
+        while True:
+            chunk = await process.stdout.read(64 * 1024)
+            if not chunk:
+                return stdout
+            stdout += chunk
+            if len(stdout) > limit:
+                raise RuntimeError(f"Claude CLI output exceeded {limit} bytes")
+    
+    def _record_cancelled(self, started: float, prompt: str, model: str):
+        """Count a CLI call abandoned because its caller went away
+        
+        The seconds saved are an estimate: the prompt's cost times the
+        average slot hold time per unit of cost, or the CLI timeout before
+        any request has completed, capped at the timeout, less what the
+        call had already run.
+        """
+        elapsed = time.perf_counter() - started
+        expected = float(self.claude_cmd_timeout)
+        per_cost = self.scheduler.average_seconds_per_cost
+        if per_cost:
+            expected = min(expected, self.cost_estimator.estimate(len(prompt), model) * per_cost)
+        CANCELLED_CALLS.inc()
+        CANCELLED_WORK_SECONDS.inc(max(0.0, expected - elapsed))
+        logger.info(f"🔌 Cancelled Claude CLI call after {elapsed:.2f}s")
+    
+    @staticmethod
+    def _decode_stripped(buffer: bytearray) -> str:
+        """Decode buffer without surrounding whitespace, without an extra bytes copy"""
+        start, end = 0, len(buffer)
+        while start < end and buffer[start] in b" \t\r\n":
+            start += 1
+        while end > start and buffer[end - 1] in b" \t\r\n":
+            end -= 1
+        with memoryview(buffer) as view:
+            return str(view[start:end], 'utf-8', errors='replace')
+    
+    async def _read_stderr_bounded(self, process) -> bytes:
+        """Drain stderr so the child never blocks on it, keeping only a prefix"""
+        limit = self.config.CLAUDE_MAX_STDERR_BYTES
+        kept = bytearray()
+        dropped = 0
+        while True:
+            chunk = await process.stderr.read(16 * 1024)
+            if not chunk:
+                break
+            room = limit - len(kept)
+            if room > 0:
+                kept += chunk[:room]
+            dropped += max(0, len(chunk) - max(room, 0))
+        if dropped:
+            kept += f"\n... [{dropped} bytes of stderr truncated]".encode('utf-8')
+        return bytes(kept)
+    
+    async def _read_stream_events(self, process) -> AsyncGenerator[Dict[str, Any], None]:
+        """Yield line-framed JSON events from a stream-json CLI process"""
+        limit = self.config.CLAUDE_MAX_OUTPUT_BYTES
+        received = 0
+        async for line in process.stdout:
+            received += len(line)
+            if received > limit:
+                raise RuntimeError(f"Claude CLI output exceeded {limit} bytes")
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug(f"Skipping non-JSON CLI output: {line[:200]!r}")
+                continue
+            yield event
+            if event.get("type") == "result":
+                return
+    
+    async def _with_deadline(self, events: AsyncGenerator) -> AsyncGenerator[Dict[str, Any], None]:
+        """Enforce the CLI timeout across the whole event stream"""
+        deadline = time.monotonic() + self.claude_cmd_timeout
+        iterator = events.__aiter__()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    event = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    return
+                yield event
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Claude CLI stream timed out after {self.claude_cmd_timeout}s")
+            raise RuntimeError(f"Claude CLI timed out after {self.claude_cmd_timeout}s")
+        finally:
+            await iterator.aclose()
+    
+    async def _text_from_events(
+        self,
+        events: AsyncGenerator,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Turn CLI stream-json events into text deltas"""
+        saw_delta = False
+        async for event in events:
+            event_type = event.get("type")
+            
+            if event_type == "stream_event":
+                inner = event.get("event", {})
+                delta = inner.get("delta", {})
+                if inner.get("type") == "content_block_delta" and delta.get("type") == "text_delta":
+                    saw_delta = True
+                    yield delta.get("text", "")
+            
+            elif event_type == "assistant" and not saw_delta:
+                # CLI without partial-message support: forward whole messages
+                for block in event.get("message", {}).get("content", []):
+                    if block.get("type") == "text":
+                        yield block.get("text", "")
+            
+            elif event_type == "result":
+                if event.get("is_error"):
+                    error_msg = event.get("result") or event.get("subtype", "unknown error")
+                    logger.error(f"❌ Claude CLI error: {error_msg}")
+                    raise RuntimeError(f"Claude CLI failed: {error_msg}")
+                if on_result:
+                    on_result(event)
+                return
+    
     @property
     def claude_cmd_timeout(self) -> int:
         """Get Claude command timeout from config"""
         return self.config.CLAUDE_CLI_TIMEOUT
     
-    def _estimate_tokens(self, text: str) -> int:
-        """Rough token estimation (1 token ≈ 0.75 words)"""
-        return max(1, int(len(text.split()) * 1.3))
+    # Anthropic stop_reason -> OpenAI finish_reason
+    FINISH_REASONS = {
+        "end_turn": "stop",
+        "stop_sequence": "stop",
+        "max_tokens": "length",
+        "tool_use": "tool_calls",
+        "refusal": "content_filter",
+    }
+    
+    def _finish_reason(self, result: Optional[CLIResult]) -> str:
+        if result is None or not result.stop_reason:
+            return "stop"
+        return self.FINISH_REASONS.get(result.stop_reason, "stop")
+    
+    def _usage(self, messages: List[Dict], completion: str, result: Optional[CLIResult] = None) -> Dict[str, int]:
+        """OpenAI usage block: the CLI's own counts when reported, else our tokenizer's"""
+        if result is not None and result.prompt_tokens is not None and result.completion_tokens is not None:
+            prompt_tokens, completion_tokens = result.prompt_tokens, result.completion_tokens
+        else:
+            # History turns are counted once and memoized
+            prompt_tokens = self.token_counter.count_messages(messages)
+            completion_tokens = self.token_counter.count(completion)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    
+    def _request_key(self, messages: List[Dict], claude_model: str, temperature: float) -> str:
+        """Cache/coalescing key for a normalized request"""
+        bucket = "default" if temperature == 1.0 else self._temperature_bucket(temperature)
+        return completion_cache_key(claude_model, messages, bucket)
+    
+    def _record_cli_result(self, claude_model: str, result: CLIResult):
+        """Export what the CLI reported about one call"""
+        if result.duration_ms is not None:
+            CLI_REPORTED_DURATION.labels(claude_model).observe(result.duration_ms / 1000)
+        if result.stop_reason:
+            STOP_REASONS.labels(claude_model, result.stop_reason).inc()
+        for kind, count in (result.usage or {}).items():
+            if kind.endswith("_tokens") and isinstance(count, int):
+                TOKENS.labels(claude_model, kind[:-len("_tokens")]).inc(count)
+    
+    def _build_completion_response(
+        self,
+        request,
+        messages: List[Dict],
+        response_content: str,
+        result: Optional[CLIResult] = None
+    ) -> Dict[str, Any]:
+        """Build an OpenAI-compatible chat.completion body"""
+        usage = self._usage(messages, response_content, result)
+        
+        response = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.model,
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": response_content
+                },
+                "finish_reason": self._finish_reason(result)
+            }],
+            "usage": usage
+        }
+        if result is not None and result.duration_ms is not None:
+            response["claude"] = {"stop_reason": result.stop_reason, "duration_ms": result.duration_ms}
+        return response
+    
+    @staticmethod
+    def _resume_args(session_id: str) -> List[str]:
+        """Continue a stored session under a new id, leaving the stored one untouched
+        
+        A prefix stays resumable after it has been continued (edits,
+        regenerations, concurrent continuations), so every continuation
+        forks instead of appending turns the other branches must not see.
+        """
+        return ["--resume", session_id, "--fork-session"]
+    
+    def _session_for(self, messages: List[Dict], claude_model: str) -> Tuple[Optional[str], int]:
+        """CLI session this conversation extends, and how many messages it holds"""
+        if self.session_store is None or self.worker_pool:
+            return None, 0
+        return self.session_store.lookup(claude_model, messages)
+    
+    def _remember_session(self, messages: List[Dict], claude_model: str, reply: str, session_id: Optional[str]):
+        """Index the session by the conversation including the reply just produced"""
+        if self.session_store is not None and session_id:
+            conversation = messages + [{"role": "assistant", "content": reply}]
+            self.session_store.remember(claude_model, conversation, session_id)
+    
+    def _request_cost(self, prompt: str, claude_model: str) -> float:
+        """Admission cost of a prompt for the given Claude model"""
+        cost = self.cost_estimator.estimate(len(prompt), claude_model)
+        REQUEST_COST.labels(claude_model).observe(cost)
+        return cost
+    
+    async def _scheduled_run(
+        self,
+        messages: List[Dict],
+        prompt: str,
+        claude_model: str,
+        temperature: float,
+        priority: Optional[str] = None
+    ) -> CLIResult:
+        """Run the CLI once a slot in the priority lane is free, resuming a known session if possible"""
+        async with self.scheduler.slot(self._request_cost(prompt, claude_model), priority):
+            resume_id, covered = self._session_for(messages, claude_model)
+            result = None
+            
+            if resume_id:
+                new_prompt = self._convert_messages_to_prompt(messages[covered:])
+                logger.info(f"🔁 Resuming session {resume_id}: sending {len(messages) - covered} of {len(messages)} messages")
+                try:
+                    result = await self._run_claude_command(new_prompt, claude_model, temperature, resume_session=resume_id)
+                except RuntimeError as e:
+                    logger.warning(f"⚠️ Could not resume session {resume_id}, sending full history: {e}")
+                    self.session_store.forget(resume_id)
+            
+            if result is None:
+                result = await self._run_claude_command(prompt, claude_model, temperature)
+        
+        self._record_cli_result(claude_model, result)
+        self._remember_session(messages, claude_model, result.text, result.session_id)
+        return result
+    
+    async def _produce_stream(
+        self,
+        flight: StreamFlight,
+        messages: List[Dict],
+        prompt: str,
+        claude_model: str,
+        temperature: float,
+        priority: Optional[str] = None
+    ):
+        """Feed CLI text deltas into a stream flight once a slot in the priority lane is free"""
+        async with self.scheduler.slot(self._request_cost(prompt, claude_model), priority):
+            flight.admit()
+            resume_id, covered = self._session_for(messages, claude_model)
+            result: Dict[str, Any] = {}
+            
+            if resume_id:
+                new_prompt = self._convert_messages_to_prompt(messages[covered:])
+                logger.info(f"🔁 Resuming session {resume_id}: sending {len(messages) - covered} of {len(messages)} messages")
+                try:
+                    async for text in self._stream_claude_command(
+                        new_prompt, claude_model, temperature,
+                        resume_session=resume_id, on_result=result.update
+                    ):
+                        if text:
+                            flight.publish(text)
+                except RuntimeError as e:
+                    if flight.parts:
+                        raise
+                    logger.warning(f"⚠️ Could not resume session {resume_id}, sending full history: {e}")
+                    self.session_store.forget(resume_id)
+                    resume_id = None
+            
+            if not resume_id:
+                async for text in self._stream_claude_command(
+                    prompt, claude_model, temperature, on_result=result.update
+                ):
+                    if text:
+                        flight.publish(text)
+        
+        if result:
+            flight.result = CLIResult.from_event(result)
+            self._record_cli_result(claude_model, flight.result)
+        self._remember_session(messages, claude_model, "".join(flight.parts), result.get("session_id"))
     
-    async def chat_completion(self, request) -> Dict[str, Any]:
+    async def chat_completion(self, request, use_cache: bool = True, priority: Optional[str] = None) -> Dict[str, Any]:
         """Generate chat completion using Claude Code CLI"""
+        started = time.perf_counter()
+        model_label = getattr(request.model, "value", request.model)
+        status = "error"
+        IN_FLIGHT.labels("false").inc()
         try:
+            self._request_started()
             # Convert messages to prompt
-            prompt = self._convert_messages_to_prompt([msg.dict() for msg in request.messages])
+            messages = [msg.model_dump() for msg in request.messages]
+            prompt = self._convert_messages_to_prompt(messages)
             
             # Map model
             claude_model = self._map_model_to_claude(request.model)
@@ -263,95 +999,157 @@ class ClaudeCodeClient:
             # Get temperature
             temperature = getattr(request, 'temperature', 1.0)
             
-            logger.info(f"🔄 Processing request: model={claude_model}, prompt_length={len(prompt)}")
-            
-            # Call Claude CLI
-            response_content = await self._run_claude_command(prompt, claude_model, temperature)
-            
-            # Estimate token usage
-            prompt_tokens = self._estimate_tokens(prompt)
-            completion_tokens = self._estimate_tokens(response_content)
-            total_tokens = prompt_tokens + completion_tokens
-            
-            # Build OpenAI-compatible response
-            response = {
-                "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_content
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": prompt_tokens,
-                    "completion_tokens": completion_tokens,
-                    "total_tokens": total_tokens
-                }
-            }
+            request_key = None
+            if use_cache and (self.response_cache is not None or self.config.REQUEST_COALESCING_ENABLED):
+                request_key = self._request_key(messages, claude_model, temperature)
+            
+            if self.response_cache is not None and request_key:
+                cached = await self.response_cache.get(request_key)
+                if cached is not None:
+                    logger.info(f"✅ Completion served from cache: model={claude_model}")
+                    response = self._build_completion_response(request, messages, cached)
+                    status = "success"
+                    TIME_TO_FIRST_BYTE.labels("false").observe(time.perf_counter() - started)
+                    return response
+            
+            logger.info(f"🔄 Processing request: model={claude_model}, prompt_length={len(prompt)}, lane={priority or self.scheduler.default_lane}")
+            
+            if self.config.REQUEST_COALESCING_ENABLED and request_key:
+                result = await self.single_flight.do(
+                    request_key,
+                    lambda: self._scheduled_run(messages, prompt, claude_model, temperature, priority)
+                )
+            else:
+                result = await self._scheduled_run(messages, prompt, claude_model, temperature, priority)
+            response_content = result.text
+            
+            if self.response_cache is not None and request_key:
+                await self.response_cache.put(request_key, response_content)
+            
+            response = self._build_completion_response(request, messages, response_content, result)
             
-            logger.info(f"✅ Completion successful: {total_tokens} tokens")
+            logger.info(f"✅ Completion successful: {response['usage']['total_tokens']} tokens")
+            status = "success"
+            TIME_TO_FIRST_BYTE.labels("false").observe(time.perf_counter() - started)
             return response
             
+        except SchedulerRejected:
+            status = "rejected"
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
         except Exception as e:
             logger.error(f"❌ Chat completion error: {e}")
             raise RuntimeError(f"Chat completion failed: {e}")
+        finally:
+            self._request_finished()
+            IN_FLIGHT.labels("false").dec()
+            REQUESTS.labels(model_label, status, "false").inc()
     
-    async def chat_completion_stream(self, request) -> AsyncGenerator[str, None]:
-        """Generate streaming chat completion (simulated)"""
+    async def chat_completion_stream(
+        self,
+        request,
+        use_cache: bool = True,
+        priority: Optional[str] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """Generate streaming chat completion from incremental CLI output"""
+        started = time.perf_counter()
+        model_label = getattr(request.model, "value", request.model)
+        status = "error"
+        first_byte = True
+        IN_FLIGHT.labels("true").inc()
         try:
+            self._request_started()
             logger.info("🔄 Starting streaming completion...")
             
-            # Get full response first (Claude CLI doesn't natively stream)
-            response = await self.chat_completion(request)
-            content = response["choices"][0]["message"]["content"]
+            messages = [msg.model_dump() for msg in request.messages]
+            prompt = self._convert_messages_to_prompt(messages)
+            claude_model = self._map_model_to_claude(request.model)
+            temperature = getattr(request, 'temperature', 1.0)
             
-            # Stream the response word by word
-            words = content.split()
             chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
             created = int(time.time())
             
-            # Send opening chunk
-            for i, word in enumerate(words):
-                chunk = {
-                    "id": chunk_id,
-                    "object": "chat.completion.chunk",
-                    "created": created,
-                    "model": request.model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {"content": word + " "},
-                        "finish_reason": None
-                    }]
-                }
+            stream_options = getattr(request, "stream_options", None)
+            include_usage = bool(stream_options and stream_options.include_usage)
+            
+            encoder = sse.ChunkEncoder(chunk_id, created, request.model)
+            
+            def make_chunk(
+                delta: Optional[Dict[str, Any]],
+                finish_reason: Optional[str] = None,
+                usage: Optional[Dict[str, int]] = None
+            ) -> bytes:
+                encode_started = time.perf_counter()
+                frame = encoder.chunk(delta, finish_reason, usage)
+                SERIALIZATION.labels("chunk").observe(time.perf_counter() - encode_started)
+                return frame
+            
+            def content_chunk(text: str) -> bytes:
+                nonlocal first_byte
+                encode_started = time.perf_counter()
+                if first_byte:
+                    first_byte = False
+                    TIME_TO_FIRST_BYTE.labels("true").observe(encode_started - started)
+                frame = encoder.content(text)
+                SERIALIZATION.labels("chunk").observe(time.perf_counter() - encode_started)
+                return frame
+            
+            request_key = None
+            cached = None
+            if use_cache and (self.response_cache is not None or self.config.REQUEST_COALESCING_ENABLED):
+                request_key = self._request_key(messages, claude_model, temperature)
+            if self.response_cache is not None and request_key:
+                cached = await self.response_cache.get(request_key)
+            
+            if cached is not None:
+                # Replay the cached completion without touching the CLI
+                logger.info(f"✅ Streaming completion served from cache: model={claude_model}")
+                yield make_chunk({"role": "assistant"})
+                yield content_chunk(cached)
+                completion = cached
+                cli_result = None
+            else:
+                flight_key = request_key if self.config.REQUEST_COALESCING_ENABLED else None
                 
-                yield f"data: {json.dumps(chunk)}\n\n"
+                # Admission happens before the first chunk so rejections surface
+                # as exceptions the caller can turn into 429/503
+                async with self.stream_fanout.join(
+                    flight_key,
+                    lambda flight: self._produce_stream(flight, messages, prompt, claude_model, temperature, priority)
+                ) as flight:
+                    # Opening chunk carries the role, as OpenAI does
+                    yield make_chunk({"role": "assistant"})
+                    
+                    # Deltas are coalesced into fewer, larger frames; heartbeats
+                    # keep the connection alive while the CLI is quiet
+                    async for text in flight.iter_batches(
+                        self.config.STREAM_FLUSH_INTERVAL_MS / 1000,
+                        self.config.STREAM_FLUSH_SIZE,
+                        self.config.STREAM_HEARTBEAT_INTERVAL or None
+                    ):
+                        yield content_chunk(text) if text is not None else sse.HEARTBEAT
                 
-                # Small delay for realistic streaming
-                await asyncio.sleep(0.03)
-            
-            # Send final chunk
-            final_chunk = {
-                "id": chunk_id,
-                "object": "chat.completion.chunk", 
-                "created": created,
-                "model": request.model,
-                "choices": [{
-                    "index": 0,
-                    "delta": {},
-                    "finish_reason": "stop"
-                }]
-            }
+                completion = "".join(flight.parts)
+                cli_result = flight.result
+                if self.response_cache is not None and request_key and flight.parts:
+                    await self.response_cache.put(request_key, completion.strip())
             
-            yield f"data: {json.dumps(final_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield make_chunk({}, self._finish_reason(cli_result))
+            if include_usage:
+                yield make_chunk(None, usage=self._usage(messages, completion, cli_result))
+            yield sse.DONE
             
+            status = "success"
             logger.info("✅ Streaming completion finished")
             
+        except SchedulerRejected:
+            status = "rejected"
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            status = "cancelled"
+            raise
         except Exception as e:
             logger.error(f"❌ Streaming completion error: {e}")
             error_chunk = {
@@ -361,19 +1159,49 @@ class ClaudeCodeClient:
                     "code": "internal_error"
                 }
             }
-            yield f"data: {json.dumps(error_chunk)}\n\n"
+            yield sse.frame(error_chunk)
+        finally:
+            self._request_finished()
+            IN_FLIGHT.labels("true").dec()
+            REQUESTS.labels(model_label, status, "true").inc()
     
-    def check_health(self) -> Dict[str, Any]:
+    async def _run_cli_probe(self, args: List[str], timeout: float) -> subprocess.CompletedProcess:
+        """Run a short CLI probe without blocking the event loop"""
+        process = await asyncio.create_subprocess_exec(
+            *(self.claude_cmd.split() + args),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **SPAWN_KWARGS
+        )
+        self.processes.add(process)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await kill_group(process)
+            raise
+        return subprocess.CompletedProcess(
+            args, process.returncode,
+            stdout.decode('utf-8', errors='replace'),
+            stderr.decode('utf-8', errors='replace')
+        )
+    
+    async def probe_health(self) -> Dict[str, Any]:
         """Check Claude CLI health and authentication status"""
         try:
-            # Check command availability
-            cmd = self.claude_cmd.split() + ["--version"]
-            version_result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
+            # Version and authentication are independent, so probe both at once;
+            # when one fails the other is cancelled, which kills its process
+            version_task = asyncio.ensure_future(self._run_cli_probe(["--version"], timeout=5))
+            auth_task = asyncio.ensure_future(self._run_cli_probe(["auth", "whoami"], timeout=30))
+            try:
+                await asyncio.wait((version_task, auth_task), return_when=asyncio.FIRST_EXCEPTION)
+            finally:
+                for task in (version_task, auth_task):
+                    task.cancel()
+                await asyncio.wait((version_task, auth_task))
+            for task in (version_task, auth_task):
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+            version_result, auth_result = version_task.result(), auth_task.result()
             
             if version_result.returncode != 0:
                 return {
@@ -382,15 +1210,7 @@ class ClaudeCodeClient:
                     "command": self.claude_cmd
                 }
             
-            # Check authentication
-            auth_cmd = self.claude_cmd.split() + ["auth", "whoami"]
-            auth_result = subprocess.run(
-                auth_cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
+            self._remember_version(version_result.stdout.strip())
             if auth_result.returncode == 0:
                 return {
                     "claude_cli": "healthy",
@@ -408,6 +1228,12 @@ class ClaudeCodeClient:
                     "version": version_result.stdout.strip()
                 }
                 
+        except asyncio.TimeoutError:
+            return {
+                "claude_cli": "unhealthy",
+                "error": "Claude CLI health probe timed out",
+                "command": self.claude_cmd
+            }
         except Exception as e:
             return {
                 "claude_cli": "unhealthy",
@@ -415,10 +1241,43 @@ class ClaudeCodeClient:
                 "command": self.claude_cmd
             }
     
-    def __del__(self):
-        """Cleanup temporary directory on deletion"""
-        try:
-            if hasattr(self, 'temp_dir') and self.temp_dir.exists():
-                shutil.rmtree(self.temp_dir, ignore_errors=True)
-        except:
-            pass
+    def _remember_version(self, version: str):
+        """Keep the resolution cache's version in step with the installed CLI"""
+        if not self.cli or self.cli.version == version:
+            return
+        self.cli.version = version
+        if self.config.CLAUDE_CLI_CACHE_FILE:
+            save_cached(Path(self.config.CLAUDE_CLI_CACHE_FILE), self.cli)
+    
+    async def refresh_health(self) -> Dict[str, Any]:
+        """Probe the CLI now and update the cached result"""
+        self._health = await self.probe_health()
+        self._health_checked_at = time.time()
+        return self._health
+    
+    async def _health_loop(self):
+        """Re-probe the CLI every HEALTH_CHECK_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(self.config.HEALTH_CHECK_INTERVAL)
+            try:
+                health = await self.refresh_health()
+                if health.get("claude_cli") != "healthy":
+                    logger.warning(f"⚠️ Claude CLI health check: {health}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Health probe failed: {e}")
+    
+    def check_health(self) -> Dict[str, Any]:
+        """Return the last probed health status without touching the CLI"""
+        if self._health_checked_at is None:
+            return {"claude_cli": "unknown", "error": "Health not probed yet", "command": self.claude_cmd}
+        
+        age = time.time() - self._health_checked_at
+        health = dict(self._health)
+        health["checked_at"] = self._health_checked_at
+        health["age_seconds"] = round(age, 3)
+        if age > self.config.HEALTH_STALE_AFTER:
+            health["claude_cli"] = "stale"
+            health["error"] = f"Last health probe is {int(age)}s old"
+        return health
@@ -0,0 +1,43 @@
+"""
+Fast JSON
+Compact UTF-8 encoding for response bodies and stream chunks; uses orjson when installed
+"""
+
+import json
+import logging
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps_stdlib(obj: Any) -> bytes:
+    # Same compact, non-ASCII-escaping form orjson produces
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _dumps_orjson(obj: Any) -> bytes:
+    return orjson.dumps(obj)
+
+
+# Encoder in use; callers look it up on the module so set_backend applies everywhere
+dumps = _dumps_orjson if orjson is not None else _dumps_stdlib
+backend = "orjson" if orjson is not None else "json"
+
+
+def set_backend(mode: str = "auto") -> str:
+    """Select the encoder: "orjson", "json", or "auto" (orjson when installed)"""
+    global dumps, backend
+    mode = mode.lower()
+    if mode == "orjson" and orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson requires the 'orjson' package: pip install orjson")
+    if mode not in ("auto", "orjson", "json"):
+        raise RuntimeError(f"Unknown JSON_BACKEND: {mode}")
+    backend = "json" if mode == "json" or orjson is None else "orjson"
+    dumps = _dumps_orjson if backend == "orjson" else _dumps_stdlib
+    logger.info(f"✅ JSON encoding with {backend}")
+    return backend
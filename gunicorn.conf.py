@@ -0,0 +1,47 @@
+"""
+Gunicorn configuration for multi-worker mode
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Runs WEB_CONCURRENCY uvicorn workers. Concurrency slots, rate limits, the
+response cache and Prometheus metrics are shared through SHARED_STATE_DIR,
+so MAX_CONCURRENCY and RATE_LIMIT_REQUESTS stay host-wide limits.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Set before workers fork and import main, so every worker sees the same paths
+shared_state_dir = os.environ.setdefault(
+    "SHARED_STATE_DIR", os.path.join(tempfile.gettempdir(), "claude-wrapper-shared")
+)
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(shared_state_dir, "metrics")
+)
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Passes the drain deadline on to uvicorn; the stock worker does not
+worker_class = "uvicorn_worker.DrainingUvicornWorker"
+keepalive = 5
+# Workers drain in-flight requests before exiting (see SHUTDOWN_DRAIN_TIMEOUT);
+# a little longer than the worker's own deadline, so SIGKILL is the last resort
+graceful_timeout = int(float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30)) + float(os.getenv("SHUTDOWN_KILL_GRACE", 5)) + 5)
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def on_starting(server):
+    """Start from an empty metrics directory; stale mmap files would skew counters"""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    os.makedirs(shared_state_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from the merged metrics"""
+    # Imported here: prometheus_client picks its value store at import time,
+    # which must happen after PROMETHEUS_MULTIPROC_DIR is set
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,127 @@
+"""
+Event Loop Monitor
+Loop-lag sampling and detection of code that blocks the event loop
+"""
+
+import asyncio
+import inspect
+import sys
+import threading
+import time
+import logging
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, Optional, Tuple
+
+from metrics import LOOP_LAG, LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _blocking_site(frame: Optional[FrameType]) -> Tuple[str, str]:
+    """(coroutine, location) of a loop thread stack caught mid-stall
+
+    The coroutine is the innermost one on the stack, i.e. the task whose
+    step is blocking; the location is the innermost line of this project's
+    code, which is usually the call to fix.
+    """
+    coroutine, location = "unknown", "unknown"
+    while frame is not None:
+        code = frame.f_code
+        if location == "unknown" and code.co_filename.startswith(str(ROOT)):
+            location = f"{Path(code.co_filename).name}:{frame.f_lineno} in {code.co_name}"
+        if coroutine == "unknown" and code.co_flags & (inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR):
+            coroutine = getattr(code, "co_qualname", code.co_name)
+            if location == "unknown":
+                # Blocking outside this project's code: point at the coroutine itself
+                location = f"{Path(code.co_filename).name}:{frame.f_lineno}"
+        if coroutine != "unknown":
+            break
+        frame = frame.f_back
+    return coroutine, location
+
+
+class LoopMonitor:
+    """Samples timer drift on the running loop; a watchdog thread names stalls
+
+    A task sleeps for interval and records how late it wakes up (the loop
+    lag histogram). When it has not woken for slow_threshold past its
+    deadline, the watchdog thread captures the loop thread's stack, so the
+    stall is logged with the coroutine and line that held the loop. Works
+    the same on uvloop, where asyncio's debug-mode slow callback log does not.
+    """
+
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.1):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: Optional[int] = None
+        # Monotonic time the sampler is next due to wake up
+        self._deadline = 0.0
+        # Where the loop was caught blocked during the current stall
+        self._site: Optional[Tuple[str, str]] = None
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls_total = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if loop.get_debug():
+            # asyncio's own slow-callback log uses the same threshold
+            loop.slow_callback_duration = self.slow_threshold
+        self._loop_thread = threading.get_ident()
+        self._deadline = time.monotonic() + self.interval
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"✅ Event loop monitor started (slow callbacks > {self.slow_threshold * 1000:.0f}ms are logged)")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _sample(self):
+        while True:
+            self._deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._deadline)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+            if lag >= self.slow_threshold:
+                coroutine, location = self._site or ("unknown", "unknown")
+                self.stalls_total += 1
+                LOOP_STALLS.labels(coroutine).inc()
+                logger.warning(f"🐢 Event loop blocked for {lag * 1000:.0f}ms by {coroutine} at {location}")
+            self._site = None
+
+    def _watch(self):
+        """Watchdog thread: snapshot the loop thread's stack while it is stalled"""
+        while not self._stopped.wait(self.slow_threshold / 2):
+            overdue = time.monotonic() - self._deadline
+            if overdue < self.slow_threshold or self._site is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            try:
+                self._site = _blocking_site(frame)
+            finally:
+                del frame
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "stalls_total": self.stalls_total,
+        }
@@ -3,12 +3,15 @@ Claude Code OpenAI Wrapper - Main Application
 A production-ready OpenAI-compatible API wrapper for Claude Code CLI
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Security
+from fastapi import FastAPI, HTTPException, Depends, Security, Request, UploadFile, File, Form
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Union
+from starlette.datastructures import MutableHeaders
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from typing import List, Optional, Dict, Any, Type, Union, AsyncGenerator
 import asyncio
 import json
 import time
@@ -16,11 +19,21 @@ import uuid
 from datetime import datetime
 import logging
 import os
+import signal
+import threading
 from enum import Enum
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 # Import Claude CLI client
+from batches import BatchError, BatchManager, FileStore, default_data_dir, owner_id
 from corrected_claude_client import ClaudeCodeClient, Config
+import fast_json
+from loop_monitor import LoopMonitor
+import sse
+from metrics import CONTENT_TYPE_LATEST, RATE_LIMITED, SERIALIZATION, register_state_collectors, render_metrics
+from rate_limiter import create_rate_limiter
+from scheduler import SchedulerRejected
 
 # Configure logging
 logging.basicConfig(
@@ -32,6 +45,18 @@ logger = logging.getLogger(__name__)
 # Load configuration
 config = Config()
 
+# Encoder for response bodies and stream chunks (orjson when installed)
+fast_json.set_backend(config.JSON_BACKEND)
+
+# Per-key rate limiting (RATE_LIMIT_REQUESTS per RATE_LIMIT_WINDOW seconds)
+rate_limiter = create_rate_limiter(config)
+
+# Event loop lag sampler and blocking-code detector
+loop_monitor = LoopMonitor(
+    interval=config.LOOP_LAG_INTERVAL,
+    slow_threshold=config.SLOW_CALLBACK_MS / 1000,
+) if config.LOOP_MONITOR_ENABLED else None
+
 # Security
 security = HTTPBearer(auto_error=False)
 
@@ -61,6 +86,10 @@ class Message(BaseModel):
     content: str
     name: Optional[str] = None
 
+class StreamOptions(BaseModel):
+    """Streaming options (OpenAI stream_options)"""
+    include_usage: bool = False
+
 class ChatCompletionRequest(BaseModel):
     """OpenAI-compatible chat completion request"""
     model: ModelType
@@ -70,6 +99,7 @@ class ChatCompletionRequest(BaseModel):
     top_p: Optional[float] = Field(default=1.0, ge=0.0, le=1.0)
     n: Optional[int] = Field(default=1, ge=1, le=1)
     stream: Optional[bool] = False
+    stream_options: Optional[StreamOptions] = None
     stop: Optional[Union[str, List[str]]] = None
     presence_penalty: Optional[float] = Field(default=0.0, ge=-2.0, le=2.0)
     frequency_penalty: Optional[float] = Field(default=0.0, ge=-2.0, le=2.0)
@@ -87,6 +117,11 @@ class Usage(BaseModel):
     completion_tokens: int
     total_tokens: int
 
+class ClaudeInfo(BaseModel):
+    """What the CLI reported about the call (non-OpenAI extension)"""
+    stop_reason: Optional[str] = None
+    duration_ms: Optional[float] = None
+
 class ChatCompletionResponse(BaseModel):
     """OpenAI-compatible chat completion response"""
     id: str
@@ -95,6 +130,7 @@ class ChatCompletionResponse(BaseModel):
     model: str
     choices: List[Choice]
     usage: Usage
+    claude: Optional[ClaudeInfo] = None
 
 class ModelInfo(BaseModel):
     """Model information"""
@@ -112,19 +148,94 @@ class ErrorResponse(BaseModel):
     """Error response"""
     error: Dict[str, str]
 
+class BatchCreateRequest(BaseModel):
+    """OpenAI-compatible batch creation request"""
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, str]] = None
+
+# The model list never changes while running, so its bodies are encoded once;
+# "created" is when this process started
+MODELS_CREATED = int(time.time())
+MODEL_INFO_BODIES = {
+    model_type.value: ModelInfo(id=model_type.value, created=MODELS_CREATED).model_dump_json().encode("utf-8")
+    for model_type in ModelType
+}
+MODELS_BODY = ModelsResponse(
+    data=[ModelInfo(id=model_type.value, created=MODELS_CREATED) for model_type in ModelType]
+).model_dump_json().encode("utf-8")
+
 # Global Claude client
 claude_client = None
 
+# Batch API storage and background runner
+batch_files: Optional[FileStore] = None
+batch_manager: Optional[BatchManager] = None
+if config.BATCH_ENABLED:
+    batch_data_dir = Path(config.BATCH_DATA_DIR) if config.BATCH_DATA_DIR else default_data_dir()
+    batch_files = FileStore(batch_data_dir / "files")
+    batch_manager = BatchManager(
+        batch_files,
+        batch_data_dir / "batches",
+        get_client=lambda: claude_client,
+        request_model=ChatCompletionRequest,
+        concurrency=config.BATCH_CONCURRENCY,
+        max_requests=config.BATCH_MAX_REQUESTS,
+        priority=config.BATCH_PRIORITY,
+        # Batch lines count against the submitting key's quota like live requests
+        rate_limit=rate_limiter.check if rate_limiter.enabled else None,
+    )
+
+# Health, scheduler, cache and pool gauges are read from the client at scrape time
+register_state_collectors(lambda: claude_client)
+
+def begin_shutdown():
+    """Stop taking work (new requests get 503) and start the drain deadline"""
+    if batch_manager is not None:
+        # Batch requests already running finish during the drain; the rest resume on restart
+        batch_manager.stop()
+    if claude_client is not None:
+        claude_client.begin_drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+
+def _drain_on_signal():
+    """Run begin_shutdown as soon as SIGTERM/SIGINT arrives
+    
+    The server only runs the lifespan shutdown once every open connection
+    has closed, i.e. after in-flight streams have finished on their own, so
+    the drain deadline has to start from the signal. The server's own
+    handler still runs: asyncio dispatches it through the signal wakeup fd.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+        
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(begin_shutdown)
+            if callable(previous):
+                previous(signum, frame)
+        
+        signal.signal(sig, handler)
+
+def graceful_shutdown_timeout() -> int:
+    """Seconds the server should wait for connections: the drain, the kill grace, and a margin"""
+    return int(config.SHUTDOWN_DRAIN_TIMEOUT + config.SHUTDOWN_KILL_GRACE) + 2
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan management"""
     global claude_client
     
     logger.info("🚀 Starting Claude Code OpenAI Wrapper")
+    if loop_monitor is not None:
+        await loop_monitor.start()
     
     try:
         # Initialize Claude client
         claude_client = ClaudeCodeClient()
+        await claude_client.start()
         logger.info("✅ Claude Code client initialized successfully")
         
         # Check health
@@ -134,6 +245,11 @@ async def lifespan(app: FastAPI):
         else:
             logger.warning(f"⚠️ Claude CLI health check: {health}")
         
+        if batch_manager is not None:
+            await batch_manager.start()
+        
+        _drain_on_signal()
+        
     except Exception as e:
         logger.error(f"❌ Failed to initialize Claude client: {e}")
         logger.error("Please ensure Claude Code CLI is installed and authenticated:")
@@ -144,6 +260,15 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("🛑 Shutting down Claude Code OpenAI Wrapper")
+    # Usually already started by the signal; this waits for it to finish
+    begin_shutdown()
+    await claude_client.begin_drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+    if batch_manager is not None:
+        await batch_manager.close()
+    await claude_client.close()
+    await rate_limiter.close()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
 
 # FastAPI app
 app = FastAPI(
@@ -164,10 +289,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RateLimitHeadersMiddleware:
+    """Attach X-RateLimit-* headers computed by verify_api_key
+    
+    Plain ASGI rather than @app.middleware("http"): the headers are added to
+    http.response.start as it passes, so responses are never re-wrapped and
+    streaming bodies go straight through.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        # Request.state reads and writes this same dict
+        state = scope.setdefault("state", {})
+        
+        async def send_with_headers(message):
+            result = state.get("rate_limit")
+            if message["type"] == "http.response.start" and result is not None:
+                message.setdefault("headers", [])
+                headers = MutableHeaders(scope=message)
+                for name, value in result.headers.items():
+                    headers.setdefault(name, value)
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+app.add_middleware(RateLimitHeadersMiddleware)
+
+async def enforce_rate_limit(request: Request, key: str):
+    """Count the request against key's quota, rejecting with 429 when exhausted"""
+    if not rate_limiter.enabled:
+        return
+    
+    result = await rate_limiter.check(key)
+    request.state.rate_limit = result
+    if not result.allowed:
+        RATE_LIMITED.inc()
+        logger.warning(f"Rate limit exceeded for key {key[:12]}...")
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": {
+                    "message": f"Rate limit exceeded: {config.RATE_LIMIT_REQUESTS} requests per {config.RATE_LIMIT_WINDOW}s",
+                    "type": "rate_limit_error",
+                    "code": "rate_limit_exceeded"
+                }
+            },
+            headers=result.headers
+        )
+
+def resolve_priority(request: Request, api_key: Optional[str]) -> str:
+    """Priority lane: the API key's lane, or a lower one requested via header"""
+    lanes = config.PRIORITY_LANES
+    lane = config.API_KEY_PRIORITIES.get(api_key, config.DEFAULT_PRIORITY) if api_key else config.DEFAULT_PRIORITY
+    requested = request.headers.get(config.PRIORITY_HEADER, "").strip().lower()
+    if not requested:
+        return lane
+    if requested not in lanes:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": {
+                    "message": f"Unknown priority {requested!r}; expected one of: {', '.join(lanes)}",
+                    "type": "invalid_request_error",
+                    "code": "invalid_priority"
+                }
+            }
+        )
+    # The header may lower a request's priority, never raise it above its key's lane
+    return requested if lanes[requested] <= lanes.get(lane, 0) else lane
+
 # Authentication dependency
-async def verify_api_key(credentials: Optional[HTTPAuthorizationCredentials] = Security(security)):
-    """Verify API key if authentication is enabled"""
+async def verify_api_key(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(security)
+):
+    """Verify API key if authentication is enabled, then apply its rate limit"""
     if not config.auth_required:
+        # Without API keys, fall back to limiting per client address
+        client_host = request.client.host if request.client else "unknown"
+        request.state.rate_limit_key = f"ip:{client_host}"
+        await enforce_rate_limit(request, request.state.rate_limit_key)
+        request.state.priority = resolve_priority(request, None)
+        request.state.owner = None
         return True
     
     if not credentials:
@@ -183,6 +391,12 @@ async def verify_api_key(credentials: Optional[HTTPAuthorizationCredentials] = S
             detail="Invalid API key"
         )
     
+    # Files and batches are only visible to the key that created them
+    request.state.owner = owner_id(api_key)
+    # Keyed by the digest, so batches can store it without storing the key
+    request.state.rate_limit_key = f"key:{request.state.owner}"
+    await enforce_rate_limit(request, request.state.rate_limit_key)
+    request.state.priority = resolve_priority(request, api_key)
     return True
 
 @app.get("/")
@@ -207,11 +421,17 @@ async def health_check():
             "timestamp": datetime.utcnow().isoformat(),
             "version": "1.0.0",
             "claude_cli": claude_health,
+            "worker_pool": claude_client.worker_pool.stats() if claude_client and claude_client.worker_pool else None,
+            "scheduler": claude_client.scheduler.stats() if claude_client else None,
+            "startup_seconds": claude_client.startup_timings if claude_client else None,
+            "token_counter": claude_client.token_counter.name if claude_client else None,
+            "event_loop": loop_monitor.stats() if loop_monitor else None,
             "config": {
                 "auth_required": config.auth_required,
                 "rate_limiting": {
                     "requests": config.RATE_LIMIT_REQUESTS,
-                    "window": config.RATE_LIMIT_WINDOW
+                    "window": config.RATE_LIMIT_WINDOW,
+                    "backend": config.RATE_LIMIT_BACKEND
                 }
             }
         }
@@ -226,55 +446,129 @@ async def health_check():
 @app.get("/v1/models", response_model=ModelsResponse)
 async def list_models(authorized: bool = Depends(verify_api_key)):
     """List available models"""
+    return Response(content=MODELS_BODY, media_type="application/json")
+
+def _json_response(body: Dict[str, Any], model: Optional[Type[BaseModel]] = None) -> Response:
+    """Encode body straight to bytes, skipping FastAPI's jsonable_encoder pass
+    
+    The route's response_model documents the body; in DEBUG mode the body is
+    also validated against model, so a drifting dict fails loudly.
+    """
+    if config.DEBUG and model is not None:
+        model.model_validate(body)
+    started = time.perf_counter()
+    content = fast_json.dumps(body)
+    SERIALIZATION.labels("response").observe(time.perf_counter() - started)
+    return Response(content=content, media_type="application/json")
+
+async def _prepend_chunk(first_chunk: bytes, stream: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+    """Re-attach a chunk that was read ahead of the StreamingResponse"""
     try:
-        models = []
-        for model_type in ModelType:
-            models.append(
-                ModelInfo(
-                    id=model_type.value,
-                    created=int(time.time()),
-                    owned_by="anthropic"
-                )
-            )
-        
-        return ModelsResponse(data=models)
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        # Close the completion stream even if the response was cancelled
+        # between chunks, so its CLI process is stopped right away
+        await stream.aclose()
+
+async def _wait_for_disconnect(http_request: Request):
+    """Return once the client has closed the connection"""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def _cancel_on_disconnect(http_request: Request, awaitable):
+    """Await awaitable, cancelling it (and its CLI process) if the client goes away first
     
-    except Exception as e:
-        logger.error(f"Error listing models: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    The awaitable runs in the handler's own task and only the disconnect
+    watcher gets a task of its own, which keeps the per-request cost to one
+    task instead of two plus an asyncio.wait.
+    """
+    handler = asyncio.current_task()
+    disconnected = False
+    
+    async def watch():
+        nonlocal disconnected
+        await _wait_for_disconnect(http_request)
+        disconnected = True
+        handler.cancel()
+    
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await awaitable
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        # Our own cancel, not the server's: take it back and answer 499
+        if hasattr(handler, "uncancel"):
+            handler.uncancel()
+        logger.info("🔌 Client disconnected, cancelling chat completion")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        watcher.cancel()
 
-@app.post("/v1/chat/completions")
+def _cache_bypassed(http_request: Request) -> bool:
+    """Whether the caller asked to skip the response cache"""
+    if http_request.headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in http_request.headers.get("cache-control", "").lower()
+
+@app.post("/v1/chat/completions", response_model=ChatCompletionResponse)
 async def chat_completions(
     request: ChatCompletionRequest,
+    http_request: Request,
     authorized: bool = Depends(verify_api_key)
 ):
     """Create chat completion (streaming and non-streaming)"""
     try:
+        use_cache = not _cache_bypassed(http_request)
+        
         if not claude_client:
             raise HTTPException(
                 status_code=503,
                 detail="Claude client not initialized"
             )
         
-        logger.info(f"Chat completion request: model={request.model}, messages={len(request.messages)}, stream={request.stream}")
+        priority = getattr(http_request.state, "priority", None)
+        logger.info(f"Chat completion request: model={request.model}, messages={len(request.messages)}, stream={request.stream}, priority={priority}")
         
         if request.stream:
+            # Read the first chunk up front so admission rejections
+            # become a proper 429/503 instead of a 200 with an error event
+            stream = claude_client.chat_completion_stream(request, use_cache=use_cache, priority=priority)
+            first_chunk = await _cancel_on_disconnect(http_request, stream.__anext__())
+            
             # Streaming response
             return StreamingResponse(
-                claude_client.chat_completion_stream(request),
-                media_type="text/plain",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"  # Disable nginx buffering
-                }
+                _prepend_chunk(first_chunk, stream),
+                media_type=sse.MEDIA_TYPE,
+                headers=sse.HEADERS
             )
         else:
             # Non-streaming response
-            response = await claude_client.chat_completion(request)
+            response = await _cancel_on_disconnect(
+                http_request, claude_client.chat_completion(request, use_cache=use_cache, priority=priority)
+            )
             logger.info(f"Chat completion response: tokens={response.get('usage', {}).get('total_tokens', 0)}")
-            return response
+            return _json_response(response, ChatCompletionResponse)
     
+    except HTTPException:
+        raise
+    except SchedulerRejected as e:
+        logger.warning(f"Chat completion rejected ({e.status_code}): {e}")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail={
+                "error": {
+                    "message": str(e),
+                    "type": "rate_limit_error" if e.status_code == 429 else "server_error",
+                    "code": "queue_full" if e.status_code == 429 else "queue_timeout"
+                }
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Chat completion error: {e}")
         
@@ -297,68 +591,176 @@ async def chat_completions(
         else:
             raise HTTPException(status_code=500, detail=error_response)
 
-@app.get("/v1/models/{model_id}")
+@app.get("/v1/models/{model_id}", response_model=ModelInfo)
 async def get_model(model_id: str, authorized: bool = Depends(verify_api_key)):
     """Get specific model information"""
+    body = MODEL_INFO_BODIES.get(model_id)
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"Model {model_id} not found")
+    return Response(content=body, media_type="application/json")
+
+def _require_batches() -> BatchManager:
+    if batch_manager is None:
+        raise HTTPException(status_code=404, detail="Batch API is disabled (BATCH_ENABLED=false)")
+    return batch_manager
+
+def _batch_error(e: BatchError) -> HTTPException:
+    """OpenAI-style error body for a files/batches failure"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail={
+            "error": {
+                "message": str(e),
+                "type": "invalid_request_error",
+                "code": "not_found" if e.status_code == 404 else "invalid_request"
+            }
+        }
+    )
+
+@app.post("/v1/files")
+async def upload_file(
+    http_request: Request,
+    file: UploadFile = File(...),
+    purpose: str = Form(...),
+    authorized: bool = Depends(verify_api_key)
+):
+    """Upload a JSONL file of batch requests"""
+    _require_batches()
+    if purpose != "batch":
+        raise _batch_error(BatchError("Only purpose 'batch' is supported"))
     try:
-        # Check if model exists
-        valid_models = [model.value for model in ModelType]
-        if model_id not in valid_models:
-            raise HTTPException(status_code=404, detail=f"Model {model_id} not found")
-        
-        return ModelInfo(
-            id=model_id,
-            created=int(time.time()),
-            owned_by="anthropic"
+        return await batch_files.create(
+            file.read, file.filename or "upload.jsonl", purpose, config.BATCH_MAX_FILE_BYTES, http_request.state.owner
         )
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error getting model {model_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    except BatchError as e:
+        raise _batch_error(e)
+
+@app.get("/v1/files")
+async def list_files(http_request: Request, purpose: Optional[str] = None, authorized: bool = Depends(verify_api_key)):
+    """List the caller's uploaded and batch output files"""
+    _require_batches()
+    return {"object": "list", "data": batch_files.list(http_request.state.owner, purpose)}
+
+@app.get("/v1/files/{file_id}")
+async def get_file(file_id: str, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """File metadata"""
+    _require_batches()
+    meta = batch_files.get(file_id, http_request.state.owner)
+    if meta is None:
+        raise _batch_error(BatchError(f"No such file: {file_id}", status_code=404))
+    return meta
+
+@app.get("/v1/files/{file_id}/content")
+async def get_file_content(file_id: str, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """Raw file content, e.g. a batch's output JSONL"""
+    _require_batches()
+    meta = batch_files.get(file_id, http_request.state.owner)
+    if meta is None:
+        raise _batch_error(BatchError(f"No such file: {file_id}", status_code=404))
+    return FileResponse(batch_files.content_path(file_id), media_type="application/jsonl", filename=meta["filename"])
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """Delete a file"""
+    _require_batches()
+    if not batch_files.delete(file_id, http_request.state.owner):
+        raise _batch_error(BatchError(f"No such file: {file_id}", status_code=404))
+    return {"id": file_id, "object": "file", "deleted": True}
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchCreateRequest, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """Start a batch over an uploaded JSONL file of chat completion requests"""
+    manager = _require_batches()
+    try:
+        return manager.create(
+            request.input_file_id, request.endpoint, http_request.state.owner,
+            request.completion_window, request.metadata, http_request.state.rate_limit_key
+        )
+    except BatchError as e:
+        raise _batch_error(e)
+
+@app.get("/v1/batches")
+async def list_batches(
+    http_request: Request,
+    limit: int = 20,
+    after: Optional[str] = None,
+    authorized: bool = Depends(verify_api_key)
+):
+    """List the caller's batches, newest first"""
+    return _require_batches().list(http_request.state.owner, limit, after)
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """Batch status and request counts"""
+    manager = _require_batches()
+    try:
+        return manager.get(batch_id, http_request.state.owner)
+    except BatchError as e:
+        raise _batch_error(e)
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str, http_request: Request, authorized: bool = Depends(verify_api_key)):
+    """Cancel a batch; requests already finished stay in its output file"""
+    manager = _require_batches()
+    try:
+        return manager.cancel(batch_id, http_request.state.owner)
+    except BatchError as e:
+        raise _batch_error(e)
 
 # Optional: Metrics endpoint for monitoring
 @app.get("/metrics")
 async def get_metrics():
-    """Prometheus-style metrics endpoint"""
+    """Prometheus metrics endpoint"""
     try:
-        metrics = []
-        
-        # Basic health metric
-        health = claude_client.check_health() if claude_client else {"claude_cli": "not_initialized"}
-        health_status = 1 if health.get("claude_cli") == "healthy" else 0
-        
-        metrics.append(f"claude_wrapper_healthy {health_status}")
-        metrics.append(f"claude_wrapper_uptime_seconds {time.time()}")
-        
-        return "\n".join(metrics)
+        # Passed as a header so Starlette does not append a second charset
+        return Response(content=render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
     
     except Exception as e:
         logger.error(f"Metrics error: {e}")
-        return f"# Error generating metrics: {e}"
+        return Response(content=f"# Error generating metrics: {e}\n", headers={"Content-Type": CONTENT_TYPE_LATEST}, status_code=500)
 
 # Error handlers
+def _openai_error(exc) -> Optional[JSONResponse]:
+    """The response for an HTTPException whose detail is already an OpenAI-style {"error": ...} body"""
+    detail = getattr(exc, "detail", None)
+    if isinstance(detail, dict) and "error" in detail:
+        return JSONResponse(status_code=exc.status_code, content=detail, headers=getattr(exc, "headers", None))
+    return None
+
+@app.exception_handler(StarletteHTTPException)
+async def http_error_handler(request, exc):
+    """Send {"error": ...} details as the body itself, not wrapped in {"detail": ...}"""
+    return _openai_error(exc) or await http_exception_handler(request, exc)
+
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return {
+    response = _openai_error(exc)
+    if response is not None:
+        return response
+    detail = getattr(exc, "detail", None)
+    # Keep a handler's own message; Starlette's unmatched-route default says less than the path
+    message = detail if isinstance(detail, str) and detail != "Not Found" else f"Not found: {request.url.path}"
+    return JSONResponse(status_code=404, content={
         "error": {
-            "message": f"Not found: {request.url.path}",
+            "message": message,
             "type": "not_found_error",
             "code": "not_found"
         }
-    }
+    })
 
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
+    response = _openai_error(exc)
+    if response is not None:
+        return response
     logger.error(f"Internal error: {exc}")
-    return {
+    return JSONResponse(status_code=500, content={
         "error": {
             "message": "Internal server error",
             "type": "server_error", 
             "code": "internal_error"
         }
-    }
+    })
 
 # Startup is handled by the lifespan context manager above
 
@@ -378,5 +780,6 @@ if __name__ == "__main__":
         host=host,
         port=port,
         log_level=log_level,
+        timeout_graceful_shutdown=graceful_shutdown_timeout(),
         reload=False  # Set to True for development
     )
@@ -0,0 +1,247 @@
+"""
+Prometheus Metrics
+Request, latency and subprocess instrumentation for the /metrics endpoint
+"""
+
+import os
+import time
+import logging
+from typing import Any, Callable, Optional
+
+import psutil
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    PlatformCollector,
+    ProcessCollector,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+START_TIME = time.time()
+
+# Under gunicorn every worker writes samples to mmap files in this directory
+# and a scrape of any worker merges them (prometheus_client multiprocess mode)
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+registry = CollectorRegistry()
+if MULTIPROCESS:
+    multiprocess.MultiProcessCollector(registry)
+    _metric_registry = None
+else:
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    _metric_registry = registry
+
+# Buckets spanning sub-millisecond bookkeeping up to multi-minute generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+REQUESTS = Counter(
+    "claude_wrapper_requests",
+    "Chat completion requests by outcome",
+    ["model", "status", "stream"],
+    registry=_metric_registry,
+)
+IN_FLIGHT = Gauge(
+    "claude_wrapper_requests_in_flight",
+    "Chat completion requests currently being served",
+    ["stream"],
+    multiprocess_mode="livesum",
+    registry=_metric_registry,
+)
+QUEUE_WAIT = Histogram(
+    "claude_wrapper_queue_wait_seconds",
+    "Time spent waiting for a concurrency slot, by priority lane",
+    ["lane"],
+    buckets=LATENCY_BUCKETS,
+    registry=_metric_registry,
+)
+LOOP_LAG = Histogram(
+    "claude_wrapper_event_loop_lag_seconds",
+    "How late the event loop ran a timer (blocking code shows up here)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    registry=_metric_registry,
+)
+LOOP_STALLS = Counter(
+    "claude_wrapper_event_loop_stalls",
+    "Times the event loop was blocked past SLOW_CALLBACK_MS, by blocking coroutine",
+    ["coroutine"],
+    registry=_metric_registry,
+)
+REQUEST_COST = Histogram(
+    "claude_wrapper_request_cost",
+    "Estimated admission cost of requests (model weight x prompt size)",
+    ["model"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+    registry=_metric_registry,
+)
+PROCESS_SPAWN = Histogram(
+    "claude_wrapper_process_spawn_seconds",
+    "Time to fork/exec a Claude CLI process",
+    ["kind"],
+    buckets=FAST_BUCKETS + LATENCY_BUCKETS[5:],
+    registry=_metric_registry,
+)
+TIME_TO_FIRST_BYTE = Histogram(
+    "claude_wrapper_time_to_first_byte_seconds",
+    "Time from request start to the first content byte",
+    ["stream"],
+    buckets=LATENCY_BUCKETS,
+    registry=_metric_registry,
+)
+CLI_RUNTIME = Histogram(
+    "claude_wrapper_cli_runtime_seconds",
+    "Wall time of one Claude CLI call",
+    ["model", "mode"],
+    buckets=LATENCY_BUCKETS,
+    registry=_metric_registry,
+)
+CLI_REPORTED_DURATION = Histogram(
+    "claude_wrapper_cli_reported_duration_seconds",
+    "Duration the Claude CLI reports in its result event",
+    ["model"],
+    buckets=LATENCY_BUCKETS,
+    registry=_metric_registry,
+)
+TOKENS = Counter(
+    "claude_wrapper_tokens",
+    "Tokens the Claude CLI reports using, by kind",
+    ["model", "kind"],
+    registry=_metric_registry,
+)
+STOP_REASONS = Counter(
+    "claude_wrapper_stop_reasons",
+    "Why the Claude CLI stopped generating",
+    ["model", "reason"],
+    registry=_metric_registry,
+)
+SERIALIZATION = Histogram(
+    "claude_wrapper_serialization_seconds",
+    "Time spent encoding responses and stream chunks",
+    ["kind"],
+    buckets=FAST_BUCKETS,
+    registry=_metric_registry,
+)
+CANCELLED_CALLS = Counter(
+    "claude_wrapper_cancelled_cli_calls",
+    "CLI calls killed because every caller waiting on them disconnected",
+    registry=_metric_registry,
+)
+CANCELLED_WORK_SECONDS = Counter(
+    "claude_wrapper_cancelled_work_seconds",
+    "Estimated CLI seconds saved by killing calls for disconnected callers (request cost x average seconds per cost unit)",
+    registry=_metric_registry,
+)
+RATE_LIMITED = Counter(
+    "claude_wrapper_rate_limited",
+    "Requests rejected by the per-key rate limiter",
+    registry=_metric_registry,
+)
+
+
+class SubprocessCollector:
+    """RSS and CPU of the Claude CLI processes spawned by this wrapper"""
+
+    def collect(self):
+        count, rss, cpu = 0, 0, 0.0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                with child.oneshot():
+                    rss += child.memory_info().rss
+                    times = child.cpu_times()
+                    cpu += times.user + times.system
+                count += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+        yield GaugeMetricFamily("claude_wrapper_cli_processes", "Live Claude CLI subprocesses", value=count)
+        yield GaugeMetricFamily("claude_wrapper_cli_rss_bytes", "Resident memory of live CLI subprocesses", value=rss)
+        yield GaugeMetricFamily("claude_wrapper_cli_cpu_seconds", "CPU time used so far by live CLI subprocesses", value=cpu)
+
+
+class WrapperStateCollector:
+    """Scrape-time view of health, scheduler, cache, session and pool state"""
+
+    def __init__(self, get_client: Callable[[], Optional[Any]]):
+        self._get_client = get_client
+
+    def collect(self):
+        yield GaugeMetricFamily("claude_wrapper_uptime_seconds", "Seconds since the wrapper started", value=time.time() - START_TIME)
+        yield GaugeMetricFamily("claude_wrapper_start_time_seconds", "Unix time the wrapper started", value=START_TIME)
+
+        client = self._get_client()
+        health = client.check_health() if client else {"claude_cli": "not_initialized"}
+        yield GaugeMetricFamily("claude_wrapper_healthy", "1 if the Claude CLI is healthy", value=1 if health.get("claude_cli") == "healthy" else 0)
+        if not client:
+            return
+
+        startup = GaugeMetricFamily("claude_wrapper_startup_phase_seconds", "Duration of each startup phase", labels=["phase"])
+        for phase, seconds in client.startup_timings.items():
+            startup.add_metric([phase], seconds)
+        yield startup
+
+        sched = client.scheduler.stats()
+        yield GaugeMetricFamily("claude_wrapper_requests_running", "Requests holding a concurrency slot", value=sched["running"])
+        yield GaugeMetricFamily("claude_wrapper_queue_depth", "Requests waiting for a concurrency slot", value=sched["queued"])
+        lane_depth = GaugeMetricFamily("claude_wrapper_lane_queue_depth", "Requests waiting in each priority lane", labels=["lane"])
+        for name, lane in sched["lanes"].items():
+            lane_depth.add_metric([name], lane["queued"])
+        yield lane_depth
+        yield GaugeMetricFamily("claude_wrapper_inflight_cost", "Estimated cost of requests holding a slot", value=sched["inflight_cost"])
+        rejected = CounterMetricFamily("claude_wrapper_requests_rejected", "Requests rejected by admission control", labels=["reason"])
+        rejected.add_metric(["queue_full"], sched["rejected_full_total"])
+        rejected.add_metric(["queue_timeout"], sched["rejected_timeout_total"])
+        rejected.add_metric(["shed"], sched["shed_total"])
+        yield rejected
+
+        yield CounterMetricFamily(
+            "claude_wrapper_coalesced_requests", "Requests served by joining an identical in-flight call",
+            value=client.single_flight.coalesced_total + client.stream_fanout.coalesced_total,
+        )
+        yield GaugeMetricFamily(
+            "claude_wrapper_inflight_calls", "Distinct coalescable CLI calls in flight",
+            value=client.single_flight.in_flight + client.stream_fanout.in_flight,
+        )
+
+        if client.response_cache is not None:
+            cache = client.response_cache.stats()
+            yield CounterMetricFamily("claude_wrapper_cache_hits", "Response cache hits", value=cache["hits"])
+            yield CounterMetricFamily("claude_wrapper_cache_misses", "Response cache misses", value=cache["misses"])
+            yield CounterMetricFamily("claude_wrapper_cache_evictions", "Response cache LRU evictions", value=cache["evictions"])
+            yield GaugeMetricFamily("claude_wrapper_cache_entries", "Response cache entries", value=cache["entries"])
+
+        if client.session_store is not None:
+            sessions = client.session_store.stats()
+            yield GaugeMetricFamily("claude_wrapper_sessions_live", "Resumable CLI sessions tracked", value=sessions["sessions"])
+            yield CounterMetricFamily("claude_wrapper_session_hits", "Requests that resumed a CLI session", value=sessions["hits"])
+            yield CounterMetricFamily("claude_wrapper_session_misses", "Requests that sent the full history", value=sessions["misses"])
+            yield CounterMetricFamily("claude_wrapper_session_evictions", "Sessions evicted from the LRU", value=sessions["evictions"])
+            yield CounterMetricFamily("claude_wrapper_session_resume_failures", "Session resumes that failed", value=sessions["resume_failures"])
+
+        if client.worker_pool:
+            pool = client.worker_pool.stats()
+            workers = GaugeMetricFamily("claude_wrapper_pool_workers", "Pooled CLI workers", labels=["state"])
+            workers.add_metric(["idle"], pool["idle"])
+            workers.add_metric(["busy"], pool["busy"])
+            yield workers
+            yield CounterMetricFamily("claude_wrapper_pool_spawned", "Pooled workers spawned", value=pool["spawned_total"])
+            yield CounterMetricFamily("claude_wrapper_pool_recycled", "Pooled workers recycled", value=pool["recycled_total"])
+
+
+def register_state_collectors(get_client: Callable[[], Optional[Any]]):
+    """Attach the scrape-time collectors that need the live client"""
+    registry.register(WrapperStateCollector(get_client))
+    registry.register(SubprocessCollector())
+
+
+def render_metrics() -> bytes:
+    """Prometheus text exposition (version 0.0.4)"""
+    return generate_latest(registry)
+
@@ -0,0 +1,73 @@
+"""
+CLI Process Groups
+Spawn each Claude CLI in its own process group and stop the whole group at once
+"""
+
+import asyncio
+import os
+import signal
+import logging
+from typing import List, Set
+
+logger = logging.getLogger(__name__)
+
+# The CLI (node) may fork helpers; a new session makes it the leader of a
+# group that can be signalled as a unit without touching the wrapper itself
+SPAWN_KWARGS = {"start_new_session": True} if os.name == "posix" else {}
+
+
+def signal_group(process: asyncio.subprocess.Process, sig: int) -> bool:
+    """Send sig to the process group led by process; False if it is gone"""
+    if process.returncode is not None:
+        return False
+    try:
+        if SPAWN_KWARGS:
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+        return True
+    except ProcessLookupError:
+        return False
+
+
+async def kill_group(process: asyncio.subprocess.Process):
+    """SIGKILL the process group and reap the leader"""
+    signal_group(process, signal.SIGKILL)
+    await process.wait()
+
+
+async def terminate_group(process: asyncio.subprocess.Process, grace: float):
+    """SIGTERM the process group, then SIGKILL it if still alive after grace seconds"""
+    if not signal_group(process, signal.SIGTERM):
+        await process.wait()
+        return
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        await kill_group(process)
+
+
+class ProcessTracker:
+    """Remembers live CLI processes so shutdown can stop the stragglers"""
+
+    def __init__(self):
+        self._live: Set[asyncio.subprocess.Process] = set()
+
+    def add(self, process: asyncio.subprocess.Process):
+        # asyncio sets returncode when the child exits, whether or not it was awaited
+        self._live = {p for p in self._live if p.returncode is None}
+        self._live.add(process)
+
+    def live(self) -> List[asyncio.subprocess.Process]:
+        return [p for p in self._live if p.returncode is None]
+
+    async def terminate_all(self, grace: float) -> int:
+        """Terminate every live process group; returns how many were still running"""
+        stragglers = self.live()
+        if stragglers:
+            logger.warning(f"⚠️ Terminating {len(stragglers)} Claude CLI process group(s)")
+            await asyncio.gather(*(terminate_group(p, grace) for p in stragglers))
+        self._live.clear()
+        return len(stragglers)
@@ -0,0 +1,237 @@
+"""
+Rate Limiter
+Per-API-key sliding-window counters with pluggable storage backends
+"""
+
+import asyncio
+import math
+import sqlite3
+import tempfile
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of one rate limit check"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: int
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_after),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.reset_after)
+        return headers
+
+
+class RateLimitBackend:
+    """Storage for (previous, current) window counts"""
+
+    async def hit(self, key: str, window_start: int, window: int, limit: int, weight: float) -> Tuple[bool, float]:
+        """Count one request if the weighted estimate stays under limit
+
+        Returns (allowed, estimated count before this request).
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Process-local counters; O(1) per request"""
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        # key -> [window_start, current_count, previous_count]
+        self._windows: Dict[str, list] = {}
+
+    def _prune(self, window_start: int, window: int):
+        """Forget keys that have been idle for two full windows"""
+        cutoff = window_start - window
+        for key in [k for k, entry in self._windows.items() if entry[0] < cutoff]:
+            del self._windows[key]
+
+    async def hit(self, key, window_start, window, limit, weight):
+        if len(self._windows) >= self.MAX_KEYS and key not in self._windows:
+            self._prune(window_start, window)
+
+        entry = self._windows.get(key)
+        if entry is None:
+            entry = self._windows[key] = [window_start, 0, 0]
+        elif entry[0] != window_start:
+            previous = entry[1] if window_start - entry[0] == window else 0
+            entry[0], entry[1], entry[2] = window_start, 0, previous
+
+        estimated = entry[2] * weight + entry[1]
+        if estimated + 1 > limit:
+            return False, estimated
+        entry[1] += 1
+        return True, estimated
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Counters in a local SQLite file so every worker process on a host shares one quota
+
+    Each hit is one short write transaction; WAL mode keeps readers and the
+    single writer from blocking each other for more than a few microseconds.
+    The transaction runs on a dedicated thread, so waiting on another
+    worker's lock (up to the 5 s busy timeout) never stalls the event loop.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # One thread owns every statement, so the connection is never used concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit-sqlite")
+        self._db = sqlite3.connect(str(path), timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit ("
+            " key TEXT NOT NULL, window_start INTEGER NOT NULL, count INTEGER NOT NULL,"
+            " PRIMARY KEY (key, window_start)) WITHOUT ROWID"
+        )
+        self._hits = 0
+
+    async def hit(self, key, window_start, window, limit, weight):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._hit, key, window_start, window, limit, weight)
+
+    def _hit(self, key: str, window_start: int, window: int, limit: int, weight: float) -> Tuple[bool, float]:
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            counts = dict(db.execute(
+                "SELECT window_start, count FROM rate_limit WHERE key = ? AND window_start IN (?, ?)",
+                (key, window_start, window_start - window),
+            ).fetchall())
+            estimated = counts.get(window_start - window, 0) * weight + counts.get(window_start, 0)
+            allowed = estimated + 1 <= limit
+            if allowed:
+                db.execute(
+                    "INSERT INTO rate_limit (key, window_start, count) VALUES (?, ?, 1)"
+                    " ON CONFLICT (key, window_start) DO UPDATE SET count = count + 1",
+                    (key, window_start),
+                )
+            self._hits += 1
+            if self._hits % self.PRUNE_EVERY == 0:
+                db.execute("DELETE FROM rate_limit WHERE window_start < ?", (window_start - window,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return allowed, estimated
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._db.close)
+        self._executor.shutdown(wait=False)
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Counters in Redis so several replicas share one quota
+
+    The read, the limit check and the increment run as one Lua script, so
+    concurrent requests from different replicas cannot all pass the check
+    before any of them is counted.
+    """
+
+    # KEYS: current, previous window; ARGV: previous-window weight, limit, ttl.
+    # The estimate goes back as a string: Redis truncates Lua numbers to integers
+    HIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local estimated = previous * tonumber(ARGV[1]) + current
+if estimated + 1 > tonumber(ARGV[2]) then
+    return {0, tostring(estimated)}
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, tostring(estimated)}
+"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package: pip install redis")
+        self._redis = redis.from_url(url)
+        # EVALSHA with a transparent EVAL fallback when the script is not cached yet
+        self._hit = self._redis.register_script(self.HIT_SCRIPT)
+
+    async def hit(self, key, window_start, window, limit, weight):
+        # The hash tag keeps both windows of a key in one Redis Cluster slot
+        allowed, estimated = await self._hit(
+            keys=[f"ratelimit:{{{key}}}:{window_start}", f"ratelimit:{{{key}}}:{window_start - window}"],
+            args=[repr(weight), limit, window * 2],
+        )
+        return bool(allowed), float(estimated)
+
+    async def close(self):
+        await self._redis.close()
+
+
+class RateLimiter:
+    """Sliding-window counter: limit requests per window seconds, per key"""
+
+    def __init__(self, limit: int, window: int, backend: Optional[RateLimitBackend] = None):
+        self.limit = limit
+        self.window = max(1, window)
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.rejected_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    async def check(self, key: str) -> RateLimitResult:
+        """Count a request for key and report whether it may proceed"""
+        now = time.time()
+        window_start = int(now // self.window) * self.window
+        elapsed = now - window_start
+        # Share of the previous window still inside the sliding window
+        weight = (self.window - elapsed) / self.window
+
+        allowed, estimated = await self.backend.hit(key, window_start, self.window, self.limit, weight)
+        reset_after = max(1, math.ceil(self.window - elapsed))
+
+        if not allowed:
+            self.rejected_total += 1
+            return RateLimitResult(False, self.limit, 0, reset_after)
+
+        remaining = max(0, int(self.limit - estimated - 1))
+        return RateLimitResult(True, self.limit, remaining, reset_after)
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_rate_limiter(config) -> RateLimiter:
+    """Build the rate limiter described by Config"""
+    backend: Optional[RateLimitBackend] = None
+    if config.RATE_LIMIT_BACKEND == "sqlite":
+        path = Path(config.SHARED_STATE_DIR or tempfile.gettempdir()) / "ratelimit.sqlite3"
+        backend = SQLiteRateLimitBackend(path)
+        logger.info(f"✅ Rate limiter using host-local SQLite backend: {path}")
+    elif config.RATE_LIMIT_BACKEND == "redis":
+        backend = RedisRateLimitBackend(config.RATE_LIMIT_REDIS_URL)
+        logger.info(f"✅ Rate limiter using shared Redis backend: {config.RATE_LIMIT_REDIS_URL}")
+    elif config.RATE_LIMIT_BACKEND != "memory":
+        raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {config.RATE_LIMIT_BACKEND}")
+    return RateLimiter(config.RATE_LIMIT_REQUESTS, config.RATE_LIMIT_WINDOW, backend)
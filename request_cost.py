@@ -0,0 +1,47 @@
+"""
+Request Cost
+Estimate what a completion will cost the host from its prompt size and model tier
+"""
+
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse "haiku=1,sonnet=3,opus=8" into {family: weight}"""
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        family, sep, weight = item.partition("=")
+        if not sep:
+            raise RuntimeError(f"Invalid MODEL_COST_WEIGHTS entry: {item!r} (expected family=weight)")
+        weights[family.strip().lower()] = float(weight)
+    return weights
+
+
+class CostEstimator:
+    """Cost = model family weight * (1 + prompt characters / unit_chars)
+
+    The Claude model comes from MODEL_MAPPING, so gpt-4-32k is priced as opus
+    and gpt-3.5-turbo as haiku. Unknown families get the highest weight.
+    """
+
+    def __init__(self, weights: Dict[str, float], unit_chars: int):
+        self.weights = weights
+        self.unit_chars = max(1, unit_chars)
+        self._default = max(weights.values(), default=1.0)
+        self._by_model: Dict[str, float] = {}
+
+    def weight(self, claude_model: str) -> float:
+        weight = self._by_model.get(claude_model)
+        if weight is None:
+            name = claude_model.lower()
+            weight = next((w for family, w in self.weights.items() if family in name), self._default)
+            self._by_model[claude_model] = weight
+        return weight
+
+    def estimate(self, prompt_chars: int, claude_model: str) -> float:
+        return self.weight(claude_model) * (1 + prompt_chars / self.unit_chars)
@@ -0,0 +1,204 @@
+"""
+Response Cache
+LRU + TTL cache of completed chat responses for repeated identical prompts
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def completion_cache_key(model: str, messages: List[Dict[str, Any]], temperature_bucket: str) -> str:
+    """Hash of everything that changes what the CLI is asked"""
+    normalized = {
+        "model": model,
+        "messages": [[m.get("role", ""), m.get("content", "")] for m in messages],
+        "temperature": temperature_bucket,
+    }
+    payload = json.dumps(normalized, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Bounded LRU of completion texts that expire after ttl seconds"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return cached content for key, or None on miss/expiry"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, content = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content
+
+    async def put(self, key: str, content: str):
+        """Store content, evicting the least recently used entries when full"""
+        self._entries[key] = (time.monotonic() + self.ttl, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for health and metrics"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SharedCompletionCache:
+    """CompletionCache stored in a local SQLite file shared by every worker process
+
+    Same interface and eviction policy as CompletionCache; hit/miss counters
+    are per process, entries are host-wide. Times are wall-clock because
+    monotonic clocks are not comparable across processes.
+
+    Statements run on a dedicated thread so a busy database never stalls the
+    event loop. Reads are read-only: recency updates from hits are collected
+    in memory and written in the next put's transaction, which is the only
+    place eviction looks at them.
+    """
+
+    def __init__(self, path: Path, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # One thread owns every statement, so the connection is never used concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="completion-cache-sqlite")
+        self._db = sqlite3.connect(str(path), timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completion_cache ("
+            " key TEXT PRIMARY KEY, content TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completion_cache_used ON completion_cache (used_at)")
+        self._entries = self._db.execute("SELECT COUNT(*) FROM completion_cache").fetchone()[0]
+        # key -> last hit time, not yet written to used_at
+        self._touched: Dict[str, float] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        """Entry count as of this process's last write"""
+        return self._entries
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return cached content for key, or None on miss/expiry"""
+        return await self._run(self._get, key)
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT content, expires_at FROM completion_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        content, expires_at = row
+        now = time.time()
+        if expires_at <= now:
+            # Left for the next put of this key, or for LRU eviction
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._touched[key] = now
+        self.hits += 1
+        return content
+
+    async def put(self, key: str, content: str):
+        """Store content, evicting the least recently used entries when full"""
+        await self._run(self._put, key, content)
+
+    def _put(self, key: str, content: str):
+        now = time.time()
+        db = self._db
+        touched, self._touched = self._touched, {}
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if touched:
+                db.executemany(
+                    "UPDATE completion_cache SET used_at = MAX(used_at, ?) WHERE key = ?",
+                    [(used_at, touched_key) for touched_key, used_at in touched.items()],
+                )
+            db.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, content, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, content, now + self.ttl, now),
+            )
+            entries = db.execute("SELECT COUNT(*) FROM completion_cache").fetchone()[0]
+            excess = entries - self.max_entries
+            if excess > 0:
+                db.execute(
+                    "DELETE FROM completion_cache WHERE key IN"
+                    " (SELECT key FROM completion_cache ORDER BY used_at LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self._entries = min(entries, self.max_entries)
+
+    async def clear(self):
+        await self._run(self._db.execute, "DELETE FROM completion_cache")
+        self._entries = 0
+        self._touched = {}
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for health and metrics"""
+        return {
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,398 @@
+"""
+Request Scheduler
+Bounded concurrency and a cost budget with weighted-fair priority lanes in front of the Claude CLI
+"""
+
+import asyncio
+import fcntl
+import heapq
+import math
+import os
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from metrics import QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(RuntimeError):
+    """Raised when a request cannot be admitted (queue full or wait timed out)"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class SharedSlots:
+    """Host-wide counting semaphore over lock files, shared by worker processes
+
+    Each slot is one file held with flock(); the kernel drops the lock when
+    a worker dies, so a crashed process can never leak a slot.
+    """
+
+    def __init__(self, directory: Path, size: int):
+        self.size = max(1, size)
+        directory.mkdir(parents=True, exist_ok=True)
+        self._paths = [directory / f"slot-{i}.lock" for i in range(self.size)]
+        self._held: List[int] = []
+
+    def _try_acquire(self) -> bool:
+        # Start at a per-process offset so workers do not all contend for slot 0
+        offset = os.getpid() % self.size
+        for i in range(self.size):
+            fd = os.open(self._paths[(offset + i) % self.size], os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self._held.append(fd)
+            return True
+        return False
+
+    async def acquire(self, timeout: float) -> bool:
+        """Poll for a free slot until timeout; False if none came free"""
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not self._try_acquire():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+        return True
+
+    def release(self):
+        fd = self._held.pop()
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class _Waiter:
+    """A queued request: the future that admits it, what it will cost and its fair-queue tags"""
+
+    __slots__ = ("future", "cost", "start", "finish", "bypassed")
+
+    def __init__(self, future: asyncio.Future, cost: float, start: float, finish: float):
+        self.future = future
+        self.cost = cost
+        # Virtual start/finish tags, fixed when the request arrives
+        self.start = start
+        self.finish = finish
+        # Times a request behind this one in dispatch order was admitted first
+        self.bypassed = 0
+
+
+class _Lane:
+    """A priority class: its own FIFO queue and a weighted share of dispatches"""
+
+    __slots__ = ("name", "weight", "waiters", "finish", "running", "admitted_total")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = max(0.001, weight)
+        self.waiters: Deque[_Waiter] = deque()
+        # Virtual finish tag of the lane's latest request
+        self.finish = 0.0
+        self.running = 0
+        self.admitted_total = 0
+
+
+class ConcurrencyScheduler:
+    """Admission control: at most max_concurrency running, max_queue waiting per lane
+
+    Requests wait in per-priority lanes. Each request is tagged on arrival
+    with a virtual finish time (start + cost / weight, where start is the
+    later of its lane's previous finish and the current virtual time) and
+    free slots go to the earliest tag, so a lane of weight 4 gets four times
+    the dispatches of a weight-1 lane while both are backlogged and the
+    lighter lane still makes progress.
+
+    With max_cost set, requests also draw on a budget of estimated cost.
+    When it is exhausted, cheap requests may overtake an expensive one
+    ahead of them (at most max_bypass times, so it cannot starve), and a
+    full lane sheds its most expensive waiter before a cheaper one.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        shared_slots: Optional[SharedSlots] = None,
+        max_cost: float = 0,
+        max_bypass: int = 8,
+        lanes: Optional[Dict[str, float]] = None,
+        default_lane: Optional[str] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        # With several worker processes, also hold one of the host-wide slots
+        self.shared_slots = shared_slots
+        # Per-process budget of estimated cost in flight; 0 disables it
+        self.max_cost = max(0.0, max_cost)
+        self.max_bypass = max(0, max_bypass)
+
+        self._lanes = {name: _Lane(name, weight) for name, weight in (lanes or {"default": 1.0}).items()}
+        self.default_lane = default_lane if default_lane in self._lanes else next(iter(self._lanes))
+        # Virtual time of weighted fair queueing: latest start tag admitted
+        self._vtime = 0.0
+
+        self._running = 0
+        self._cost = 0.0
+
+        # Exponentially weighted average of slot hold time, for Retry-After
+        self._avg_service = 0.0
+        # ... and of hold time per unit of cost, for sizing individual requests
+        self._avg_per_cost = 0.0
+
+        self.admitted_total = 0
+        self.rejected_full_total = 0
+        self.rejected_timeout_total = 0
+        self.shed_total = 0
+        self.wait_seconds_sum = 0.0
+        self.wait_seconds_count = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return sum(len(lane.waiters) for lane in self._lanes.values())
+
+    @property
+    def inflight_cost(self) -> float:
+        return self._cost
+
+    @property
+    def lanes(self) -> List[str]:
+        return list(self._lanes)
+
+    @property
+    def average_service_time(self) -> float:
+        """Smoothed seconds a request holds its slot"""
+        return self._avg_service
+
+    @property
+    def average_seconds_per_cost(self) -> float:
+        """Smoothed seconds a request holds its slot per unit of cost"""
+        return self._avg_per_cost
+
+    def retry_after(self) -> int:
+        """Estimate seconds until a queue slot frees up"""
+        backlog = (self.queued + 1) / self.max_concurrency
+        return max(1, math.ceil(self._avg_service * backlog))
+
+    def _record_wait(self, lane: _Lane, seconds: float):
+        QUEUE_WAIT.labels(lane.name).observe(seconds)
+        self.wait_seconds_sum += seconds
+        self.wait_seconds_count += 1
+
+    def _lane(self, name: Optional[str]) -> _Lane:
+        return self._lanes.get(name or self.default_lane) or self._lanes[self.default_lane]
+
+    def _budgeted(self, cost: float) -> float:
+        """Cost charged against the budget: never more than the whole budget
+
+        A request estimated above max_cost is charged exactly max_cost, so it
+        runs once the scheduler is otherwise idle and holds the budget no
+        longer than it runs, instead of overdrawing it.
+        """
+        return min(cost, self.max_cost) if self.max_cost else cost
+
+    def _fits(self, cost: float) -> bool:
+        """Whether a request of this cost may start now"""
+        if self._running >= self.max_concurrency:
+            return False
+        return not self.max_cost or self._cost + cost <= self.max_cost
+
+    def _tag(self, lane: _Lane, cost: float) -> Tuple[float, float]:
+        """Virtual (start, finish) tags for a request arriving in lane now"""
+        start = max(lane.finish, self._vtime)
+        lane.finish = start + cost / lane.weight
+        return start, lane.finish
+
+    def _admit(self, lane: _Lane, cost: float, start: float):
+        self._running += 1
+        self._cost += cost
+        self._vtime = max(self._vtime, start)
+        lane.running += 1
+        lane.admitted_total += 1
+
+    def _in_fair_order(self) -> List[Tuple[_Lane, _Waiter]]:
+        """Queued requests in dispatch order: by finish tag (FIFO within a lane, as tags only grow)"""
+        return list(heapq.merge(
+            *([(lane, waiter) for waiter in lane.waiters] for lane in self._lanes.values()),
+            key=lambda item: item[1].finish,
+        ))
+
+    async def acquire(self, cost: float = 1.0, lane: Optional[str] = None):
+        """Wait for a concurrency slot and cost budget, or raise SchedulerRejected"""
+        cost = self._budgeted(cost)
+        started = time.monotonic()
+        queue = self._lane(lane)
+        await self._acquire_local(queue, cost)
+        if self.shared_slots is not None:
+            try:
+                acquired = await self.shared_slots.acquire(self.queue_timeout - (time.monotonic() - started))
+            except BaseException:
+                self._release_local(queue, cost)
+                raise
+            if not acquired:
+                self._release_local(queue, cost)
+                self.rejected_timeout_total += 1
+                raise SchedulerRejected(
+                    f"Request waited {self.queue_timeout}s without a free slot on this host",
+                    status_code=503,
+                    retry_after=self.retry_after(),
+                )
+
+        self.admitted_total += 1
+        self._record_wait(queue, time.monotonic() - started)
+
+    async def _acquire_local(self, lane: _Lane, cost: float):
+        """Wait in lane for one of this process's slots and its share of the cost budget"""
+        # Waiters only remain queued while none of them fits, so a request
+        # that fits may go ahead unless the first in line was overtaken too often
+        queue = self._in_fair_order()
+        if self._fits(cost) and (not queue or queue[0][1].bypassed < self.max_bypass):
+            if queue:
+                queue[0][1].bypassed += 1
+            self._admit(lane, cost, self._tag(lane, cost)[0])
+            return
+
+        shed = False
+        if len(lane.waiters) >= self.max_queue:
+            victim = max(lane.waiters, key=lambda w: w.cost) if self.max_cost and lane.waiters else None
+            if victim is None or victim.cost <= cost:
+                self.rejected_full_total += 1
+                raise SchedulerRejected(
+                    f"Server busy: {self._running} running, {len(lane.waiters)} queued ({lane.name})",
+                    status_code=429,
+                    retry_after=self.retry_after(),
+                )
+            # Shed the most expensive waiter to make room for a cheaper request
+            lane.waiters.remove(victim)
+            self.shed_total += 1
+            logger.warning(f"⚠️ Shedding queued request with cost {victim.cost:.1f} for one with cost {cost:.1f}")
+            victim.future.set_exception(SchedulerRejected(
+                f"Server busy: request shed for cheaper work (cost {victim.cost:.1f}, budget {self.max_cost:g})",
+                status_code=429,
+                retry_after=self.retry_after(),
+            ))
+            shed = True
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(future, cost, *self._tag(lane, cost))
+        lane.waiters.append(waiter)
+        if shed:
+            # The victim may have been what held the rest of the queue back
+            self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was handed over just as we gave up; pass it on
+                self._release_local(lane, cost)
+            else:
+                try:
+                    lane.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout_total += 1
+                raise SchedulerRejected(
+                    f"Request waited {self.queue_timeout}s in queue without a free slot",
+                    status_code=503,
+                    retry_after=self.retry_after(),
+                )
+            raise
+
+    def release(self, cost: float = 1.0, lane: Optional[str] = None):
+        """Give back the host-wide slot, then this process's slot"""
+        if self.shared_slots is not None:
+            self.shared_slots.release()
+        self._release_local(self._lane(lane), self._budgeted(cost))
+
+    def _release_local(self, lane: _Lane, cost: float):
+        """Free the slot and its cost, then admit waiters that now fit"""
+        self._running -= 1
+        lane.running -= 1
+        self._cost = self._cost - cost if self._running else 0.0
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit queued requests in fair order; cheaper ones may pass one that does not fit"""
+        for lane in self._lanes.values():
+            if any(w.future.done() for w in lane.waiters):
+                lane.waiters = deque(w for w in lane.waiters if not w.future.done())
+
+        blocked: Optional[_Waiter] = None
+        while self._running < self.max_concurrency:
+            chosen: Optional[Tuple[_Lane, _Waiter]] = None
+            for lane, waiter in self._in_fair_order():
+                if self._fits(waiter.cost):
+                    chosen = lane, waiter
+                    break
+                if blocked is None:
+                    blocked = waiter
+            if chosen is None:
+                return
+            if blocked is not None:
+                if blocked.bypassed >= self.max_bypass:
+                    # Hold everything back until the starved request fits
+                    return
+                blocked.bypassed += 1
+            lane, waiter = chosen
+            lane.waiters.remove(waiter)
+            self._admit(lane, waiter.cost, waiter.start)
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1.0, lane: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold a concurrency slot and cost budget for the duration of the block"""
+        await self.acquire(cost, lane)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self._avg_service = held if not self._avg_service else 0.8 * self._avg_service + 0.2 * held
+            if cost > 0:
+                per_cost = held / cost
+                self._avg_per_cost = per_cost if not self._avg_per_cost else 0.8 * self._avg_per_cost + 0.2 * per_cost
+            self.release(cost, lane)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of scheduler state for health and metrics"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queued": self.queued,
+            "max_cost": self.max_cost,
+            "inflight_cost": round(self._cost, 3),
+            "admitted_total": self.admitted_total,
+            "rejected_full_total": self.rejected_full_total,
+            "rejected_timeout_total": self.rejected_timeout_total,
+            "shed_total": self.shed_total,
+            "wait_seconds_sum": self.wait_seconds_sum,
+            "wait_seconds_count": self.wait_seconds_count,
+            "lanes": {
+                lane.name: {
+                    "weight": lane.weight,
+                    "running": lane.running,
+                    "queued": len(lane.waiters),
+                    "admitted_total": lane.admitted_total,
+                }
+                for lane in self._lanes.values()
+            },
+        }
@@ -0,0 +1,103 @@
+"""
+Conversation Session Store
+Maps conversation prefixes to persisted Claude CLI sessions so only new turns are sent
+"""
+
+import hashlib
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def prefix_hashes(model: str, messages: List[Dict[str, Any]]) -> List[str]:
+    """Chained hash of every prefix: result[k] covers messages[:k]
+
+    Each step only hashes one message, so all prefixes cost one pass.
+    """
+    digest = hashlib.sha256(model.encode("utf-8")).digest()
+    hashes = [digest.hex()]
+    for message in messages:
+        role = message.get("role", "")
+        role = getattr(role, "value", role)  # MessageRole enum or plain str
+        step = hashlib.sha256(digest)
+        step.update(b"\x00" + str(role).encode("utf-8"))
+        step.update(b"\x00" + str(message.get("content", "")).encode("utf-8"))
+        digest = step.digest()
+        hashes.append(digest.hex())
+    return hashes
+
+
+class SessionStore:
+    """LRU of conversation-prefix hash -> CLI session id"""
+
+    def __init__(self, max_sessions: int, ttl: float):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.resume_failures = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def lookup(self, model: str, messages: List[Dict[str, Any]]) -> Tuple[Optional[str], int]:
+        """Find the longest known prefix ending in an assistant turn
+
+        Returns (session_id, number of messages the session already holds),
+        or (None, 0) when the request does not extend a known conversation.
+        """
+        hashes = prefix_hashes(model, messages)
+        now = time.monotonic()
+        # A resumable prefix must leave at least one new message to send
+        for covered in range(len(messages) - 1, 0, -1):
+            if messages[covered - 1].get("role") != "assistant":
+                continue
+            key = hashes[covered]
+            entry = self._sessions.get(key)
+            if entry is None:
+                continue
+            session_id, expires_at = entry
+            if expires_at <= now:
+                del self._sessions[key]
+                self.expirations += 1
+                continue
+            self._sessions.move_to_end(key)
+            self.hits += 1
+            return session_id, covered
+
+        self.misses += 1
+        return None, 0
+
+    def remember(self, model: str, messages: List[Dict[str, Any]], session_id: str):
+        """Record that session_id now holds exactly these messages"""
+        key = prefix_hashes(model, messages)[-1]
+        self._sessions[key] = (session_id, time.monotonic() + self.ttl)
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def forget(self, session_id: str):
+        """Drop every prefix pointing at a session the CLI can no longer resume"""
+        self.resume_failures += 1
+        for key in [k for k, (sid, _) in self._sessions.items() if sid == session_id]:
+            del self._sessions[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for health and metrics"""
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "resume_failures": self.resume_failures,
+        }
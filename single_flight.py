@@ -0,0 +1,198 @@
+"""
+Request Coalescing
+Single-flight execution so identical concurrent requests share one CLI call
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """An in-flight call and how many callers are waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run fn once per key; concurrent callers with the same key share the result"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.leaders_total = 0
+        self.coalesced_total = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders_total += 1
+        else:
+            self.coalesced_total += 1
+            logger.debug(f"Coalesced request onto in-flight call {key[:12]}")
+
+        call.waiters += 1
+        try:
+            # Shielded so one caller going away does not cancel the others
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+
+class StreamFlight:
+    """Text deltas from one producer, replayed to every subscriber"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        # Total characters published, so readers can tell how much is pending
+        self.size = 0
+        self.admitted = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Producer's summary of the finished call (usage, stop reason), if any
+        self.result: Any = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def admit(self):
+        """Mark the producer as past admission control"""
+        self.admitted = True
+        self._notify()
+
+    def publish(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def wait_admitted(self):
+        """Wait until the producer is admitted, re-raising an admission failure"""
+        while not self.admitted and not self.done:
+            await self._changed.wait()
+        if not self.admitted and self.error is not None:
+            raise self.error
+
+    async def iter_batches(
+        self,
+        flush_interval: float = 0.0,
+        flush_size: int = 0,
+        idle_timeout: Optional[float] = None,
+    ) -> AsyncIterator[Optional[str]]:
+        """Yield every delta so far, then new ones, joined into batches
+
+        The first delta goes out at once; after that deltas are held until
+        flush_interval seconds have passed since the previous batch or
+        flush_size characters are pending. Yields None when nothing new has
+        arrived for idle_timeout seconds (the caller's cue for a heartbeat).
+        """
+        loop = asyncio.get_running_loop()
+        index = 0
+        sent = 0
+        next_flush = 0.0
+        while True:
+            pending = self.size - sent
+            if pending and (self.done or loop.time() >= next_flush or (flush_size and pending >= flush_size)):
+                batch = "".join(self.parts[index:])
+                index, sent = len(self.parts), self.size
+                next_flush = loop.time() + flush_interval
+                yield batch
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+            timeout = next_flush - loop.time() if pending else idle_timeout
+            if timeout is None:
+                await self._changed.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._changed.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                if not pending:
+                    yield None
+
+
+class StreamFanout:
+    """Single-flight for streams: late joiners replay buffered deltas then follow live"""
+
+    def __init__(self):
+        self._flights: Dict[str, StreamFlight] = {}
+        self.leaders_total = 0
+        self.coalesced_total = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _forget(self, key: str, flight: StreamFlight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _run(self, flight: StreamFlight, produce: Callable[[StreamFlight], Awaitable[None]]):
+        try:
+            await produce(flight)
+            flight.finish()
+        except asyncio.CancelledError:
+            flight.finish(RuntimeError("Stream cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+
+    @asynccontextmanager
+    async def join(
+        self,
+        key: Optional[str],
+        produce: Callable[[StreamFlight], Awaitable[None]],
+    ) -> AsyncIterator[StreamFlight]:
+        """Subscribe to the flight for key, starting produce if none is running
+
+        A key of None always starts a private flight. The producer is
+        cancelled once its last subscriber leaves.
+        """
+        flight = self._flights.get(key) if key else None
+        if flight is None:
+            flight = StreamFlight()
+            flight.task = asyncio.create_task(self._run(flight, produce))
+            if key:
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders_total += 1
+        else:
+            self.coalesced_total += 1
+            logger.debug(f"Coalesced stream onto in-flight stream {key[:12]}")
+
+        flight.subscribers += 1
+        try:
+            await flight.wait_admitted()
+            yield flight
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                flight.task.cancel()
@@ -0,0 +1,73 @@
+"""
+Server-Sent Events
+text/event-stream framing for chat.completion.chunk streams
+"""
+
+from typing import Any, Dict, Optional
+
+import fast_json
+
+MEDIA_TYPE = "text/event-stream"
+HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # Disable nginx buffering
+}
+
+# Frames are bytes, so the ASGI server sends them without re-encoding
+DONE = b"data: [DONE]\n\n"
+# SSE comment line: ignored by clients, but keeps idle proxies from timing out
+HEARTBEAT = b": keep-alive\n\n"
+
+_PLACEHOLDER = "\x00content\x00"
+
+
+def frame(payload: Dict[str, Any]) -> bytes:
+    return b"data: " + fast_json.dumps(payload) + b"\n\n"
+
+
+class ChunkEncoder:
+    """Encodes chunks of one completion; content deltas reuse a precomputed template
+
+    Everything in a content chunk except the text is the same for the whole
+    stream, so the frame is split once around the content and each delta
+    costs one encode of a string. Output is byte-identical to encoding
+    the full chunk dict.
+    """
+
+    def __init__(self, chunk_id: str, created: int, model: str):
+        self._base = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+        }
+        template = frame(self._chunk({"content": _PLACEHOLDER}, None))
+        self._prefix, self._suffix = template.split(fast_json.dumps(_PLACEHOLDER))
+
+    def _chunk(self, delta: Optional[Dict[str, Any]], finish_reason: Optional[str]) -> Dict[str, Any]:
+        return {
+            **self._base,
+            # The usage-only chunk has no choices, as in OpenAI's stream_options
+            "choices": [] if delta is None else [{
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason
+            }]
+        }
+
+    def content(self, text: str) -> bytes:
+        """Frame for a content delta"""
+        return self._prefix + fast_json.dumps(text) + self._suffix
+
+    def chunk(
+        self,
+        delta: Optional[Dict[str, Any]],
+        finish_reason: Optional[str] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> bytes:
+        """Frame for any other chunk (role, finish, usage)"""
+        chunk = self._chunk(delta, finish_reason)
+        if usage is not None:
+            chunk["usage"] = usage
+        return frame(chunk)
@@ -15,4 +15,14 @@ fi
 
 # Start server
 echo "🌐 Starting server on http://localhost:${PORT:-8000}"
-python3 -m uvicorn main:app --host ${HOST:-0.0.0.0} --port ${PORT:-8000}
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    # Multi-worker mode: state shared through SHARED_STATE_DIR (see gunicorn.conf.py)
+    echo "👥 Running ${WEB_CONCURRENCY} workers"
+    exec gunicorn -c gunicorn.conf.py main:app
+fi
+# Keep connections open for the drain plus the CLI kill grace (see SHUTDOWN_DRAIN_TIMEOUT)
+DRAIN=${SHUTDOWN_DRAIN_TIMEOUT:-30}
+GRACE=${SHUTDOWN_KILL_GRACE:-5}
+GRACEFUL_SHUTDOWN=$(( ${DRAIN%.*} + ${GRACE%.*} + 2 ))
+exec python3 -m uvicorn main:app --host ${HOST:-0.0.0.0} --port ${PORT:-8000} \
+    --timeout-graceful-shutdown ${GRACEFUL_SHUTDOWN}
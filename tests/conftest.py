@@ -0,0 +1,15 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# Every test drives benchmarks/fake_claude.py; nothing needs the real CLI or the network
+os.environ.update({
+    "CLAUDE_CLI_PATH": f"{sys.executable} {ROOT / 'benchmarks' / 'fake_claude.py'}",
+    "CLAUDE_CLI_CACHE_FILE": "",
+    "BATCH_ENABLED": "false",
+    "LOOP_MONITOR_ENABLED": "false",
+})
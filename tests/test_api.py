@@ -0,0 +1,55 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def completion(text):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": text}]}
+
+
+@pytest.fixture
+def app_env(monkeypatch):
+    # One slow CLI call at a time, so a second request has to queue
+    monkeypatch.setenv("MAX_CONCURRENCY", "1")
+    monkeypatch.setenv("FAKE_CLAUDE_STARTUP_MS", "500")
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+    return monkeypatch
+
+
+async def _post_concurrently(bodies):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+            responses = []
+            for body in bodies:
+                responses.append(asyncio.create_task(http.post("/v1/chat/completions", json=body)))
+                # Arrive in order, so the first one is running before the rest queue
+                await asyncio.sleep(0.05)
+            return await asyncio.gather(*responses)
+
+
+def test_full_queue_rejects_with_429(app_env):
+    app_env.setenv("MAX_QUEUE_SIZE", "1")
+    responses = run(_post_concurrently([completion(f"request {i}") for i in range(3)]))
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    rejected = responses[2]
+    assert rejected.json()["error"]["code"] == "queue_full"
+    assert int(rejected.headers["Retry-After"]) >= 1
+
+
+def test_queue_timeout_returns_503(app_env):
+    app_env.setenv("QUEUE_TIMEOUT", "0.2")
+    responses = run(_post_concurrently([completion("slow"), completion("waits too long")]))
+
+    assert [r.status_code for r in responses] == [200, 503]
+    rejected = responses[1]
+    assert rejected.json()["error"]["code"] == "queue_timeout"
+    assert "Retry-After" in rejected.headers
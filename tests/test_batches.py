@@ -0,0 +1,204 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+from batches import BatchManager, FileStore, owner_id
+from rate_limiter import RateLimiter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def jsonl(*custom_ids):
+    return "".join(
+        json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": "gpt-4", "messages": [{"role": "user", "content": f"prompt {custom_id}"}]},
+        }) + "\n"
+        for custom_id in custom_ids
+    ).encode("utf-8")
+
+
+def make_manager(tmp_path, **kwargs):
+    files = FileStore(tmp_path / "files")
+    return files, BatchManager(
+        files,
+        tmp_path / "batches",
+        get_client=lambda: main.claude_client,
+        request_model=main.ChatCompletionRequest,
+        priority=None,
+        **kwargs
+    )
+
+
+@pytest.fixture
+def batch_app(monkeypatch, tmp_path):
+    files, manager = make_manager(tmp_path)
+    monkeypatch.setattr(main, "batch_files", files)
+    monkeypatch.setattr(main, "batch_manager", manager)
+    monkeypatch.setattr(main.config, "VALID_API_KEYS", ["key-a", "key-b"])
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+    return manager
+
+
+async def _with_app(scenario):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+            return await scenario(http)
+
+
+def as_key(key):
+    return {"Authorization": f"Bearer {key}"}
+
+
+async def _upload_and_run(http, key, content):
+    uploaded = await http.post(
+        "/v1/files", files={"file": ("in.jsonl", content)}, data={"purpose": "batch"}, headers=as_key(key)
+    )
+    batch = (await http.post(
+        "/v1/batches",
+        json={"input_file_id": uploaded.json()["id"], "endpoint": "/v1/chat/completions", "completion_window": "24h"},
+        headers=as_key(key),
+    )).json()
+    while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(0.05)
+        batch = (await http.get(f"/v1/batches/{batch['id']}", headers=as_key(key))).json()
+    return uploaded.json(), batch
+
+
+def test_batch_runs_to_completion(batch_app):
+    async def scenario(http):
+        _, batch = await _upload_and_run(http, "key-a", jsonl("r1", "r2", "r3"))
+        output = await http.get(f"/v1/files/{batch['output_file_id']}/content", headers=as_key("key-a"))
+        return batch, [json.loads(line) for line in output.text.splitlines()]
+
+    batch, lines = run(_with_app(scenario))
+
+    assert batch["status"] == "completed"
+    assert batch["request_counts"] == {"total": 3, "completed": 3, "failed": 0}
+    assert "owner" not in batch
+    assert sorted(line["custom_id"] for line in lines) == ["r1", "r2", "r3"]
+    assert all(line["response"]["status_code"] == 200 for line in lines)
+
+
+def test_files_and_batches_are_private_to_their_key(batch_app):
+    async def scenario(http):
+        uploaded, batch = await _upload_and_run(http, "key-a", jsonl("r1"))
+        other = as_key("key-b")
+        return {
+            "files": (await http.get("/v1/files", headers=other)).json()["data"],
+            "batches": (await http.get("/v1/batches", headers=other)).json()["data"],
+            "file": (await http.get(f"/v1/files/{uploaded['id']}", headers=other)).status_code,
+            "output": (await http.get(f"/v1/files/{batch['output_file_id']}/content", headers=other)).status_code,
+            "delete": (await http.delete(f"/v1/files/{uploaded['id']}", headers=other)).status_code,
+            "batch": (await http.get(f"/v1/batches/{batch['id']}", headers=other)).status_code,
+            "cancel": (await http.post(f"/v1/batches/{batch['id']}/cancel", headers=other)).status_code,
+            "reuse": (await http.post(
+                "/v1/batches",
+                json={"input_file_id": uploaded["id"], "endpoint": "/v1/chat/completions"},
+                headers=other,
+            )).status_code,
+            "own_files": len((await http.get("/v1/files", headers=as_key("key-a"))).json()["data"]),
+        }
+
+    seen = run(_with_app(scenario))
+
+    assert seen["files"] == [] and seen["batches"] == []
+    assert [seen[name] for name in ("file", "output", "delete", "batch", "cancel", "reuse")] == [404] * 6
+    # The input file and the batch's output file
+    assert seen["own_files"] == 2
+
+
+def test_restart_resumes_only_unfinished_requests(monkeypatch, tmp_path):
+    files, manager = make_manager(tmp_path)
+    owner = owner_id("key-a")
+
+    async def scenario():
+        chunks = iter([jsonl("r1", "r2", "r3"), b""])
+        meta = await files.create(lambda _: asyncio.sleep(0, next(chunks)), "in.jsonl", "batch", 1 << 20, owner)
+        # A previous run finished r1 and crashed halfway through writing r2's line
+        batch = manager.create(meta["id"], "/v1/chat/completions", owner)
+        await manager.close()
+        stored = manager._load(batch["id"])
+        stored.update(status="in_progress", request_counts={"total": 3, "completed": 0, "failed": 0})
+        manager._save(stored)
+        batch_dir = manager._dir(batch["id"])
+        (batch_dir / "output.jsonl").write_text(json.dumps({"custom_id": "r1"}) + "\n" + '{"custom_id": "r2", "resp')
+
+        _, restarted = make_manager(tmp_path)
+        client = main.ClaudeCodeClient()
+        monkeypatch.setattr(main, "claude_client", client)
+        try:
+            await restarted.start()
+            await asyncio.gather(*restarted._tasks.values())
+        finally:
+            await client.close()
+        lines = (batch_dir / "output.jsonl").read_text().splitlines()
+        return restarted.get(batch["id"], owner), [json.loads(line)["custom_id"] for line in lines]
+
+    batch, custom_ids = run(scenario())
+
+    assert batch["status"] == "completed"
+    assert batch["request_counts"] == {"total": 3, "completed": 3, "failed": 0}
+    # r1 is not run again and the torn r2 line is replaced by a whole one
+    assert custom_ids[0] == "r1" and sorted(custom_ids[1:]) == ["r2", "r3"]
+
+
+def test_batch_requests_count_against_the_submitters_rate_limit(monkeypatch, tmp_path):
+    # Two requests per window: the third line has to wait for the window to slide
+    limiter = RateLimiter(limit=2, window=1)
+    charged = []
+
+    async def rate_limit(key):
+        result = await limiter.check(key)
+        charged.append((key, result.allowed))
+        return result
+
+    files, manager = make_manager(tmp_path, rate_limit=rate_limit)
+    owner = owner_id("key-a")
+
+    async def scenario():
+        chunks = iter([jsonl("r1", "r2", "r3"), b""])
+        meta = await files.create(lambda _: asyncio.sleep(0, next(chunks)), "in.jsonl", "batch", 1 << 20, owner)
+        client = main.ClaudeCodeClient()
+        monkeypatch.setattr(main, "claude_client", client)
+        try:
+            batch = manager.create(meta["id"], "/v1/chat/completions", owner, rate_limit_key=f"key:{owner}")
+            await asyncio.gather(*manager._tasks.values())
+        finally:
+            await client.close()
+        return manager.get(batch["id"], owner)
+
+    batch = run(scenario())
+
+    assert batch["status"] == "completed"
+    assert "rate_limit_key" not in batch
+    assert {key for key, _ in charged} == {f"key:{owner}"}
+    assert [allowed for _, allowed in charged].count(True) == 3
+    assert not all(allowed for _, allowed in charged)
+
+
+def test_batch_errors_use_the_openai_error_body(batch_app):
+    async def scenario(http):
+        key = as_key("key-a")
+        wrong_purpose = await http.post(
+            "/v1/files", files={"file": ("in.jsonl", jsonl("r1"))}, data={"purpose": "fine-tune"}, headers=key
+        )
+        missing = await http.get("/v1/batches/batch_000000000000000000000000", headers=key)
+        _, batch = await _upload_and_run(http, "key-a", jsonl("r1"))
+        finished = await http.post(f"/v1/batches/{batch['id']}/cancel", headers=key)
+        return wrong_purpose, missing, finished
+
+    responses = run(_with_app(scenario))
+
+    assert [r.status_code for r in responses] == [400, 404, 409]
+    for response in responses:
+        assert set(response.json()) == {"error"}
+        assert response.json()["error"]["type"] == "invalid_request_error"
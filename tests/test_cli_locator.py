@@ -0,0 +1,100 @@
+import asyncio
+import os
+import shutil
+
+import pytest
+
+from cli_locator import NPX_PACKAGE, ResolvedCLI, load_cached, locate_claude_cli, resolve_claude_cli, save_cached
+
+# Looked up before the tests narrow PATH down to their own scripts
+SLEEP = shutil.which("sleep")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def executable(directory, name, body="exit 0"):
+    path = directory / name
+    path.write_text(f"#!/bin/sh\n{body}\n")
+    path.chmod(0o755)
+    return path
+
+
+@pytest.fixture
+def bin_dir(monkeypatch, tmp_path):
+    """An otherwise empty PATH, so only the scripts a test writes are found"""
+    directory = tmp_path / "bin"
+    directory.mkdir()
+    monkeypatch.setenv("PATH", str(directory))
+    return directory
+
+
+def test_cached_resolution_is_dropped_when_the_executable_changes(bin_dir, tmp_path):
+    claude = executable(bin_dir, "claude")
+    cache_file = tmp_path / "cli.json"
+
+    found = locate_claude_cli(None, cache_file)
+    cached = load_cached(cache_file)
+    stat = claude.stat()
+    os.utime(claude, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    after_upgrade = load_cached(cache_file)
+
+    assert found == ResolvedCLI(command=str(claude), source="path")
+    assert cached.command == str(claude) and cached.source == "cache"
+    assert after_upgrade is None
+
+
+def test_cached_resolution_is_dropped_when_path_changes(bin_dir, tmp_path, monkeypatch):
+    executable(bin_dir, "claude")
+    cache_file = tmp_path / "cli.json"
+    locate_claude_cli(None, cache_file)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{tmp_path}")
+
+    assert load_cached(cache_file) is None
+
+
+def test_explicit_command_is_never_cached(bin_dir, tmp_path):
+    executable(bin_dir, "claude")
+    cache_file = tmp_path / "cli.json"
+
+    resolved = locate_claude_cli("claude --verbose", cache_file)
+    save_cached(cache_file, resolved)
+
+    assert resolved.source == "env"
+    assert not cache_file.exists()
+
+
+def test_npx_fallback_is_awaited_and_cached(bin_dir, tmp_path):
+    executable(bin_dir, "npx", f'{SLEEP} 0.3\necho "1.2.3 (Claude Code)"')
+    cache_file = tmp_path / "cli.json"
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        assert locate_claude_cli(None, cache_file) is None
+        task = asyncio.create_task(ticker())
+        resolved = await resolve_claude_cli(None, cache_file)
+        task.cancel()
+        return resolved, ticks
+
+    resolved, ticks = run(scenario())
+
+    # The event loop kept running while npx was busy
+    assert ticks >= 10
+    assert resolved == ResolvedCLI(command=f"npx {NPX_PACKAGE}", source="npx", version="1.2.3 (Claude Code)")
+    assert load_cached(cache_file).command == f"npx {NPX_PACKAGE}"
+
+
+def test_slow_npx_times_out(bin_dir, tmp_path):
+    executable(bin_dir, "npx", f"exec {SLEEP} 10")
+
+    with pytest.raises(RuntimeError, match="not found"):
+        run(resolve_claude_cli(None, tmp_path / "cli.json", npx_timeout=0.2))
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from corrected_claude_client import ClaudeCodeClient, CLIResult
+from main import ChatCompletionRequest
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def result_event(**fields):
+    event = {
+        "type": "result",
+        "subtype": "success",
+        "is_error": False,
+        "result": "  the answer \n",
+        "session_id": "abc",
+        "stop_reason": "end_turn",
+        "duration_ms": 120,
+        "usage": {
+            "input_tokens": 10,
+            "cache_creation_input_tokens": 5,
+            "cache_read_input_tokens": 100,
+            "output_tokens": 7,
+        },
+    }
+    event.update(fields)
+    return json.dumps(event).encode("utf-8")
+
+
+@pytest.fixture
+def client():
+    client = ClaudeCodeClient()
+    yield client
+    run(client.close())
+
+
+def test_json_result_carries_text_session_and_usage(client):
+    result = client._parse_json_result(result_event())
+
+    assert result.text == "the answer"
+    assert result.session_id == "abc"
+    # Prompt tokens include prompt-cache reads and writes
+    assert (result.prompt_tokens, result.completion_tokens) == (115, 7)
+    assert result.duration_ms == 120
+
+
+def test_json_result_errors(client):
+    with pytest.raises(RuntimeError, match="Unparseable JSON"):
+        client._parse_json_result(b"not json")
+    with pytest.raises(RuntimeError, match="rate limited"):
+        client._parse_json_result(result_event(is_error=True, result="rate limited"))
+    with pytest.raises(RuntimeError, match="error_max_turns"):
+        client._parse_json_result(result_event(is_error=True, result="", subtype="error_max_turns"))
+
+
+@pytest.mark.parametrize("stop_reason, finish_reason", [
+    ("end_turn", "stop"),
+    ("stop_sequence", "stop"),
+    ("max_tokens", "length"),
+    ("tool_use", "tool_calls"),
+    ("refusal", "content_filter"),
+    ("something_new", "stop"),
+    (None, "stop"),
+])
+def test_stop_reason_maps_to_finish_reason(client, stop_reason, finish_reason):
+    assert client._finish_reason(CLIResult(text="x", stop_reason=stop_reason)) == finish_reason
+
+
+def test_plain_text_result_falls_back_to_the_token_counter(client):
+    request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "hello"}])
+    messages = [{"role": "user", "content": "hello"}]
+
+    response = client._build_completion_response(request, messages, "hi there", CLIResult(text="hi there"))
+
+    assert response["choices"][0]["finish_reason"] == "stop"
+    assert response["usage"]["completion_tokens"] == client.token_counter.count("hi there")
+    assert "claude" not in response
+
+
+def test_json_output_format_reports_the_clis_usage(monkeypatch):
+    monkeypatch.setenv("CLAUDE_OUTPUT_FORMAT", "json")
+
+    async def scenario():
+        client = ClaudeCodeClient()
+        try:
+            request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "hello"}])
+            return await client.chat_completion(request)
+        finally:
+            await client.close()
+
+    response = run(scenario())
+
+    # benchmarks/fake_claude.py reports input_tokens = len(prompt) // 4 + 1 and stop_reason end_turn
+    assert response["choices"][0]["finish_reason"] == "stop"
+    assert response["claude"]["stop_reason"] == "end_turn"
+    assert response["usage"]["completion_tokens"] == len(response["choices"][0]["message"]["content"]) // 4 + 1
+    assert response["usage"]["total_tokens"] == response["usage"]["prompt_tokens"] + response["usage"]["completion_tokens"]
@@ -0,0 +1,66 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from corrected_claude_client import ClaudeCodeClient
+from main import ChatCompletionRequest
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def completion(text):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": text}]}
+
+
+def test_draining_rejects_new_requests_and_finishes_in_flight_ones(monkeypatch):
+    monkeypatch.setenv("FAKE_CLAUDE_STARTUP_MS", "500")
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+                in_flight = asyncio.create_task(http.post("/v1/chat/completions", json=completion("before")))
+                while not main.claude_client.processes.live():
+                    await asyncio.sleep(0.01)
+                main.begin_shutdown()
+                rejected = await http.post("/v1/chat/completions", json=completion("after"))
+                return await in_flight, rejected
+
+    finished, rejected = run(scenario())
+
+    assert finished.status_code == 200
+    assert finished.json()["choices"][0]["message"]["content"]
+    assert rejected.status_code == 503
+    assert "Retry-After" in rejected.headers
+
+
+def test_drain_deadline_terminates_what_is_still_running(monkeypatch):
+    monkeypatch.setenv("FAKE_CLAUDE_STARTUP_MS", "10000")
+    monkeypatch.setenv("SHUTDOWN_KILL_GRACE", "0.5")
+
+    async def scenario():
+        client = ClaudeCodeClient()
+        request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "slow"}])
+        call = asyncio.create_task(client.chat_completion(request))
+        while not client.processes.live():
+            await asyncio.sleep(0.01)
+        process = client.processes.live()[0]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await client.begin_drain(0.2)
+        drained_in = loop.time() - started
+        with pytest.raises(RuntimeError):
+            await call
+        await client.close()
+        return drained_in, process.returncode
+
+    drained_in, returncode = run(scenario())
+
+    # The deadline plus at most the kill grace, not the CLI's ten seconds
+    assert drained_in < 2
+    assert returncode is not None
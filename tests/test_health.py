@@ -0,0 +1,85 @@
+import asyncio
+
+import httpx
+
+import main
+from corrected_claude_client import ClaudeCodeClient
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def count_probes(monkeypatch):
+    probes = []
+    probe_health = ClaudeCodeClient.probe_health
+
+    async def counted(self):
+        probes.append(1)
+        return await probe_health(self)
+
+    monkeypatch.setattr(ClaudeCodeClient, "probe_health", counted)
+    return probes
+
+
+def test_health_endpoint_serves_the_cached_probe_and_reports_stale(monkeypatch):
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+    probes = count_probes(monkeypatch)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                fresh = [(await http.get("/health")).json() for _ in range(5)]
+                probes_after_requests = len(probes)
+                # The background prober stopped long enough ago to be distrusted
+                main.claude_client._health_checked_at -= main.claude_client.config.HEALTH_STALE_AFTER + 1
+                stale = (await http.get("/health")).json()
+                return fresh, probes_after_requests, stale
+
+    fresh, probes_after_requests, stale = run(scenario())
+
+    # Probed once at startup, never by /health itself
+    assert probes_after_requests == 1
+    assert all(body["status"] == "healthy" for body in fresh)
+    assert fresh[0]["claude_cli"]["authenticated"] is True
+    assert stale["status"] == "degraded"
+    assert stale["claude_cli"]["claude_cli"] == "stale"
+    assert "old" in stale["claude_cli"]["error"]
+
+
+def test_background_prober_refreshes_the_cache(monkeypatch):
+    monkeypatch.setenv("HEALTH_CHECK_INTERVAL", "0.05")
+    probes = count_probes(monkeypatch)
+
+    async def scenario():
+        client = ClaudeCodeClient()
+        before = client.check_health()
+        await client.start()
+        first = client.check_health()["checked_at"]
+        await asyncio.sleep(0.5)
+        latest = client.check_health()
+        await client.close()
+        return before, first, latest
+
+    before, first, latest = run(scenario())
+
+    assert before["claude_cli"] == "unknown"
+    assert latest["claude_cli"] == "healthy"
+    assert latest["checked_at"] > first
+    assert len(probes) >= 3
+
+
+def test_failing_cli_is_unhealthy(monkeypatch):
+    monkeypatch.setenv("CLAUDE_CLI_PATH", "false")
+
+    async def scenario():
+        client = ClaudeCodeClient()
+        health = await client.refresh_health()
+        await client.close()
+        return health
+
+    health = run(scenario())
+
+    assert health["claude_cli"] == "unhealthy"
+    assert health["command"] == "false"
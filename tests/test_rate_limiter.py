@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import httpx
+
+import main
+import rate_limiter
+from rate_limiter import RateLimiter, SQLiteRateLimitBackend
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_window_slides_instead_of_resetting(monkeypatch):
+    clock = Clock(1000.0)
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    limiter = RateLimiter(limit=4, window=10)
+
+    async def scenario():
+        first = [(await limiter.check("key")).allowed for _ in range(5)]
+        # Halfway into the next window half of the previous window still counts: 4 * 0.5 = 2
+        clock.now = 1015.0
+        half = [(await limiter.check("key")).allowed for _ in range(3)]
+        # Two whole windows later nothing is left
+        clock.now = 1030.0
+        fresh = await limiter.check("key")
+        other = await limiter.check("other key")
+        return first, half, fresh, other
+
+    first, half, fresh, other = run(scenario())
+
+    assert first == [True, True, True, True, False]
+    assert half == [True, True, False]
+    assert fresh.allowed and fresh.remaining == 3
+    assert other.allowed and other.remaining == 3
+    assert limiter.rejected_total == 2
+
+
+def test_rejection_headers_carry_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "time", Clock(1003.0).time)
+    limiter = RateLimiter(limit=1, window=10)
+
+    async def scenario():
+        return await limiter.check("key"), await limiter.check("key")
+
+    allowed, rejected = run(scenario())
+
+    assert allowed.headers == {"X-RateLimit-Limit": "1", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "7"}
+    assert rejected.headers["Retry-After"] == "7"
+
+
+def test_sqlite_backend_never_admits_more_than_the_limit(tmp_path):
+    # Several workers on one host, each with its own connection to the shared file
+    path = tmp_path / "ratelimit.sqlite3"
+    backends = [SQLiteRateLimitBackend(path) for _ in range(4)]
+    barrier = threading.Barrier(len(backends))
+    admitted = []
+
+    def worker(backend):
+        barrier.wait()
+        admitted.extend(allowed for allowed, _ in (backend._hit("key", 1000, 60, 50, 0.0) for _ in range(30)))
+
+    threads = [threading.Thread(target=worker, args=(backend,)) for backend in backends]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    async def close():
+        for backend in backends:
+            await backend.close()
+
+    run(close())
+
+    assert admitted.count(True) == 50
+    assert len(admitted) == 120
+
+
+def test_responses_carry_rate_limit_headers(monkeypatch):
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(limit=2, window=60))
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return [await http.get("/v1/models") for _ in range(3)]
+
+    responses = run(scenario())
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert [r.headers["X-RateLimit-Remaining"] for r in responses] == ["1", "0", "0"]
+    # The 429 already sets them; the middleware must not add a second copy
+    assert responses[2].headers.get_list("X-RateLimit-Limit") == ["2"]
+    assert "Retry-After" in responses[2].headers
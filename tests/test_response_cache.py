@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import httpx
+
+import main
+import response_cache
+from response_cache import CompletionCache, SharedCompletionCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = CompletionCache(max_entries=2, ttl=60)
+
+    async def scenario():
+        await cache.put("a", "A")
+        await cache.put("b", "B")
+        await cache.get("a")
+        await cache.put("c", "C")
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert run(scenario()) == ["A", None, "C"]
+    assert cache.evictions == 1
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock(100.0)
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    cache = CompletionCache(max_entries=10, ttl=5)
+
+    async def scenario():
+        await cache.put("a", "A")
+        clock.now = 104.9
+        fresh = await cache.get("a")
+        clock.now = 105.0
+        return fresh, await cache.get("a")
+
+    assert run(scenario()) == ("A", None)
+    assert cache.expirations == 1 and len(cache) == 0
+
+
+def test_shared_cache_is_seen_by_every_process_and_evicts_by_last_use(monkeypatch, tmp_path):
+    clock = Clock(1000.0)
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    path = tmp_path / "cache.sqlite3"
+    first, second = SharedCompletionCache(path, 2, 60), SharedCompletionCache(path, 2, 60)
+
+    async def scenario():
+        await first.put("a", "A")
+        clock.now += 1
+        await first.put("b", "B")
+        clock.now += 1
+        # A hit from the other process keeps "a" recent once it writes
+        seen = await second.get("a")
+        clock.now += 1
+        await second.put("c", "C")
+        kept = [await first.get(key) for key in ("a", "b", "c")]
+        clock.now += 61
+        expired = await first.get("c")
+        return seen, kept, expired
+
+    seen, kept, expired = run(scenario())
+
+    assert seen == "A"
+    assert kept == ["A", None, "C"]
+    assert expired is None
+
+
+def completion(text, **fields):
+    return {"model": "gpt-4", "messages": [{"role": "user", "content": text}], **fields}
+
+
+def test_identical_requests_hit_the_cache_unless_bypassed(monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "true")
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+                cache = main.claude_client.response_cache
+                first = await http.post("/v1/chat/completions", json=completion("hello"))
+                second = await http.post("/v1/chat/completions", json=completion("hello"))
+                hits_before_bypass = cache.hits
+                for headers in ({"X-Cache-Bypass": "1"}, {"Cache-Control": "no-cache"}):
+                    await http.post("/v1/chat/completions", json=completion("hello"), headers=headers)
+                bypassed_hits = cache.hits - hits_before_bypass
+                stream = await http.post("/v1/chat/completions", json=completion("hello", stream=True))
+                return first.json(), second.json(), hits_before_bypass, bypassed_hits, stream, cache.hits
+
+    first, second, hits, bypassed_hits, stream, final_hits = run(scenario())
+
+    content = first["choices"][0]["message"]["content"]
+    assert second["choices"][0]["message"]["content"] == content
+    assert second["id"] != first["id"]
+    assert hits == 1
+    assert bypassed_hits == 0
+
+    # A streaming request replays the cached text as SSE chunks
+    assert final_hits == 2
+    events = [line[len("data: "):] for line in stream.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert "".join(c["choices"][0]["delta"].get("content", "") for c in chunks) == content
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
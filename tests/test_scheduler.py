@@ -0,0 +1,141 @@
+import asyncio
+
+from scheduler import ConcurrencyScheduler, SchedulerRejected
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _admission_order(scheduler, arrivals):
+    """Queue requests in arrival order while the first one holds the slot; return lanes in admission order"""
+    order = []
+    queued = asyncio.Event()
+
+    async def request(lane):
+        async with scheduler.slot(1.0, lane):
+            order.append(lane[0])
+            await queued.wait()
+
+    tasks = []
+    for lane in arrivals:
+        tasks.append(asyncio.create_task(request(lane)))
+        await asyncio.sleep(0)
+    queued.set()
+    await asyncio.gather(*tasks)
+    return "".join(order)
+
+
+def test_backlogged_lanes_share_slots_by_weight():
+    scheduler = ConcurrencyScheduler(1, 100, 10, lanes={"interactive": 4, "batch": 1})
+    order = run(_admission_order(scheduler, ["batch"] * 20 + ["interactive"] * 20))
+
+    # The first batch request is already running when interactive arrives;
+    # from then on batch gets one dispatch for every four interactive ones
+    assert order == "b" + "i" * 8 + ("b" + "i" * 4) * 3 + "b" * 16
+
+
+def test_returning_lane_does_not_starve_the_other():
+    scheduler = ConcurrencyScheduler(1, 100, 10, lanes={"interactive": 4, "batch": 1})
+
+    async def scenario():
+        # Batch runs alone for a while, then both lanes are backlogged
+        await _admission_order(scheduler, ["batch"] * 10)
+        return await _admission_order(scheduler, ["batch"] * 10 + ["interactive"] * 10)
+
+    # Neither lane carries credit or debt from the idle period into the 4:1 share
+    assert run(scenario()) == "b" + "i" * 8 + "b" + "i" * 2 + "b" * 8
+
+
+def test_cheap_requests_overtake_an_expensive_one_at_most_max_bypass_times():
+    scheduler = ConcurrencyScheduler(4, 100, 10, max_cost=10, max_bypass=2)
+
+    async def scenario():
+        order = []
+        running = asyncio.Event()
+        release = asyncio.Event()
+
+        async def request(name, cost):
+            async with scheduler.slot(cost):
+                order.append(name)
+                running.set()
+                await release.wait()
+
+        # Half the budget is spent, so the expensive request has to queue
+        first = asyncio.create_task(request("first", 5))
+        await running.wait()
+        tasks = [asyncio.create_task(request("expensive", 6))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request(f"cheap{i}", 1)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        admitted_while_blocked = list(order)
+        release.set()
+        await asyncio.gather(first, *tasks)
+        return admitted_while_blocked, order
+
+    blocked, order = run(scenario())
+
+    # The third cheap request would fit too, but two have already passed the expensive one
+    assert blocked == ["first", "cheap0", "cheap1"]
+    assert order.index("expensive") < order.index("cheap2")
+
+
+def test_full_queue_sheds_its_most_expensive_waiter():
+    scheduler = ConcurrencyScheduler(1, 1, 10, max_cost=10)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold(cost):
+            async with scheduler.slot(cost):
+                await release.wait()
+
+        running = asyncio.create_task(hold(1))
+        await asyncio.sleep(0)
+        expensive = asyncio.create_task(hold(9))
+        await asyncio.sleep(0)
+        cheap = asyncio.create_task(hold(1))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(running, expensive, cheap, return_exceptions=True)
+        return results, scheduler.shed_total
+
+    (running, expensive, cheap), shed = run(scenario())
+
+    assert running is None and cheap is None
+    assert isinstance(expensive, SchedulerRejected) and expensive.status_code == 429
+    assert shed == 1
+
+
+def test_request_costlier_than_the_budget_is_charged_the_whole_budget():
+    scheduler = ConcurrencyScheduler(4, 100, 10, max_cost=10)
+
+    async def scenario():
+        seen = {}
+        release = asyncio.Event()
+
+        async def oversized():
+            async with scheduler.slot(50):
+                seen["inflight"] = scheduler.inflight_cost
+                await release.wait()
+
+        async def cheap():
+            async with scheduler.slot(1):
+                seen.setdefault("cheap_saw", scheduler.inflight_cost)
+
+        big = asyncio.create_task(oversized())
+        await asyncio.sleep(0)
+        small = asyncio.create_task(cheap())
+        await asyncio.sleep(0.01)
+        waiting = not small.done()
+        release.set()
+        await asyncio.gather(big, small)
+        return seen, waiting, scheduler.inflight_cost
+
+    seen, waiting, after = run(scenario())
+
+    # It holds exactly the budget, never more, and gives all of it back
+    assert seen["inflight"] == 10
+    assert waiting
+    assert seen["cheap_saw"] == 1
+    assert after == 0
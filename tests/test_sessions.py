@@ -0,0 +1,47 @@
+import asyncio
+import json
+
+from corrected_claude_client import ClaudeCodeClient
+from main import ChatCompletionRequest
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_follow_up_resumes_a_fork_of_the_session(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_REUSE_ENABLED", "true")
+    monkeypatch.setenv("FAKE_CLAUDE_SESSION_DIR", str(tmp_path))
+
+    def histories():
+        """Prompts the fake CLI saw per session, oldest session first"""
+        files = sorted(tmp_path.glob("*.json"), key=lambda path: path.stat().st_mtime_ns)
+        return [json.loads(path.read_text()) for path in files]
+
+    async def scenario():
+        client = ClaudeCodeClient()
+
+        async def ask(*turns):
+            messages = [{"role": role, "content": text} for role, text in turns]
+            response = await client.chat_completion(ChatCompletionRequest(model="gpt-4", messages=messages))
+            return response["choices"][0]["message"]["content"]
+
+        answer = await ask(("user", "first question"))
+        await ask(("user", "first question"), ("assistant", answer), ("user", "follow-up"))
+        after_follow_up = histories()
+        await ask(("user", "first question"), ("assistant", answer), ("user", "edited follow-up"))
+        await client.close()
+        return after_follow_up, histories()
+
+    after_follow_up, after_edit = run(scenario())
+
+    # The follow-up sends only the new message, in a fork of the first session
+    assert len(after_follow_up) == 2
+    first, follow_up = after_follow_up
+    assert len(first) == 1 and "first question" in first[0]
+    assert follow_up[0] == first[0]
+    assert "follow-up" in follow_up[1] and "first question" not in follow_up[1]
+
+    # Editing the follow-up branches from the first session again; the other branch is untouched
+    assert after_edit[:2] == after_follow_up
+    assert after_edit[2][0] == first[0] and "edited follow-up" in after_edit[2][1]
@@ -0,0 +1,82 @@
+import asyncio
+
+from corrected_claude_client import ClaudeCodeClient
+from main import ChatCompletionRequest
+from metrics import CANCELLED_CALLS
+from single_flight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_cancelling_one_caller_keeps_the_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        first = asyncio.create_task(flight.do("key", fn))
+        second = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await second
+        return result, first.cancelled(), len(calls)
+
+    assert run(scenario()) == ("result", True, 1)
+
+
+def test_cancelling_every_caller_cancels_the_call():
+    async def scenario():
+        flight = SingleFlight()
+        started, finished = asyncio.Event(), []
+
+        async def fn():
+            started.set()
+            await asyncio.sleep(10)
+            finished.append(1)
+
+        callers = [asyncio.create_task(flight.do("key", fn)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flight.in_flight, finished
+
+    assert run(scenario()) == (0, [])
+
+
+def test_disconnected_callers_kill_the_cli_process(monkeypatch):
+    monkeypatch.setenv("FAKE_CLAUDE_STARTUP_MS", "5000")
+
+    async def scenario():
+        client = ClaudeCodeClient()
+        request = ChatCompletionRequest(model="gpt-4", messages=[{"role": "user", "content": "hello"}])
+        callers = [asyncio.create_task(client.chat_completion(request)) for _ in range(2)]
+        while not client.processes.live():
+            await asyncio.sleep(0.01)
+        process = client.processes.live()[0]
+
+        callers[0].cancel()
+        await asyncio.sleep(0.1)
+        survived = process.returncode is None
+
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(process.wait(), timeout=5)
+        stats = (client.single_flight.leaders_total, client.single_flight.coalesced_total)
+        await client.close()
+        return survived, stats
+
+    cancelled_before = CANCELLED_CALLS._value.get()
+    survived, stats = run(scenario())
+
+    # One CLI call for both callers; it outlives the first and dies with the last
+    assert stats == (1, 1)
+    assert survived
+    assert CANCELLED_CALLS._value.get() == cancelled_before + 1
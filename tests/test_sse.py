@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import fast_json
+import sse
+
+TEXTS = [
+    "",
+    "plain ascii",
+    'quotes " and \\ backslashes',
+    "control \n\t\r\x00\x1f characters",
+    "non-ascii: café, 日本語, emoji 🎉",
+    "\u2028 line separators \u2029",
+    "</script> & <tags>",
+]
+
+
+def stdlib(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request):
+    if request.param == "orjson" and fast_json.orjson is None:
+        pytest.skip("orjson is not installed")
+    previous = fast_json.backend
+    fast_json.set_backend(request.param)
+    yield request.param
+    fast_json.set_backend(previous)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_dumps_matches_compact_json_dumps(backend, text):
+    payload = {"text": text, "n": 12345, "f": 0.5, "none": None, "list": [True, False], "nested": {"k": text}}
+
+    assert fast_json.dumps(payload) == stdlib(payload)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_content_frames_match_encoding_the_whole_chunk(backend, text):
+    encoder = sse.ChunkEncoder("chatcmpl-abc", 1700000000, "gpt-4")
+    expected = {
+        "id": "chatcmpl-abc",
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": "gpt-4",
+        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+    }
+
+    assert encoder.content(text) == b"data: " + stdlib(expected) + b"\n\n"
+
+
+def test_other_chunks_match_encoding_the_whole_chunk(backend):
+    encoder = sse.ChunkEncoder("chatcmpl-abc", 1700000000, "gpt-4")
+    base = {"id": "chatcmpl-abc", "object": "chat.completion.chunk", "created": 1700000000, "model": "gpt-4"}
+    usage = {"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}
+
+    assert encoder.chunk({"role": "assistant"}) == sse.frame(
+        {**base, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]}
+    )
+    assert encoder.chunk({}, "stop") == b"data: " + stdlib(
+        {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    ) + b"\n\n"
+    # The usage-only chunk has no choices
+    assert encoder.chunk(None, usage=usage) == b"data: " + stdlib({**base, "choices": [], "usage": usage}) + b"\n\n"
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(RuntimeError, match="Unknown JSON_BACKEND"):
+        fast_json.set_backend("simdjson")
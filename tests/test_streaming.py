@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import httpx
+
+import main
+from single_flight import StreamFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _collect(flight, **kwargs):
+    batches = []
+    async for batch in flight.iter_batches(**kwargs):
+        batches.append(batch)
+    return batches
+
+
+def test_deltas_are_coalesced_after_the_first():
+    async def scenario():
+        flight = StreamFlight()
+        reader = asyncio.create_task(_collect(flight, flush_interval=0.1))
+        for text in "abcdef":
+            flight.publish(text)
+            await asyncio.sleep(0.01)
+        flight.finish()
+        return await reader
+
+    batches = run(scenario())
+
+    # The first delta goes out at once, the rest wait for the flush interval
+    assert batches[0] == "a"
+    assert "".join(batches) == "abcdef"
+    assert len(batches) < 6
+
+
+def test_flush_size_sends_early():
+    async def scenario():
+        flight = StreamFlight()
+        reader = asyncio.create_task(_collect(flight, flush_interval=10, flush_size=3))
+        for text in ("a", "bc", "d", "ef", "g"):
+            flight.publish(text)
+            await asyncio.sleep(0.01)
+        flight.finish()
+        return await reader
+
+    # Nothing waits ten seconds: three pending characters flush, and finishing flushes the rest
+    assert run(asyncio.wait_for(scenario(), timeout=5)) == ["a", "bcd", "efg"]
+
+
+def test_zero_interval_sends_every_delta():
+    async def scenario():
+        flight = StreamFlight()
+        reader = asyncio.create_task(_collect(flight))
+        for text in ("a", "b", "c"):
+            flight.publish(text)
+            await asyncio.sleep(0.01)
+        flight.finish()
+        return await reader
+
+    assert run(scenario()) == ["a", "b", "c"]
+
+
+def test_idle_stream_yields_heartbeats_and_errors_propagate():
+    async def scenario():
+        flight = StreamFlight()
+        seen = []
+
+        async def read():
+            async for batch in flight.iter_batches(idle_timeout=0.05):
+                seen.append(batch)
+
+        reader = asyncio.create_task(read())
+        await asyncio.sleep(0.18)
+        flight.publish("late")
+        await asyncio.sleep(0.01)
+        flight.finish(RuntimeError("CLI died"))
+        try:
+            await reader
+        except RuntimeError as e:
+            return seen, str(e)
+
+    seen, error = run(scenario())
+
+    assert seen[-1] == "late"
+    assert seen[:-1] == [None] * len(seen[:-1]) and len(seen) >= 3
+    assert error == "CLI died"
+
+
+def test_stream_sends_heartbeats_while_the_cli_is_quiet(monkeypatch):
+    monkeypatch.setenv("FAKE_CLAUDE_STARTUP_MS", "400")
+    monkeypatch.setenv("STREAM_HEARTBEAT_INTERVAL", "0.1")
+    monkeypatch.setenv("FAKE_CLAUDE_OUTPUT_BYTES", "400")
+    monkeypatch.setenv("FAKE_CLAUDE_CHUNK_BYTES", "4")
+    monkeypatch.setattr(main, "_drain_on_signal", lambda: None)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.lifespan(main.app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as http:
+                body = {"model": "gpt-4", "messages": [{"role": "user", "content": "hello"}], "stream": True}
+                return await http.post("/v1/chat/completions", json=body)
+
+    response = run(scenario())
+
+    frames = response.text.split("\n\n")
+    assert ": keep-alive" in frames
+    events = [frame[len("data: "):] for frame in frames if frame.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    content = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+    assert len(content) == 400
+    # 100 four-byte deltas arrive in far fewer frames
+    assert len(chunks) < 100
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from token_counter import MESSAGE_OVERHEAD, PROMPT_OVERHEAD, ApproxTokenCounter, create_token_counter
+
+
+def test_approximation_counts_words_digits_cjk_and_punctuation():
+    counter = ApproxTokenCounter()
+
+    assert counter.count("") == 0
+    assert counter.count("hello world") == 2
+    # Long words split into ~5-character subwords
+    assert counter.count("internationalization") == 4
+    # Digits group in threes, punctuation stands alone
+    assert counter.count("1234567!") == 4
+    # One token per CJK character
+    assert counter.count("日本語") == 3
+
+
+def test_count_messages_adds_prompt_and_turn_overhead():
+    counter = ApproxTokenCounter()
+    messages = [{"role": "user", "content": "hello world"}, {"role": "assistant", "content": "hi"}]
+
+    assert counter.count_messages(messages) == PROMPT_OVERHEAD + 2 * MESSAGE_OVERHEAD + 3
+    assert counter.count_messages([{"role": "user"}]) == PROMPT_OVERHEAD + MESSAGE_OVERHEAD
+
+
+def test_cache_keeps_only_digests_and_counts_and_evicts_least_recent():
+    counter = ApproxTokenCounter(cache_size=2)
+    long_message = "word " * 10000
+
+    counter.count_messages([{"content": long_message}, {"content": "second"}])
+    # Touch the long message so "second" is the least recently used
+    counter.count_messages([{"content": long_message}])
+    counter.count_messages([{"content": "third"}])
+    counter.count_messages([{"content": long_message}, {"content": "second"}])
+
+    assert counter.cache_info() == {"hits": 2, "misses": 4, "entries": 2}
+    for key, tokens in counter._counts.items():
+        assert isinstance(key, bytes) and len(key) == 16
+        assert isinstance(tokens, int)
+
+
+def test_create_token_counter_modes():
+    config = SimpleNamespace(TOKEN_COUNTER="approx", TOKEN_ENCODING="cl100k_base", TOKEN_COUNT_CACHE_SIZE=8)
+    assert create_token_counter(config).name == "approx"
+
+    config.TOKEN_COUNTER = "words"
+    with pytest.raises(RuntimeError, match="Unknown TOKEN_COUNTER"):
+        create_token_counter(config)
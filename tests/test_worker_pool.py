@@ -0,0 +1,58 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from scheduler import SchedulerRejected
+from worker_pool import ClaudeWorkerPool
+
+FAKE_CLAUDE = [sys.executable, str(Path(__file__).resolve().parents[1] / "benchmarks" / "fake_claude.py")]
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_checkout_gives_up_with_503_when_every_worker_is_busy(tmp_path):
+    async def scenario():
+        pool = ClaudeWorkerPool(FAKE_CLAUDE, tmp_path, "sonnet", min_size=0, max_size=1, checkout_timeout=0.2)
+        try:
+            busy = await pool.checkout("sonnet")
+            with pytest.raises(SchedulerRejected) as rejected:
+                await pool.checkout("sonnet")
+            # Nothing leaked: once the busy worker is back, the next checkout succeeds
+            await pool.checkin(busy)
+            worker = await asyncio.wait_for(pool.checkout("sonnet"), timeout=5)
+            served = await worker.run("hello")
+            await pool.checkin(worker)
+            return rejected.value, served
+        finally:
+            await pool.close()
+
+    rejected, served = run(scenario())
+
+    assert rejected.status_code == 503
+    assert rejected.retry_after >= 1
+    assert served["type"] == "result"
+
+
+def test_each_worker_serves_one_request_by_default(tmp_path):
+    async def scenario():
+        pool = ClaudeWorkerPool(FAKE_CLAUDE, tmp_path, "sonnet", min_size=1, max_size=2, max_requests=5)
+        try:
+            await pool.start()
+            pids = []
+            for _ in range(2):
+                async with pool.acquire("sonnet") as worker:
+                    pids.append(worker.process.pid)
+                    await worker.run("hello")
+            return pids, pool.max_requests
+        finally:
+            await pool.close()
+
+    pids, max_requests = run(scenario())
+
+    # Pre-spawned, not reused: without shared context every request gets a fresh process
+    assert max_requests == 1
+    assert pids[0] != pids[1]
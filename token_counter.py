@@ -0,0 +1,121 @@
+"""
+Token Counting
+Usage accounting with a BPE tokenizer when available and a fast approximation otherwise
+"""
+
+import re
+import logging
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Role prefix ("Human: ") and the blank line between turns of the CLI prompt
+MESSAGE_OVERHEAD = 3
+# Trailing "Assistant:" cue that ends every prompt
+PROMPT_OVERHEAD = 2
+
+# CJK/kana/hangul count one token per character; letters of any other script
+# form words; digits group in threes as BPE vocabularies do; any other
+# non-space character (punctuation, emoji) is a token of its own
+_PIECES = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+    r"|[^\W\d_]+"
+    r"|\d{1,3}"
+    r"|\S"
+)
+
+
+class TokenCounter:
+    """Counts tokens in text and in chat histories"""
+
+    name = "base"
+
+    def __init__(self, cache_size: int = 4096):
+        # Conversation history repeats verbatim from request to request, so
+        # per-message counts are memoized. Entries are keyed by a 16-byte
+        # digest of the content, so the cache holds integers, not messages
+        self._cache_size = max(1, cache_size)
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def _count_message(self, text: str) -> int:
+        key = blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        tokens = self._counts.get(key)
+        if tokens is not None:
+            self._hits += 1
+            self._counts.move_to_end(key)
+            return tokens
+        self._misses += 1
+        tokens = self._counts[key] = self.count(text)
+        if len(self._counts) > self._cache_size:
+            self._counts.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """Tokens in the prompt built from messages"""
+        total = PROMPT_OVERHEAD
+        for message in messages:
+            total += MESSAGE_OVERHEAD + self._count_message(str(message.get("content", "")))
+        return total
+
+    def cache_info(self) -> Dict[str, int]:
+        return {"hits": self._hits, "misses": self._misses, "entries": len(self._counts)}
+
+
+class ApproxTokenCounter(TokenCounter):
+    """Character-class approximation of BPE counts; no dependencies, one regex pass"""
+
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        tokens = 0
+        for piece in _PIECES.findall(text):
+            # Long words split into several subword tokens, ~5 characters each
+            tokens += (len(piece) + 4) // 5
+        return tokens
+
+
+class TiktokenCounter(TokenCounter):
+    """Exact BPE counts from tiktoken; the encoding is loaded once per process"""
+
+    name = "tiktoken"
+
+    def __init__(self, encoding: str = "cl100k_base", cache_size: int = 4096):
+        import tiktoken
+        self._encoding = tiktoken.get_encoding(encoding)
+        super().__init__(cache_size)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode_ordinary(text))
+
+
+def create_token_counter(config) -> TokenCounter:
+    """Build the counter described by Config; "auto" prefers tiktoken when installed"""
+    mode = config.TOKEN_COUNTER
+    if mode in ("auto", "tiktoken"):
+        try:
+            counter = TiktokenCounter(config.TOKEN_ENCODING, config.TOKEN_COUNT_CACHE_SIZE)
+        except ImportError:
+            if mode == "tiktoken":
+                raise RuntimeError("TOKEN_COUNTER=tiktoken requires the 'tiktoken' package: pip install tiktoken")
+            logger.info("Token counting with approximation (TOKEN_COUNTER=auto, tiktoken is not installed)")
+        except Exception as e:
+            if mode == "tiktoken":
+                raise
+            # Usually the encoding file: tiktoken downloads it on first use
+            logger.warning(
+                f"⚠️ Token counting with approximation (TOKEN_COUNTER=auto, "
+                f"tiktoken could not load {config.TOKEN_ENCODING}: {e})"
+            )
+        else:
+            logger.info(f"✅ Token counting with tiktoken ({config.TOKEN_ENCODING})")
+            return counter
+    elif mode != "approx":
+        raise RuntimeError(f"Unknown TOKEN_COUNTER: {mode}")
+    return ApproxTokenCounter(config.TOKEN_COUNT_CACHE_SIZE)
@@ -0,0 +1,24 @@
+"""
+Gunicorn Worker
+UvicornWorker that keeps connections open for the whole shutdown drain
+"""
+
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class DrainingUvicornWorker(UvicornWorker):
+    """Waits SHUTDOWN_DRAIN_TIMEOUT + SHUTDOWN_KILL_GRACE for open connections on shutdown
+
+    The stock worker does not pass a graceful shutdown timeout to uvicorn.
+    gunicorn's graceful_timeout (set a little longer in gunicorn.conf.py)
+    then SIGKILLs the worker before its CLI process groups are stopped.
+    """
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": int(
+            float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 30)) + float(os.getenv("SHUTDOWN_KILL_GRACE", 5))
+        ) + 2,
+    }
@@ -0,0 +1,374 @@
+"""
+Claude CLI Worker Pool
+Keeps warm Claude Code CLI processes driven over the stream-json stdin interface
+"""
+
+import asyncio
+import json
+import time
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from metrics import PROCESS_SPAWN
+from process_group import SPAWN_KWARGS, kill_group
+from scheduler import SchedulerRejected
+
+logger = logging.getLogger(__name__)
+
+# asyncio's default 64 KiB line limit is far below a long completion
+STREAM_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class ClaudeWorker:
+    """A single long-lived Claude CLI process for one model"""
+
+    def __init__(self, base_cmd: List[str], model: str, cwd: Path):
+        self.model = model
+        self.cmd = base_cmd + [
+            "--print",
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--verbose",
+            "--include-partial-messages",
+            "--model", model,
+        ]
+        self.cwd = cwd
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.created_at = time.monotonic()
+        self.requests_served = 0
+        self._stderr_tail: Deque[str] = deque(maxlen=20)
+        self._stderr_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Spawn the CLI process and start draining its stderr"""
+        started = time.perf_counter()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            limit=STREAM_LINE_LIMIT,
+            **SPAWN_KWARGS,
+        )
+        PROCESS_SPAWN.labels("pool").observe(time.perf_counter() - started)
+        self.created_at = time.monotonic()
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+        logger.debug(f"Spawned Claude worker pid={self.process.pid} model={self.model}")
+
+    async def _drain_stderr(self):
+        """Keep the stderr pipe empty, remembering only the last few lines"""
+        try:
+            async for line in self.process.stderr:
+                self._stderr_tail.append(line.decode("utf-8", errors="replace").rstrip())
+        except Exception:
+            pass
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
+    @property
+    def stderr_tail(self) -> str:
+        return "\n".join(self._stderr_tail)
+
+    async def stream(self, prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        """Send one user turn and yield CLI events up to and including the result"""
+        if not self.is_alive:
+            raise RuntimeError(f"Claude worker exited: {self.stderr_tail or 'no output'}")
+
+        message = {
+            "type": "user",
+            "message": {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
+            },
+        }
+        self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self.process.stdin.drain()
+        self.requests_served += 1
+
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                await self.process.wait()
+                raise RuntimeError(
+                    f"Claude worker exited (code {self.process.returncode}): {self.stderr_tail}"
+                )
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug(f"Skipping non-JSON worker output: {line[:200]!r}")
+                continue
+            yield event
+            if event.get("type") == "result":
+                return
+
+    async def run(self, prompt: str) -> Dict[str, Any]:
+        """Send one user turn and wait for the CLI's result event"""
+        result: Dict[str, Any] = {}
+        async for event in self.stream(prompt):
+            result = event
+        return result
+
+    async def close(self, timeout: float = 5.0):
+        """Close stdin and give the CLI a moment to exit before killing it
+
+        A timeout of 0 kills the process group straight away, for workers
+        abandoned mid-turn whose output nobody will read.
+        """
+        if self.process is None:
+            return
+        if self.process.returncode is None and timeout <= 0:
+            await kill_group(self.process)
+        elif self.process.returncode is None:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), timeout=timeout)
+            except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError):
+                await kill_group(self.process)
+        if self._stderr_task:
+            self._stderr_task.cancel()
+
+
+class ClaudeWorkerPool:
+    """Checkout/checkin pool of warm Claude CLI workers keyed by model
+
+    Workers share conversation state across the turns they serve, so each
+    worker serves one request unless allow_shared_context is set. Start-up
+    is hidden only for models with a warm spare: min_size spares are kept
+    for the default model and for every model requested within max_age,
+    as far as max_size allows. A request for a model without a spare pays
+    for a cold spawn.
+    """
+
+    def __init__(
+        self,
+        base_cmd: List[str],
+        cwd: Path,
+        default_model: str,
+        min_size: int = 1,
+        max_size: int = 4,
+        max_requests: int = 1,
+        max_age: float = 300.0,
+        allow_shared_context: bool = False,
+        checkout_timeout: Optional[float] = None,
+    ):
+        self.base_cmd = base_cmd
+        self.cwd = cwd
+        self.default_model = default_model
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.max_requests = max(1, max_requests)
+        if self.max_requests > 1 and not allow_shared_context:
+            logger.warning(
+                f"⚠️ CLAUDE_POOL_MAX_REQUESTS={max_requests} ignored: workers would carry one client's "
+                f"conversation into the next; set CLAUDE_POOL_UNSAFE_SHARED_CONTEXT=true to allow it"
+            )
+            self.max_requests = 1
+        self.max_age = max_age
+        # How long checkout waits for a busy pool before giving up with a 503
+        self.checkout_timeout = checkout_timeout
+
+        self._idle: Dict[str, Deque[ClaudeWorker]] = {}
+        self._busy: set = set()
+        self._spawning = 0
+        # model -> spares being spawned by _replenish
+        self._warming: Dict[str, int] = {}
+        self._cond = asyncio.Condition()
+        self._closed = False
+        self._background: set = set()
+        # model -> last request time, least recently requested first
+        self._requested: "OrderedDict[str, float]" = OrderedDict()
+
+        self.spawned_total = 0
+        self.recycled_total = 0
+
+    @property
+    def size(self) -> int:
+        idle = sum(len(q) for q in self._idle.values())
+        return idle + len(self._busy) + self._spawning
+
+    def _is_stale(self, worker: ClaudeWorker) -> bool:
+        return (
+            not worker.is_alive
+            or worker.requests_served >= self.max_requests
+            or worker.age >= self.max_age
+        )
+
+    async def _spawn(self, model: str) -> ClaudeWorker:
+        worker = ClaudeWorker(self.base_cmd, model, self.cwd)
+        await worker.start()
+        self.spawned_total += 1
+        return worker
+
+    def _warm_models(self) -> List[str]:
+        """Models to keep spares for, most recently requested first"""
+        cutoff = time.monotonic() - self.max_age
+        while self._requested and next(iter(self._requested.values())) < cutoff:
+            self._requested.popitem(last=False)
+        models = [m for m in reversed(self._requested) if m != self.default_model]
+        return [self.default_model] + models
+
+    def _note_request(self, model: str):
+        self._requested[model] = time.monotonic()
+        self._requested.move_to_end(model)
+
+    async def start(self):
+        """Pre-warm min_size workers for the default model"""
+        await self._replenish()
+        logger.info(
+            f"✅ Claude worker pool ready: min={self.min_size}, max={self.max_size}, "
+            f"max_requests={self.max_requests}, max_age={self.max_age}s"
+        )
+
+    async def _replenish(self):
+        """Top each warm model's idle queue back up to min_size, within max_size"""
+        async with self._cond:
+            if self._closed:
+                return
+            wanted: List[str] = []
+            room = self.max_size - self.size
+            for model in self._warm_models():
+                missing = self.min_size - len(self._idle.get(model, ())) - self._warming.get(model, 0)
+                for _ in range(max(0, min(missing, room - len(wanted)))):
+                    wanted.append(model)
+            if not wanted:
+                return
+            self._spawning += len(wanted)
+            for model in wanted:
+                self._warming[model] = self._warming.get(model, 0) + 1
+
+        for model in wanted:
+            try:
+                worker = await self._spawn(model)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to pre-warm Claude worker for {model}: {e}")
+                worker = None
+            async with self._cond:
+                self._spawning -= 1
+                self._warming[model] -= 1
+                if worker is not None:
+                    self._idle.setdefault(model, deque()).append(worker)
+                self._cond.notify_all()
+
+    def _schedule_replenish(self):
+        task = asyncio.create_task(self._replenish())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _retire(self, worker: ClaudeWorker, graceful: bool = True):
+        self.recycled_total += 1
+        task = asyncio.create_task(worker.close() if graceful else worker.close(timeout=0))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def checkout(self, model: str) -> ClaudeWorker:
+        """Take an idle worker for model, spawning or waiting when none is free
+
+        Waiting is bounded by checkout_timeout; past it SchedulerRejected
+        (503) is raised, as when the scheduler's own queue times out.
+        """
+        deadline = time.monotonic() + self.checkout_timeout if self.checkout_timeout is not None else None
+        async with self._cond:
+            self._note_request(model)
+            while True:
+                if self._closed:
+                    raise RuntimeError("Claude worker pool is closed")
+
+                queue = self._idle.get(model)
+                while queue:
+                    worker = queue.popleft()
+                    if self._is_stale(worker):
+                        self._retire(worker)
+                        continue
+                    self._busy.add(worker)
+                    return worker
+
+                if self.size >= self.max_size:
+                    # Free a slot held by an idle worker for the least recently requested other model
+                    for other_model in reversed(self._warm_models() + list(self._idle)):
+                        other_queue = self._idle.get(other_model)
+                        if other_model != model and other_queue:
+                            self._retire(other_queue.popleft())
+                            break
+
+                if self.size < self.max_size:
+                    self._spawning += 1
+                    break
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    raise SchedulerRejected(
+                        f"No Claude worker for {model} became free within {self.checkout_timeout}s",
+                        status_code=503,
+                        retry_after=max(1, round(self.checkout_timeout)),
+                    )
+
+        try:
+            worker = await self._spawn(model)
+        except Exception:
+            async with self._cond:
+                self._spawning -= 1
+                self._cond.notify_all()
+            raise
+
+        async with self._cond:
+            self._spawning -= 1
+            self._busy.add(worker)
+        return worker
+
+    async def checkin(self, worker: ClaudeWorker, healthy: bool = True):
+        """Return a worker to the pool, recycling it when spent or broken"""
+        async with self._cond:
+            self._busy.discard(worker)
+            if not healthy:
+                self._retire(worker, graceful=False)
+            elif self._closed or self._is_stale(worker):
+                self._retire(worker)
+            else:
+                self._idle.setdefault(worker.model, deque()).append(worker)
+            self._cond.notify_all()
+        self._schedule_replenish()
+
+    @asynccontextmanager
+    async def acquire(self, model: str) -> AsyncIterator[ClaudeWorker]:
+        """Checkout a worker for the duration of one request"""
+        worker = await self.checkout(model)
+        healthy = False
+        try:
+            yield worker
+            healthy = True
+        finally:
+            await self.checkin(worker, healthy=healthy)
+
+    async def close(self):
+        """Stop every worker, idle or busy"""
+        async with self._cond:
+            self._closed = True
+            workers = [w for q in self._idle.values() for w in q] + list(self._busy)
+            self._idle.clear()
+            self._busy.clear()
+            self._cond.notify_all()
+        await asyncio.gather(*(w.close() for w in workers), return_exceptions=True)
+        await asyncio.gather(*self._background, return_exceptions=True)
+        logger.info(f"🛑 Claude worker pool closed ({len(workers)} workers stopped)")
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of pool occupancy for health and metrics"""
+        return {
+            "size": self.size,
+            "idle": sum(len(q) for q in self._idle.values()),
+            "busy": len(self._busy),
+            "spawned_total": self.spawned_total,
+            "recycled_total": self.recycled_total,
+        }